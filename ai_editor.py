@@ -1,10 +1,19 @@
 import argparse
+import collections
 import curses
+import queue
 import sys
+import threading
+import time
 import wcwidth
 import locale
 from utils import save_text, display_welcomepage, save_buffer
-from copilot import TogetherCopilot, get_copilot
+from copilot import TogetherCopilot, get_copilot, get_provider, provider_modules, supported_models
+from logger import INFO, WARNING, print_to_log, setup_logging
+from cache import CompletionCache
+from run import configure_clients
+from scheduler import scheduler
+import copilot as copilot_module
 # from editor import Buffer, Cursor, Window, char_width, left, right, Editor
 from editor import Editor
 
@@ -19,18 +28,270 @@ def add_end_token(editor):
     end_token = "</user>\n"
     editor.insert(end_token)
 
-def copilot(editor, copilot):
-    response = copilot(editor.buffer.prefix(editor.cursor), editor.buffer.suffix(editor.cursor))
+def insert_draft(editor, response):
     editor.draft_len = len(response)  # Update the draft_len attribute of the editor object
     editor.keep_draft = True  # Update the keep_draft attribute of the editor object
     editor.insert(response)
 
+
+def extend_draft(editor, piece):
+    editor.draft_len += len(piece)
+    editor.keep_draft = True
+    editor.insert(piece)
+
+
+def insert_drafts(editor, candidates):
+    # insert the first candidate; the others wait in the ring for cycle_draft
+    editor.drafts = candidates
+    editor.draft_index = 0
+    insert_draft(editor, candidates[0])
+
+
+def delete_draft(editor, max_deletions=None):
+    # delete the draft before the cursor, or at most max_deletions characters of it
+    count = editor.draft_len if max_deletions is None else min(editor.draft_len, max_deletions)
+    editor.delete_before(count)
+    editor.draft_len -= count
+
+
+def cycle_draft(editor):
+    """
+    replace the draft with the next candidate of the same completion; no request is made.
+    nothing happens once the draft has been accepted by typing past it.
+    """
+    if editor.draft_len <= 0 or len(editor.drafts) < 2:
+        return
+    delete_draft(editor)
+    editor.draft_index = (editor.draft_index + 1) % len(editor.drafts)
+    insert_draft(editor, editor.drafts[editor.draft_index])
+
+
+class PendingRequest:
+    """
+    a completion on its way: the scheduler ticket running it, the editor state it was made for,
+    and, when streaming, the queue of pieces received so far.
+    """
+    def __init__(self, ticket, editor, pieces=None, deadline=None):
+        self.ticket = ticket
+        self.pieces = pieces
+        self.deadline = deadline
+        self.cancelled = threading.Event()
+        self.inserted = 0
+        self.mark(editor)
+
+    def mark(self, editor):
+        self.state = (editor.buffer.version, editor.cursor.row, editor.cursor.col)
+
+    def is_stale(self, editor):
+        return self.state != (editor.buffer.version, editor.cursor.row, editor.cursor.col)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.ticket.cancel()
+
+
+class AsyncCopilot:
+    """
+    runs copilot requests on the shared request scheduler so the editor keeps reading keys while
+    the provider answers. the context is read on the editor thread; only the network call is deferred.
+    a response is inserted as a draft by poll() if the buffer and cursor have not changed since
+    the request, and discarded otherwise. a request still unanswered after `timeout` seconds is dropped.
+    with stream=True, pieces are inserted as they arrive and the draft grows until the stream ends;
+    the timeout then applies to the first piece.
+    """
+    def __init__(self, copilot, stream=False, timeout=10.0):
+        self.copilot = copilot
+        self.stream = stream
+        self.timeout = timeout
+        self.pending = None
+
+    def cancel(self):
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+
+    def request(self, editor):
+        self.cancel()
+        editor.drafts = []
+        context = self.copilot.context(editor.buffer, editor.cursor)
+        if self.stream:
+            pending = PendingRequest(None, editor, queue.Queue(), time.monotonic() + self.timeout)
+            pending.ticket = scheduler.submit(self._stream, context, pending)
+            self.pending = pending
+        else:
+            self.pending = PendingRequest(scheduler.submit(self.copilot.candidates, timeout=self.timeout,
+                                                           **context), editor)
+
+    def _stream(self, context, pending):
+        t0 = time.monotonic()
+        first = None
+        pieces = self.copilot.stream(**context)
+        try:
+            for piece in pieces:
+                if pending.cancelled.is_set():
+                    print_to_log("stream cancelled")
+                    break
+                if first is None:
+                    first = time.monotonic()
+                    print_to_log("time to first token: %.3fs", first - t0, level=INFO)
+                pending.pieces.put(piece)
+        finally:
+            pieces.close()
+            print_to_log("total latency: %.3fs", time.monotonic() - t0, level=INFO)
+
+    def poll(self, editor):
+        pending = self.pending
+        if pending is None:
+            return
+        if pending.pieces is not None:
+            return self._poll_stream(editor, pending)
+        if not pending.ticket.done():
+            return
+        self.pending = None
+        result = pending.ticket.result()
+        print_to_log("latency: %.3fs (%s)", result.latency, result.status, level=INFO)
+        if not result.ok:
+            print_to_log("copilot request failed: %s", result, level=WARNING)
+            return
+        if pending.is_stale(editor):
+            print_to_log("discarding stale response: %s", result.value)
+            return
+        candidates = [response for response in result.value if response]
+        if not candidates:
+            return
+        insert_drafts(editor, candidates)
+        return True
+
+    def _poll_stream(self, editor, pending):
+        inserted = False
+        while True:
+            try:
+                piece = pending.pieces.get_nowait()
+            except queue.Empty:
+                break
+            if pending.is_stale(editor):
+                print_to_log("buffer changed, cancelling stream")
+                self.cancel()
+                return inserted
+            if pending.inserted == 0:
+                insert_draft(editor, piece)
+            else:
+                extend_draft(editor, piece)
+            pending.inserted += len(piece)
+            pending.mark(editor)
+            inserted = True
+        if pending.inserted == 0 and time.monotonic() > pending.deadline:
+            print_to_log("stream timed out before the first token", level=WARNING)
+            self.cancel()
+        elif pending.ticket.future.done() and pending.pieces.empty():
+            self.pending = None
+            result = pending.ticket.result()
+            if not result.ok:
+                print_to_log("copilot request failed: %s", result, level=WARNING)
+        return inserted
+
+    def follow(self, ticket, editor):
+        # wait for a request started elsewhere (a prefetch) as if Tab had started it now
+        self.cancel()
+        self.pending = PendingRequest(ticket, editor)
+
+
+class Prefetcher:
+    """
+    speculatively requests a completion once the user has stopped typing for idle_ms.
+    Tab then uses the prefetched response if the prefix is unchanged, or if the user has typed
+    the beginning of it: the rest of the suggestion is inserted without a new request.
+
+    a prefetch is identified by the document offset of the cursor and the text just before it,
+    so checking a hit only reads the tail of the buffer.
+    """
+    tail_len = 64
+
+    def __init__(self, copilot, idle_ms=500, max_inflight=1, per_minute=20, timeout=10.0):
+        self.copilot = copilot
+        self.idle_ms = idle_ms
+        self.max_inflight = max_inflight
+        self.per_minute = per_minute
+        self.timeout = timeout
+        self.last_key = time.monotonic()
+        self.inflight = []
+        self.sent = collections.deque()  # send times within the last minute
+        self.current = None  # (ticket, buffer version, cursor offset, text before the cursor)
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "wasted": 0}
+
+    def touch(self, editor):
+        self.last_key = time.monotonic()
+
+    def maybe_prefetch(self, editor):
+        now = time.monotonic()
+        if (now - self.last_key) * 1000 < self.idle_ms:
+            return
+        if self.current is not None and self.current[1:3] == (editor.buffer.version, editor.buffer.offset(editor.cursor)):
+            return  # already prefetched for this text and cursor
+        self.inflight = [ticket for ticket in self.inflight if not ticket.done()]
+        while self.sent and now - self.sent[0] > 60:
+            self.sent.popleft()
+        if len(self.inflight) >= self.max_inflight or len(self.sent) >= self.per_minute:
+            return
+        self.discard()
+        context = self.copilot.context(editor.buffer, editor.cursor)
+        ticket = scheduler.submit(self.copilot.candidates, timeout=self.timeout, **context)
+        self.inflight.append(ticket)
+        self.sent.append(now)
+        self.stats["requests"] += 1
+        self.current = (ticket, editor.buffer.version, editor.buffer.offset(editor.cursor),
+                        editor.buffer.tail(editor.cursor, self.tail_len))
+
+    def discard(self):
+        if self.current is not None:
+            self.stats["wasted"] += 1
+            self.current[0].cancel()
+            self.current = None
+
+    def take(self, editor, worker):
+        """
+        serve Tab from the prefetch if it matches. returns False if Tab needs a new request.
+        """
+        hit = self._take(editor, worker)
+        self.stats["hits" if hit else "misses"] += 1
+        tabs = self.stats["hits"] + self.stats["misses"]
+        print_to_log("prefetch: hit rate %d/%d, requests %d, wasted %d", self.stats["hits"], tabs,
+                     self.stats["requests"], self.stats["wasted"], level=INFO)
+        return hit
+
+    def _take(self, editor, worker):
+        if self.current is None:
+            return False
+        ticket, version, offset, tail = self.current
+        if not ticket.done():
+            if (version, offset) != (editor.buffer.version, editor.buffer.offset(editor.cursor)):
+                # the text or the cursor moved since: the response would land in the wrong place
+                self.discard()
+                return False
+            # same text and cursor, response still on its way
+            self.current = None
+            worker.follow(ticket, editor)
+            return True
+        result = ticket.result()
+        if not result.ok:
+            return False
+        typed = editor.buffer.offset(editor.cursor) - offset
+        if typed < 0:
+            return False
+        # the candidates whose beginning the user has typed, minus that beginning
+        before = editor.buffer.tail(editor.cursor, len(tail) + typed)
+        candidates = [response[typed:] for response in result.value
+                      if typed < len(response) and before == tail + response[:typed]]
+        if not candidates:
+            return False
+        self.current = None
+        insert_drafts(editor, candidates)
+        return True
+
+
 def remove_completion(editor, max_deletions=15):
     if editor.draft_len > 0:  # Access the draft_len attribute of the editor object
-        for _ in range(min(editor.draft_len, max_deletions)):
-            editor.left()
-            editor.buffer.delete(editor.cursor)
-            editor.draft_len -= 1
+        delete_draft(editor, max_deletions)
         editor.keep_draft = True
 
 def decrease_draft_len(editor):
@@ -50,13 +311,58 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("filename", nargs='?', default="")
     # add arguments --model --provider --sliding_window(default -1)
-    parser.add_argument("--model", type=str, default="Qwen/Qwen2-72B-Instruct")
+    parser.add_argument("--model", type=str, default="Qwen/Qwen2-72B-Instruct",
+                        help=f"one of {', '.join(supported_models())}, or any model served at --base_url")
     # parser.add_argument("--model_type", type=str, default="chat")
     parser.add_argument("--sliding_window", type=int, default=-1)
     parser.add_argument("--provider", type=str, default=None)
     parser.add_argument('--system_prompt', type=str, default="")
     parser.add_argument('--fill_len', type=int, default=7)
+    # prompt budget in tokens, trimmed at paragraphs keeping <user> turns (0: provider default, -1: no limit)
+    parser.add_argument("--context_tokens", type=int, default=0)
+    # heal Chinese tokens split by the cursor (Together models)
+    parser.add_argument("--token_healing", action="store_true", default=False)
+    # an OpenAI-compatible endpoint serving --model, e.g. a local server or mock_server.py
+    parser.add_argument("--base_url", type=str, default=None)
+    # send earlier chapters as rolling summaries and only the last N characters as they are (0: off)
+    parser.add_argument("--summary_window", type=int, default=0)
+    parser.add_argument("--summary_cache", type=str, default=None, help="json file keeping the summaries")
+    # add this many earlier paragraphs related to the one being written to the prompt
+    parser.add_argument("--retrieve", type=int, default=0)
+    # lay the prompt out for prefix caching, the older text in blocks of N characters (0: off)
+    parser.add_argument("--prompt_chunk", type=int, default=0)
+    # with --prompt_chunk, keep the stable turns as Gemini cached content for N seconds (0: off)
+    parser.add_argument("--gemini_cache_ttl", type=int, default=0)
+    parser.add_argument("--gemini_cache_min_tokens", type=int, default=32768)
     parser.add_argument("--auto-save", action="store_true", default=False)
+    # how long (ms) to wait for a key before checking for copilot responses
+    parser.add_argument("--input_timeout", type=int, default=50)
+    # insert completions token by token as they arrive
+    parser.add_argument("--stream", action="store_true", default=False)
+    # alternative completions fetched per Tab, cycled with ctrl + f (not with --stream)
+    parser.add_argument("--candidates", type=int, default=1)
+    # prefetch a completion after this many ms without typing (0: off)
+    parser.add_argument("--prefetch_ms", type=int, default=0)
+    parser.add_argument("--prefetch_max_inflight", type=int, default=1)
+    parser.add_argument("--prefetch_per_minute", type=int, default=20)
+    # completion cache: entries (0: off), max age in seconds, responses kept per prompt (--candidates
+    # fills them), sqlite file
+    parser.add_argument("--cache_size", type=int, default=256)
+    parser.add_argument("--cache_ttl", type=float, default=3600)
+    parser.add_argument("--cache_samples", type=int, default=3)
+    parser.add_argument("--cache_db", type=str, default=None)
+    # shared API clients: connection pool size and per-request timeout (seconds)
+    parser.add_argument("--pool_size", type=int, default=10)
+    parser.add_argument("--request_timeout", type=float, default=30.0)
+    # background log: file, level, characters kept of long prompts (0: all), rotation size and count
+    parser.add_argument("--log_file", type=str, default="log.txt")
+    parser.add_argument("--log_level", type=str, default="DEBUG",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--log_max_chars", type=int, default=1000)
+    parser.add_argument("--log_max_bytes", type=int, default=5 * 1024 * 1024)
+    parser.add_argument("--log_backups", type=int, default=3)
+    # print an import-time breakdown of startup and of the provider's first request, then exit
+    parser.add_argument("--profile-startup", action="store_true", default=False)
     return parser.parse_args()
 
 def get_system_prompt(system_prompt):
@@ -71,13 +377,61 @@ def get_system_prompt(system_prompt):
 
 def main(stdscr):
     args = parse_args()
+    setup_logging(args.log_file, level=args.log_level, max_chars=args.log_max_chars,
+                  max_bytes=args.log_max_bytes, backup_count=args.log_backups)
     system_prompt = get_system_prompt(args.system_prompt)
+    configure_clients(max_connections=args.pool_size, max_keepalive_connections=args.pool_size,
+                      timeout=args.request_timeout)
+    cache = None
+    if args.cache_size > 0:
+        cache = CompletionCache(max_entries=args.cache_size, max_age=args.cache_ttl,
+                                samples=args.cache_samples, path=args.cache_db)
     # copilot_instance = TogetherCopilot(model="Qwen/Qwen2-72B-Instruct", model_type="chat", sliding_window=500)
     copilot_instance = get_copilot(model = args.model, 
                                     provider = args.provider, 
                                     sliding_window = args.sliding_window,
                                     system_prompt = system_prompt,
-                                    fill_len = args.fill_len)
+                                    fill_len = args.fill_len,
+                                    cache = cache,
+                                    token_healing = args.token_healing,
+                                    context_tokens = args.context_tokens,
+                                    n_candidates = args.candidates,
+                                    base_url = args.base_url,
+                                    summary_window = args.summary_window,
+                                    summary_path = args.summary_cache,
+                                    retrieval_k = args.retrieve,
+                                    stable_chunk = args.prompt_chunk,
+                                    context_cache_ttl = args.gemini_cache_ttl,
+                                    context_cache_min_tokens = args.gemini_cache_min_tokens)
+    copilot_module.request_timeout = args.request_timeout
+    copilot_worker = AsyncCopilot(copilot_instance, stream=args.stream, timeout=args.request_timeout)
+    prefetcher = None
+    if args.prefetch_ms > 0:
+        prefetcher = Prefetcher(copilot_instance, idle_ms=args.prefetch_ms,
+                                max_inflight=args.prefetch_max_inflight,
+                                per_minute=args.prefetch_per_minute,
+                                timeout=args.request_timeout)
+
+    def invoke_copilot(editor):
+        if prefetcher is None or not prefetcher.take(editor, copilot_worker):
+            copilot_worker.request(editor)
+
+    def after_keypress(editor):
+        update_draft_len(editor)
+        if prefetcher is not None:
+            prefetcher.touch(editor)
+
+    def cancel_and_remove_completion(editor):
+        copilot_worker.cancel()
+        remove_completion(editor)
+
+    def on_idle(editor):
+        inserted = copilot_worker.poll(editor)
+        if prefetcher is not None:
+            if inserted:
+                prefetcher.touch(editor)
+            elif copilot_worker.pending is None:
+                prefetcher.maybe_prefetch(editor)
 
     keypresses_list = [
         {
@@ -92,12 +446,17 @@ def main(stdscr):
         },
         {
             "key": ["\t"],  # tab for copilot
-            "func": lambda editor: copilot(editor, copilot_instance),
+            "func": invoke_copilot,
             "description": "Invoke Copilot"
         },
+        {
+            "key": ["\x06"],  # ctrl + f
+            "func": cycle_draft,
+            "description": "Next candidate"
+        },
         {
             "key": ["\x01"],  # ctrl + a
-            "func": remove_completion,
+            "func": cancel_and_remove_completion,
             "description": "Remove completion"
         },
         # decrease draft_len when delete is pressed
@@ -109,12 +468,68 @@ def main(stdscr):
     ]
     
     editor = Editor(stdscr, args.filename, keypresses_list, 
-                    func_after_keypress=update_draft_len,
+                    func_after_keypress=after_keypress,
                     func_before_keypress=set_keep_draft,
-                    auto_save=args.auto_save)
+                    auto_save=args.auto_save,
+                    func_on_idle=on_idle,
+                    input_timeout=args.input_timeout)
     editor.draft_len = 0  # Add a draft_len attribute to the editor object
     editor.keep_draft = False  # Add a keep_draft attribute to the editor object
+    editor.drafts = []  # candidates of the last completion, see cycle_draft
+    editor.draft_index = 0
     editor.run()
 
+def profile_startup(model, top=12):
+    """
+    import the editor in a fresh interpreter with -X importtime and print the slowest imports:
+    first those paid before the welcome page, then the provider SDK paid on the first request.
+    """
+    import os
+    import subprocess
+    try:
+        provider = get_provider(model)
+    except ValueError:
+        provider = "together"
+    code = ("import ai_editor\n"
+            f"for name in {provider_modules[provider]!r}:\n"
+            "    try:\n"
+            "        __import__(name)\n"
+            "    except ImportError as e:\n"
+            "        print(f'{name}: not installed ({e})')\n")
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=here,
+                         capture_output=True, text=True)
+    print(out.stdout, end="")
+
+    # each line: "import time: self [us] | cumulative | <2 spaces per nesting level>name".
+    # a module's own imports are listed before it, one level deeper
+    children, startup, first_request = [], [], []
+    startup_ms = 0.0
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entry = (int(parts[1]) / 1000, name.strip())
+        if depth == 1:
+            children.append(entry)
+        elif depth == 0:
+            if entry[1] == "ai_editor":
+                startup_ms, startup = entry[0], children
+            elif startup:
+                first_request.append(entry)
+            children = []
+    sections = [("startup, before the welcome page", startup_ms, startup),
+                (f"first {provider} request", sum(ms for ms, _ in first_request), first_request)]
+    for title, total, imports in sections:
+        print(f"{title}: {total:.1f} ms")
+        for ms, name in sorted(imports, reverse=True)[:top]:
+            print(f"{ms:9.1f} ms  {name}")
+
 if __name__ == "__main__":
-    curses.wrapper(main)
+    args = parse_args()
+    if args.profile_startup:
+        profile_startup(args.model)
+    else:
+        curses.wrapper(main)
@@ -0,0 +1,299 @@
+"""
+async completion backends under the copilots.
+
+every provider is reached through the same protocol:
+
+    await backend.complete(prompt, max_tokens, temperature, stop, n, request_id)
+    async for piece in backend.stream(prompt, max_tokens, temperature, stop, request_id): ...
+    backend.cancel(request_id)
+
+the prompt is whatever the provider takes: text for the completion endpoints, chat turns for
+Gemini (see GeminiCopilot.prepare). a request given a request_id can be cancelled from any
+thread while it runs; its task is cancelled, which also closes the HTTP stream of a streamed one.
+
+run_sync and iter_sync drive a backend from synchronous code (the request scheduler's workers)
+on one background event loop, so the connection pools of the async clients are shared.
+
+asyncio is imported on first use; importing this module stays cheap for the editor's startup.
+"""
+import datetime
+import itertools
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+
+from cache import cache_key
+from logger import WARNING, print_to_log
+from run import get_client
+
+# ids for callers that need one to cancel their request later
+request_ids = itertools.count(1)
+
+
+class Backend(ABC):
+
+    def __init__(self):
+        self._inflight = {}  # request id -> task running it
+        self._cancelled = set()
+
+    @asynccontextmanager
+    async def _track(self, request_id):
+        if request_id is None:
+            yield
+            return
+        import asyncio
+        self._inflight[request_id] = asyncio.current_task()
+        try:
+            yield
+        finally:
+            self._inflight.pop(request_id, None)
+            self._cancelled.discard(request_id)
+
+    async def complete(self, prompt, max_tokens: int, temperature: float = 0.6, stop=None, n: int = 1,
+                       request_id=None):
+        """
+        the completion text, or with n > 1, a list of n alternatives.
+        """
+        async with self._track(request_id):
+            return await self._complete(prompt, max_tokens, temperature, stop, n)
+
+    async def stream(self, prompt, max_tokens: int, temperature: float = 0.6, stop=None, request_id=None):
+        """
+        yield the completion piece by piece as it arrives.
+        """
+        async with self._track(request_id):
+            async for piece in self._stream(prompt, max_tokens, temperature, stop):
+                yield piece
+                if request_id is not None:
+                    self._resume(request_id)
+
+    def _resume(self, request_id):
+        # a stream driven piece by piece (see iter_sync) resumes in a new task after each piece,
+        # and one cancelled while waiting for its consumer stops here
+        import asyncio
+        if request_id in self._cancelled:
+            raise asyncio.CancelledError
+        self._inflight[request_id] = asyncio.current_task()
+
+    def cancel(self, request_id) -> bool:
+        """
+        cancel the running request. false if it is not running (finished or never started).
+        """
+        task = self._inflight.get(request_id)
+        if task is None:
+            return False
+        self._cancelled.add(request_id)
+        task.get_loop().call_soon_threadsafe(task.cancel)
+        return True
+
+    @abstractmethod
+    async def _complete(self, prompt, max_tokens, temperature, stop, n):
+        pass
+
+    @abstractmethod
+    def _stream(self, prompt, max_tokens, temperature, stop):
+        # an async generator of text pieces
+        pass
+
+
+async def _aclose(stream):
+    # stop reading an SDK's HTTP stream; some close() methods are coroutines
+    close = getattr(stream, "close", None)
+    if close is not None:
+        closed = close()
+        if hasattr(closed, "__await__"):
+            await closed
+
+
+class OpenAIBackend(Backend):
+    """
+    any server with the OpenAI completions API: Together's OpenAI endpoint by default,
+    or vLLM, llama.cpp, mock_server.py... at base_url.
+    """
+
+    client_kind = "async_openai"
+
+    def __init__(self, model: str, base_url: str = None):
+        super().__init__()
+        self.model = model
+        self.base_url = base_url
+
+    @property
+    def client(self):
+        return get_client(self.client_kind, self.base_url)
+
+    async def _complete(self, prompt, max_tokens, temperature, stop, n):
+        options = {"n": n} if n > 1 else {}
+        response = await self.client.completions.create(model=self.model, prompt=prompt, max_tokens=max_tokens,
+                                                        temperature=temperature, stop=stop, **options)
+        if n > 1:
+            return [choice.text for choice in response.choices]
+        return response.choices[0].text
+
+    async def _stream(self, prompt, max_tokens, temperature, stop):
+        stream = await self.client.completions.create(model=self.model, prompt=prompt, max_tokens=max_tokens,
+                                                      temperature=temperature, stop=stop, stream=True)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].text:
+                    yield chunk.choices[0].text
+        finally:
+            await _aclose(stream)
+
+
+class TogetherBackend(OpenAIBackend):
+    # the same API through the Together SDK, which run.py's synchronous calls also use
+    client_kind = "async_together"
+
+
+_genai = None
+
+def load_genai():
+    # google.generativeai is slow to import, so it is loaded and configured on the first Gemini request
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
+        _genai = genai
+    return _genai
+
+
+class GeminiBackend(Backend):
+    """
+    Gemini chat models. the prompt is a list of chat turns; the system prompt is part of the model.
+    also has a synchronous generate, for the copilot's non-async calls.
+    """
+
+    def __init__(self, model: str, system_prompt: str = ""):
+        super().__init__()
+        self.model = model
+        self.system_prompt = system_prompt
+        self._gen_model = None
+        self._cached = None  # (key of the cached turns, model using them, cached content, expiry)
+        self._cache_lock = threading.Lock()
+
+    @property
+    def gen_model(self):
+        # built once per backend; the model object holds the gRPC/HTTP client it reuses
+        if self._gen_model is None:
+            if self.system_prompt:
+                self._gen_model = load_genai().GenerativeModel(self.model,
+                                                system_instruction=self.system_prompt)
+            else:
+                self._gen_model = load_genai().GenerativeModel(self.model)
+        return self._gen_model
+
+    def generation_options(self, max_output_tokens, temperature=0.5, candidate_count=1) -> dict:
+        return dict(safety_settings={'HARASSMENT':'block_none',
+                                     'SEXUALLY_EXPLICIT': 'block_none',
+                                     'HATE_SPEECH': 'block_none',
+                                     'DANGEROUS': 'block_none',
+                                     # 'CIVIC_INTEGRITY': 'block_none',
+                                     },
+                    generation_config=load_genai().types.GenerationConfig(
+                          candidate_count=candidate_count,
+                          # stop_sequences=['x'],
+                          max_output_tokens=max_output_tokens,
+                          temperature=temperature))
+
+    def cached_model(self, turns, ttl: float = 3600, min_tokens: int = 32768):
+        """
+        a model whose context starts with turns, registered as Gemini cached content and reused
+        while the turns stay the same, until a minute before it expires. None if the turns are
+        too short to cache or caching fails; the whole message is sent then.
+        """
+        from context import count_tokens
+        key = cache_key(self.model, self.system_prompt, list(turns))
+        with self._cache_lock:
+            if self._cached is not None and self._cached[0] == key and self._cached[3] > time.time() + 60:
+                return self._cached[1]
+            if sum(count_tokens(part) for turn in turns for part in turn["parts"]) < min_tokens:
+                return None
+            genai = load_genai()
+            try:
+                # cached content needs a versioned model name, like gemini-1.5-flash-002
+                content = genai.caching.CachedContent.create(
+                    model=f"models/{self.model}", system_instruction=self.system_prompt or None,
+                    contents=list(turns), ttl=datetime.timedelta(seconds=ttl))
+                model = genai.GenerativeModel.from_cached_content(content)
+            except Exception as e:
+                print_to_log("caching %d turns failed: %r", len(turns), e, level=WARNING)
+                return None
+            if self._cached is not None:
+                self._delete(self._cached[2])
+            self._cached = (key, model, content, time.time() + ttl)
+            return model
+
+    def _delete(self, content):
+        # the previous turns are not used again; they would be billed until they expire
+        try:
+            content.delete()
+        except Exception as e:
+            print_to_log("deleting cached content failed: %r", e, level=WARNING)
+
+    def generate(self, message, max_output_tokens, temperature=0.5, stream=False, candidate_count=1,
+                 model=None):
+        # model: one from cached_model, for the rest of the message
+        return (model or self.gen_model).generate_content(
+            message, stream=stream, **self.generation_options(max_output_tokens, temperature, candidate_count))
+
+    async def _complete(self, prompt, max_tokens, temperature, stop, n):
+        response = await self.gen_model.generate_content_async(
+            prompt, **self.generation_options(max_tokens, temperature, n))
+        if n > 1:
+            # response.text only works for a single candidate
+            return ["".join(part.text for part in candidate.content.parts) for candidate in response.candidates]
+        return response.text
+
+    async def _stream(self, prompt, max_tokens, temperature, stop):
+        response = await self.gen_model.generate_content_async(
+            prompt, stream=True, **self.generation_options(max_tokens, temperature))
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def event_loop():
+    # the background event loop run_sync and iter_sync submit to, started on first use
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            import asyncio
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="backends", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """
+    run a coroutine on the background loop and wait for its result. if the timeout passes
+    first, the coroutine is cancelled and TimeoutError raised.
+    """
+    import asyncio
+    future = asyncio.run_coroutine_threadsafe(coro, event_loop())
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+def iter_sync(pieces):
+    """
+    iterate an async generator from synchronous code. closing this generator closes it.
+    """
+    import asyncio
+    loop = event_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(pieces.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(pieces.aclose(), loop).result()
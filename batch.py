@@ -0,0 +1,157 @@
+"""
+headless batch continuation: a continuation for every manuscript in a directory, or for every
+chapter inside them, generated concurrently.
+
+    python batch.py drafts/ --model gemini-1.5-flash --system_prompt 起点 --fill_len 800
+    python batch.py 爱种田的邪神.txt --split_chapters --concurrency 8
+
+each result is written to its own file as soon as it is done (via a temporary file, so a crash
+never leaves half a result). running the same command again skips the results that exist.
+"""
+import argparse
+import asyncio
+import glob
+import os
+import random
+import time
+
+from copilot import get_copilot, supported_models
+from logger import INFO, WARNING, print_to_log, setup_logging
+from summaries import chapter_pattern, split_chapters
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_prompt(name: str) -> str:
+    if not name:
+        return ""
+    with open(os.path.join(here, "prompts", f"{name}.txt"), encoding="utf-8") as file:
+        return file.read()
+
+
+# .txt files of the editor itself, never manuscripts, in case the repo is given as a directory
+not_manuscripts = {"chinese_tokens.txt", "insertion_prompt.txt", "log.txt"}
+
+
+def find_manuscripts(paths, pattern: str = "*.txt") -> list:
+    # files given directly, or matching pattern (not recursively) in the given directories
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(name for name in glob.glob(os.path.join(glob.escape(path), pattern))
+                            if os.path.isfile(name) and os.path.basename(name) not in not_manuscripts)
+        else:
+            files.append(path)
+    return files
+
+
+def chapter_ends(text: str, pattern: str = chapter_pattern) -> list:
+    """
+    the end offset of each chapter. the text before the first heading is not a chapter of its
+    own; without headings the whole text is one chapter.
+    """
+    starts = split_chapters(text, pattern)
+    return starts[1:] + [len(text)]
+
+
+def units(files, out_dir, chapters=False, pattern=chapter_pattern) -> list:
+    """
+    (name, output path, text to continue) for each file or chapter. a chapter is continued
+    from the manuscript up to its end, so that the copilot's budget picks what it sees.
+    """
+    result = []
+    for path in files:
+        with open(path, encoding="utf-8") as file:
+            text = file.read()
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if not chapters:
+            result.append((stem, os.path.join(out_dir, f"{stem}.txt"), text))
+            continue
+        for i, end in enumerate(chapter_ends(text, pattern)):
+            result.append((f"{stem} #{i + 1}", os.path.join(out_dir, stem, f"{i + 1:03d}.txt"), text[:end]))
+    return result
+
+
+def write_result(path: str, text: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+async def continue_unit(copilot, unit, semaphore, retries, backoff, progress):
+    name, path, text = unit
+    async with semaphore:
+        t0 = time.monotonic()
+        for attempt in range(retries + 1):
+            try:
+                continuation = await copilot.acomplete(text)
+                break
+            except Exception as e:
+                if attempt == retries:
+                    print(f"{name}: failed after {attempt + 1} attempts: {e!r}")
+                    print_to_log("batch: %s failed: %r", name, e, level=WARNING)
+                    progress["failed"] += 1
+                    return
+                # exponential backoff with jitter, so retries of a rate limit do not arrive together
+                delay = backoff * 2 ** attempt * (0.5 + random.random())
+                print_to_log("batch: %s attempt %d failed (%r), retrying in %.1fs", name, attempt + 1, e, delay,
+                             level=INFO)
+                await asyncio.sleep(delay)
+    write_result(path, continuation)
+    progress["done"] += 1
+    print(f"[{progress['done'] + progress['failed']}/{progress['total']}] {name}: "
+          f"{len(continuation)} characters in {time.monotonic() - t0:.1f}s -> {path}")
+
+
+async def run_batch(copilot, todo, concurrency, retries, backoff):
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = {"done": 0, "failed": 0, "total": len(todo)}
+    await asyncio.gather(*(continue_unit(copilot, unit, semaphore, retries, backoff, progress)
+                           for unit in todo))
+    return progress
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="manuscripts (.txt) or directories of them")
+    parser.add_argument("--glob", type=str, default="*.txt", help="manuscripts in a directory")
+    parser.add_argument("--model", type=str, default="Qwen/Qwen2-72B-Instruct",
+                        help=f"one of {', '.join(supported_models())}, or any model served at --base_url")
+    parser.add_argument("--system_prompt", type=str, default="", help="name of a file in prompts/")
+    parser.add_argument("--fill_len", type=int, default=500)
+    parser.add_argument("--context_tokens", type=int, default=0)
+    parser.add_argument("--base_url", type=str, default=None, help="an OpenAI-compatible endpoint")
+    parser.add_argument("--out", type=str, default="continuations")
+    # one continuation per chapter heading matched by --chapter_pattern, instead of per file
+    parser.add_argument("--split_chapters", action="store_true", default=False)
+    parser.add_argument("--chapter_pattern", type=str, default=chapter_pattern)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=2.0, help="seconds before the first retry")
+    parser.add_argument("--overwrite", action="store_true", default=False)
+    parser.add_argument("--log_file", type=str, default="log.txt")
+    parser.add_argument("--log_level", type=str, default="INFO")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    setup_logging(args.log_file, level=args.log_level)
+    copilot = get_copilot(model=args.model, fill_len=args.fill_len, system_prompt=load_prompt(args.system_prompt),
+                          context_tokens=args.context_tokens, base_url=args.base_url)
+    todo = units(find_manuscripts(args.paths, args.glob), args.out, args.split_chapters, args.chapter_pattern)
+    if not args.overwrite:
+        skipped = [unit for unit in todo if os.path.exists(unit[1])]
+        todo = [unit for unit in todo if not os.path.exists(unit[1])]
+        if skipped:
+            print(f"skipping {len(skipped)} finished continuations")
+    progress = asyncio.run(run_batch(copilot, todo, args.concurrency, args.retries, args.backoff))
+    print(f"done: {progress['done']}, failed: {progress['failed']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+load test of the async backends against the local mock server (mock_server.py): no network,
+no API keys. needs the openai and httpx packages that the OpenAI-compatible backend uses.
+
+    completions   --requests requests at each concurrency, through OpenAIBackend.complete:
+                  throughput and latency percentiles
+    streams       time to first piece and total time of streamed requests
+    cancel        streams cancelled after their first piece; the server sees the disconnects
+
+usage:
+    python bench_backends.py --latency 0.2 --tokens_per_second 50 --max_tokens 32
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import mock_server
+from backends import OpenAIBackend, request_ids
+from run import configure_clients
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)]
+
+
+async def completions(backend, requests, concurrency, max_tokens):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            t0 = time.perf_counter()
+            await backend.complete(f"第{i}段：", max_tokens)
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - t0, latencies
+
+
+async def streams(backend, requests, max_tokens):
+    first, total = [], []
+
+    async def one(i):
+        t0 = time.perf_counter()
+        pieces = 0
+        async for _ in backend.stream(f"第{i}段：", max_tokens):
+            if pieces == 0:
+                first.append(time.perf_counter() - t0)
+            pieces += 1
+        total.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return first, total
+
+
+async def cancelled_streams(backend, requests, max_tokens):
+    # each stream is cancelled from another task once its first piece arrived
+    async def one(i):
+        request_id = next(request_ids)
+        pieces = 0
+        try:
+            async for _ in backend.stream(f"第{i}段：", max_tokens, request_id=request_id):
+                pieces += 1
+                if pieces == 1:
+                    asyncio.get_running_loop().call_soon(backend.cancel, request_id)
+        except asyncio.CancelledError:
+            pass
+        return pieces
+
+    return await asyncio.gather(*(one(i) for i in range(requests)), return_exceptions=True)
+
+
+async def run(args, server):
+    backend = OpenAIBackend("mock", server.base_url)
+    print(f"mock server: latency {args.latency}s, {args.tokens_per_second} tokens/s, {args.max_tokens} tokens")
+    ideal = args.latency + args.max_tokens / args.tokens_per_second
+    print(f"one request takes at least {ideal * 1e3:.0f} ms")
+    for concurrency in args.concurrency:
+        elapsed, latencies = await completions(backend, args.requests, concurrency, args.max_tokens)
+        print(f"concurrency {concurrency:>3}: {args.requests / elapsed:7.1f} req/s   "
+              f"p50 {statistics.median(latencies) * 1e3:7.1f} ms   p95 {percentile(latencies, 95) * 1e3:7.1f} ms")
+
+    first, total = await streams(backend, min(args.requests, 20), args.max_tokens)
+    print(f"streams: first piece p50 {statistics.median(first) * 1e3:7.1f} ms   "
+          f"total p50 {statistics.median(total) * 1e3:7.1f} ms")
+
+    before = server.stats.disconnects
+    await cancelled_streams(backend, 10, 1000)
+    await asyncio.sleep(0.5)
+    print(f"cancelled 10 streams: the server saw {server.stats.disconnects - before} disconnects")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens_per_second", type=float, default=50.0)
+    parser.add_argument("--max_tokens", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    configure_clients(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    server = mock_server.start(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    asyncio.run(run(args, server))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+micro-benchmark: replay a keystroke trace against a large document with the old list-of-lines
+Buffer and the rope-backed editor.Buffer.
+
+usage:
+    python bench_buffer.py                                   # synthetic trace on a ~200k char document
+    python bench_buffer.py --trace keys.jsonl --file novel.txt   # trace recorded with `editor.py --record-keys keys.jsonl`
+"""
+import argparse
+import json
+import random
+import time
+
+from editor import Buffer
+
+
+class ListBuffer:
+    # the original list-of-strings Buffer, kept here as the baseline
+    def __init__(self, lines):
+        self.lines = lines
+        self.word_count = sum([len(line) for line in lines])
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index]
+
+    def insert(self, cursor, string):
+        row, col = cursor.row, cursor.col
+        current = self.lines.pop(row)
+        new = current[:col] + string + current[col:]
+        self.lines.insert(row, new)
+        self.word_count += len(string)
+
+    def split(self, cursor):
+        row, col = cursor.row, cursor.col
+        current = self.lines.pop(row)
+        self.lines.insert(row, current[:col])
+        self.lines.insert(row + 1, current[col:])
+        self.word_count += 1
+
+    def delete(self, cursor):
+        row, col = cursor.row, cursor.col
+        if col < len(self[row]):
+            current = self.lines.pop(row)
+            new = current[:col] + current[col+1:]
+            self.lines.insert(row, new)
+        else:
+            current = self.lines.pop(row)
+            next = self.lines.pop(row)
+            new = current + next
+            self.lines.insert(row, new)
+        self.word_count -= 1
+
+
+class Pos:
+    # a bare cursor: the benchmark measures buffer cost, not layout
+    def __init__(self, row=0, col=0):
+        self.row = row
+        self.col = col
+
+
+def replay(buffer, trace, start_row):
+    cursor = Pos(start_row, 0)
+    for k in trace:
+        if k == "\n":
+            buffer.split(cursor)
+            cursor.row += 1
+            cursor.col = 0
+        elif k in ("KEY_BACKSPACE", "\x7f"):
+            if cursor.col > 0:
+                cursor.col -= 1
+                buffer.delete(cursor)
+            elif cursor.row > 0:
+                cursor.row -= 1
+                cursor.col = len(buffer[cursor.row])
+                buffer.delete(cursor)
+        elif k == "KEY_LEFT":
+            if cursor.col > 0:
+                cursor.col -= 1
+        elif k == "KEY_RIGHT":
+            if cursor.col < len(buffer[cursor.row]):
+                cursor.col += 1
+        elif k == "KEY_UP":
+            if cursor.row > 0:
+                cursor.row -= 1
+                cursor.col = min(cursor.col, len(buffer[cursor.row]))
+        elif k == "KEY_DOWN":
+            if cursor.row < len(buffer) - 1:
+                cursor.row += 1
+                cursor.col = min(cursor.col, len(buffer[cursor.row]))
+        elif isinstance(k, str) and len(k) == 1:
+            buffer.insert(cursor, k)
+            cursor.col += 1
+    return buffer
+
+
+def synthetic_trace(source, n_keys, seed=0):
+    rng = random.Random(seed)
+    chars = [c for c in source if c != "\n"] or ["字"]
+    trace = []
+    while len(trace) < n_keys:
+        r = rng.random()
+        if r < 0.85:
+            trace.extend(rng.choice(chars) for _ in range(rng.randint(1, 12)))
+        elif r < 0.90:
+            trace.append("\n")
+        elif r < 0.96:
+            trace.extend(["KEY_BACKSPACE"] * rng.randint(1, 4))
+        else:
+            trace.append(rng.choice(["KEY_LEFT", "KEY_RIGHT", "KEY_UP", "KEY_DOWN"]))
+    return trace[:n_keys]
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_document(path, size):
+    with open(path) as f:
+        text = f.read()
+    text = (text + "\n") * (size // max(len(text), 1) + 1)
+    return text[:size].splitlines()
+
+
+def bench(cls, lines, trace, start_row, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        buffer = cls(list(lines))
+        t0 = time.perf_counter()
+        replay(buffer, trace, start_row)
+        best = min(best, time.perf_counter() - t0)
+    return best, buffer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default="仙侠开局大纲.txt")
+    parser.add_argument("--size", type=int, default=200_000, help="document size in characters")
+    parser.add_argument("--trace", type=str, default=None, help="keystroke trace recorded by editor.py --record-keys")
+    parser.add_argument("--keys", type=int, default=20_000, help="length of the synthetic trace")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = make_document(args.file, args.size)
+    trace = load_trace(args.trace) if args.trace else synthetic_trace("\n".join(lines[:200]), args.keys)
+    # start editing in the middle of the document, where both implementations pay for the line shifts
+    start_row = len(lines) // 2
+
+    t_old, old = bench(ListBuffer, lines, trace, start_row, args.repeat)
+    t_new, new = bench(Buffer, lines, trace, start_row, args.repeat)
+    assert list(old.lines) == list(new.lines) and old.word_count == new.word_count
+
+    print(f"document: {args.size} chars, {len(lines)} lines; trace: {len(trace)} keys")
+    print(f"list Buffer: {t_old * 1e3:8.1f} ms  ({t_old / len(trace) * 1e6:6.2f} us/key)")
+    print(f"rope Buffer: {t_new * 1e3:8.1f} ms  ({t_new / len(trace) * 1e6:6.2f} us/key)")
+
+
+if __name__ == "__main__":
+    main()
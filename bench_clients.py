@@ -0,0 +1,105 @@
+"""
+benchmark: per-request latency against a local stub completion server, with a new client per
+request (what run.py used to do) and with the shared clients from run.get_client.
+
+usage:
+    python bench_clients.py --requests 200
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # answers any POST like an OpenAI-compatible /completions endpoint, keeping the connection open
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({
+            "id": "stub", "object": "text_completion", "created": 0, "model": "stub",
+            "choices": [{"index": 0, "text": "续写", "finish_reason": "length", "logprobs": None}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(call, n):
+    latencies = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def report(name, latencies):
+    print(f"{name:<28} mean {statistics.mean(latencies) * 1e3:7.3f} ms   "
+          f"p50 {statistics.median(latencies) * 1e3:7.3f} ms   max {max(latencies) * 1e3:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_server()
+    host, port = server.server_address
+    payload = json.dumps({"model": "stub", "prompt": "从前", "max_tokens": 7})
+    headers = {"Content-Type": "application/json"}
+
+    def fresh_connection():
+        conn = http.client.HTTPConnection(host, port)
+        conn.request("POST", "/v1/completions", payload, headers)
+        conn.getresponse().read()
+        conn.close()
+
+    shared = http.client.HTTPConnection(host, port)
+
+    def kept_alive():
+        shared.request("POST", "/v1/completions", payload, headers)
+        shared.getresponse().read()
+
+    report("http.client new connection", timed(fresh_connection, args.requests))
+    report("http.client keep-alive", timed(kept_alive, args.requests))
+
+    try:
+        import openai
+        import run
+    except ImportError as e:
+        print(f"skipping SDK comparison: {e}")
+        return
+    base_url = f"http://{host}:{port}/v1"
+
+    def new_client():
+        client = openai.OpenAI(api_key="stub", base_url=base_url)
+        client.completions.create(model="stub", prompt="从前", max_tokens=7)
+        client.close()
+
+    def shared_client():
+        run.openai_completion("从前", model="stub", max_tokens=7, base_url=base_url)
+
+    report("openai new client per call", timed(new_client, args.requests))
+    report("run.get_client shared", timed(shared_client, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+accepting and removing completions: Editor.insert and Editor.delete_before, one buffer
+operation each, against the old path that inserted and deleted character by character, moving
+the cursor and the window after each one.
+
+a long paragraph is written completion by completion; every other completion is removed
+again, as with Ctrl+Z. both paths must end with the same text, cursor and window.
+
+usage:
+    python bench_completions.py --line_chars 4000 --completion_chars 200 --completions 100
+"""
+import argparse
+import random
+import time
+
+from bench_render import FakeScreen
+from editor import Editor
+
+
+def insert_by_char(editor, string):
+    for char in string:
+        if char == "\n":
+            editor.buffer.split(editor.cursor)
+        else:
+            editor.buffer.insert(editor.cursor, char)
+        editor.right()
+
+
+def delete_by_char(editor, n):
+    for _ in range(n):
+        editor.left()
+        editor.buffer.delete(editor.cursor)
+
+
+def completions(rng, n, chars):
+    alphabet = "天地玄黄宇宙洪荒日月盈昃辰宿列张，。abc "
+    result = []
+    for _ in range(n):
+        text = "".join(rng.choice(alphabet) for _ in range(chars))
+        if rng.random() < 0.3:
+            # some completions end a paragraph and start the next
+            cut = rng.randrange(chars)
+            text = text[:cut] + "\n" + text[cut:]
+        result.append(text)
+    return result
+
+
+def run(line_chars, texts, bulk):
+    # a screen tall enough for the paragraph: the window does not scroll within a line
+    editor = Editor(FakeScreen(n_lines=200, n_cols=200), "")
+    editor.insert("天" * line_chars)
+    t0 = time.perf_counter()
+    for i, text in enumerate(texts):
+        if bulk:
+            editor.insert(text)
+        else:
+            insert_by_char(editor, text)
+        if i % 2:
+            if bulk:
+                editor.delete_before(len(text) // 2)
+            else:
+                delete_by_char(editor, len(text) // 2)
+    elapsed = time.perf_counter() - t0
+    cursor, window = editor.cursor, editor.window
+    state = (list(editor.buffer), editor.buffer.word_count, cursor.row, cursor.col, cursor.row_offset,
+             window.row, window.row_offset)
+    return elapsed, state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--line_chars", type=int, default=4000)
+    parser.add_argument("--completion_chars", type=int, default=200)
+    parser.add_argument("--completions", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = completions(random.Random(args.seed), args.completions, args.completion_chars)
+    old, old_state = run(args.line_chars, texts, bulk=False)
+    new, new_state = run(args.line_chars, texts, bulk=True)
+    assert old_state == new_state, "bulk editing ended in a different state"
+    n = args.completions
+    print(f"{args.completions} completions of {args.completion_chars} characters on a "
+          f"{args.line_chars}-character paragraph, half of them partly removed")
+    print(f"per character: {old / n * 1e3:8.2f} ms per completion")
+    print(f"bulk:          {new / n * 1e3:8.2f} ms per completion ({old / new:.0f}x)")
+    print("both end with the same text, cursor and window")
+
+
+if __name__ == "__main__":
+    main()
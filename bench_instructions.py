@@ -0,0 +1,99 @@
+"""
+benchmark: building the Gemini message on Tab in a document with many <user> blocks,
+while typing at the end of it.
+
+    scan     buffer.prefix + the old get_message, which re-finds the tags and re-slices the
+             remaining text after every block
+    index    GeminiCopilot.context + prepare: segments from the buffer's instruction index
+
+both run without a token budget, so they build the same message (checked on every Tab).
+
+usage:
+    python bench_instructions.py --blocks 500 --tabs 50
+"""
+import argparse
+import random
+import statistics
+import time
+
+from copilot import GeminiCopilot
+from editor import Buffer, Cursor
+
+
+def scan_message(text):
+    # GeminiCopilot.get_message before the instruction index, without the unclosed-prompt case
+    message = []
+    if not text:
+        message.append({"role": "user", "parts": ["给我写一段小说"]})
+    unprocessed_text = text
+    while True:
+        user_prompt_start = unprocessed_text.find("<user>")
+        user_prompt_end = unprocessed_text.find("</user>")
+        if user_prompt_start == -1 or user_prompt_end == -1:
+            break
+        user_prompt = unprocessed_text[user_prompt_start + len("<user>"):user_prompt_end]
+        model_completion = unprocessed_text[:user_prompt_start]
+        if model_completion:
+            message.append({"role": "model", "parts": [model_completion]})
+        message.append({"role": "user", "parts": [user_prompt]})
+        unprocessed_text = unprocessed_text[user_prompt_end + len("</user>"):]
+    message.append({"role": "model", "parts": [unprocessed_text]})
+    last_paragraph_index = text.rfind("\n")
+    if last_paragraph_index != -1:
+        prefill_len = len(text) - last_paragraph_index
+        continuation_prompt = "Continue from this line, do not repeat the previous content nor the chapter title:\n"
+        continuation_prompt += text[last_paragraph_index:]
+    else:
+        prefill_len = 0
+        continuation_prompt = "Continue"
+    message.append({"role": "user", "parts": [continuation_prompt]})
+    return message, prefill_len
+
+
+def make_document(blocks, paragraphs, seed=0):
+    rng = random.Random(seed)
+    chars = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏，。"
+    lines = []
+    for b in range(blocks):
+        lines.append(f"<user>第{b}章：主角遇到新的对手，写一场打斗。</user>")
+        for _ in range(paragraphs):
+            lines.append("".join(rng.choice(chars) for _ in range(rng.randint(40, 160))))
+        lines.append("")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=500)
+    parser.add_argument("--paragraphs", type=int, default=8)
+    parser.add_argument("--tabs", type=int, default=50)
+    parser.add_argument("--keys_per_tab", type=int, default=20)
+    args = parser.parse_args()
+
+    buffer = Buffer(make_document(args.blocks, args.paragraphs))
+    copilot = GeminiCopilot(context_tokens=-1)
+    cursor = Cursor(80, len(buffer) - 1, 0)
+    n_chars = buffer.offset(cursor)
+    print(f"{args.blocks} <user> blocks, {len(buffer)} lines, {n_chars} characters")
+
+    scan, index = [], []
+    for tab in range(args.tabs):
+        for _ in range(args.keys_per_tab):
+            buffer.insert(cursor, "字")
+            cursor.col += 1
+
+        t0 = time.perf_counter()
+        expected = scan_message(buffer.prefix(cursor))
+        t1 = time.perf_counter()
+        _, message, prefill_len = copilot.prepare(**copilot.context(buffer, cursor))
+        t2 = time.perf_counter()
+        assert (message, prefill_len) == expected
+        scan.append(t1 - t0)
+        index.append(t2 - t1)
+
+    for name, times in (("scan", scan), ("index", index)):
+        print(f"{name:<6} mean {statistics.mean(times) * 1e3:8.3f} ms   p50 {statistics.median(times) * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+cursor jumps on a 1M-character document: goto_bottom (Ctrl+N), goto_offset, goto_line and
+page up/down, which place the cursor and the window directly, against moving there one right()
+at a time as goto_bottom used to.
+
+checks: after a jump the cursor is at the requested offset and on screen. on a document of
+--step_chars characters, goto_offset shows at least as much text above the cursor as stepping
+there does, and the cursor is drawn on the row the lines put it on, also after moving on.
+
+usage:
+    python bench_navigation.py --sizes 100000 1000000 --jumps 1000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from bench_buffer import make_document
+from bench_render import FakeScreen
+from editor import Editor, get_line_height
+from layout import get_layout
+
+
+def make_editor(lines):
+    editor = Editor(FakeScreen(), "")
+    editor.buffer = type(editor.buffer)(lines)
+    return editor
+
+
+def step_to(editor, offset):
+    # the old way: one right() per character
+    while editor.buffer.offset(editor.cursor) < offset:
+        editor.right()
+
+
+def check_jump(editor, offset):
+    assert editor.buffer.offset(editor.cursor) == offset, (editor.buffer.offset(editor.cursor), offset)
+    display_row = editor.window.translate(editor.cursor, editor.buffer)[0]
+    assert 0 <= display_row < editor.window.n_rows, display_row
+
+
+def timed(calls):
+    times = []
+    for call in calls:
+        t0 = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e6, max(times) * 1e6
+
+
+def bench(lines, jumps, rng):
+    editor = make_editor(lines)
+    n_chars = editor.buffer.lines.n_chars
+    offsets = [rng.randrange(n_chars + 1) for _ in range(jumps)]
+    rows = [rng.randrange(len(editor.buffer)) for _ in range(jumps)]
+    results = {}
+
+    t0 = time.perf_counter()
+    editor.goto_bottom()
+    results["goto_bottom"] = ((time.perf_counter() - t0) * 1e6,) * 2
+    check_jump(editor, n_chars)
+
+    def goto_offset(offset):
+        editor.goto_offset(offset)
+        check_jump(editor, offset)
+
+    results["goto_offset"] = timed(lambda offset=offset: goto_offset(offset) for offset in offsets)
+    results["goto_line"] = timed(lambda row=row: editor.goto_line(row) for row in rows)
+    editor.goto(0, 0)
+    results["page_down"] = timed(editor.page_down for _ in range(jumps))
+    results["page_up"] = timed(editor.page_up for _ in range(jumps))
+    return results
+
+
+def true_display_row(editor):
+    # the screen row of the cursor, counted from the lines themselves rather than the row offsets
+    buffer, window, cursor = editor.buffer, editor.window, editor.cursor
+    rows = sum(get_line_height(buffer[row], window.n_cols) + 1 for row in range(window.row, cursor.row))
+    return rows + get_layout(buffer[cursor.row], window.n_cols).translate(cursor.col)[0]
+
+
+def check_against_stepping(lines, step_chars, rng):
+    # a document short enough to step through
+    lines = lines[:]
+    while sum(map(len, lines)) > step_chars:
+        lines.pop()
+    for _ in range(20):
+        offset = rng.randrange(sum(map(len, lines)) + len(lines))
+        stepped, jumped = make_editor(lines), make_editor(lines)
+        step_to(stepped, offset)
+        jumped.goto_offset(offset)
+        # stepping past a tall line scrolls further than needed, and the window stays there
+        assert jumped.window.row <= stepped.window.row, (offset, jumped.window.row, stepped.window.row)
+        # the re-based row offsets draw the cursor where it is, then and after moving on
+        for _ in range(200):
+            assert true_display_row(jumped) == jumped.window.translate(jumped.cursor, jumped.buffer)[0]
+            if rng.random() < 0.7:
+                jumped.right()
+            else:
+                jumped.left()
+    jumped.goto_bottom()
+    assert 0 <= true_display_row(jumped) < jumped.window.n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default="仙侠开局大纲.txt")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--jumps", type=int, default=1000)
+    parser.add_argument("--step_chars", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    for size in args.sizes:
+        lines = make_document(args.file, size)
+        editor = make_editor(lines)
+        t0 = time.perf_counter()
+        step_to(editor, editor.buffer.lines.n_chars)
+        stepping = time.perf_counter() - t0
+        print(f"{size} characters, {len(lines)} lines: stepping to the end took {stepping:.2f} s")
+        for name, (p50, worst) in bench(lines, args.jumps, rng).items():
+            print(f"    {name:<12} p50 {p50:9.1f} us   max {worst:9.1f} us")
+
+    check_against_stepping(make_document(args.file, args.step_chars * 2), args.step_chars, rng)
+    print(f"jumps place the window and cursor consistently with stepping ({args.step_chars} characters)")
+
+
+if __name__ == "__main__":
+    main()
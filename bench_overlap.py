@@ -0,0 +1,56 @@
+"""
+check_overlap and fuzzy_overlap timings against a 100k-character text. postprocess runs the
+fuzzy pass only when the exact overlap is 0, so its cost is paid by responses that do not
+repeat the text exactly.
+
+the randomized agreement checks are in test_overlap.py.
+
+usage:
+    python bench_overlap.py --repeat 20000
+"""
+import argparse
+import random
+import time
+
+from overlap import check_overlap, fuzzy_overlap
+
+
+def random_text(rng, alphabet, length):
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def timed(fn, text, response, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(text, response)
+    return (time.perf_counter() - t0) / repeat
+
+
+def postprocess_overlap(text, response):
+    # what GeminiCopilot.postprocess strips
+    return check_overlap(text, response) or fuzzy_overlap(text, response)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    text = random_text(rng, "天地玄黄宇宙洪荒，。\n", 100000)
+    for response_len in (100, 1000, 5000):
+        repeat = max(2, args.repeat // response_len)
+        # no overlap: every length is tried, and the fuzzy pass runs too
+        fresh = "日" + random_text(rng, "天地玄黄宇宙洪荒，。", response_len - 1)
+        # the usual case: the last line comes back unchanged, and the fuzzy pass is skipped
+        repeated = text[-20:] + fresh
+        exact = timed(check_overlap, text, fresh, repeat)
+        fuzzy = timed(fuzzy_overlap, text, fresh, repeat)
+        both = timed(postprocess_overlap, text, repeated, repeat)
+        print(f"response {response_len:>5}: exact {exact * 1e3:7.3f} ms   fuzzy {fuzzy * 1e3:7.3f} ms   "
+              f"repeated line {both * 1e3:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
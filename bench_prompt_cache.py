@@ -0,0 +1,67 @@
+"""
+how much of each prompt repeats the start of the previous one (what a provider's prefix cache
+can reuse) while a novel is typed, with the sliding window and with the stable layout
+(Copilot.use_stable_layout). prompts are built the way Tab builds them; no model is called.
+
+usage:
+    python bench_prompt_cache.py --chars 100000 --tabs 300 --chunk 1000
+"""
+import argparse
+import random
+import statistics
+
+from context import count_tokens, shared_prefix
+from copilot import GeminiCopilot, TogetherCopilot
+
+
+def random_paragraph(rng):
+    alphabet = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(40, 200))) + "。\n"
+
+
+def typing(rng, chars, tabs, keys_per_tab):
+    # the text at each Tab: a novel of `chars` characters, typed on
+    text = "".join(random_paragraph(rng) for _ in range(chars // 120))
+    paragraph = random_paragraph(rng)
+    for tab in range(tabs):
+        for _ in range(keys_per_tab):
+            text += paragraph[0]
+            paragraph = paragraph[1:] or random_paragraph(rng)
+        if tab % 50 == 49:
+            text += "<user>下一章，主角离开村子。</user>"
+        yield text
+
+
+def reuse(prompts):
+    ratios = [shared_prefix(a, b) / len(b) for a, b in zip(prompts, prompts[1:])]
+    return statistics.median(ratios), sum(ratios) / len(ratios)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=100000)
+    parser.add_argument("--tabs", type=int, default=300)
+    parser.add_argument("--keys_per_tab", type=int, default=20)
+    parser.add_argument("--chunk", type=int, default=1000)
+    parser.add_argument("--context_tokens", type=int, default=4096)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = list(typing(random.Random(args.seed), args.chars, args.tabs, args.keys_per_tab))
+    print(f"{'layout':<34} {'reuse p50':>10} {'reuse mean':>11} {'prompt tokens':>14}")
+    for name, chunk in (("sliding window", 0), (f"stable, {args.chunk}-char blocks", args.chunk)):
+        together = TogetherCopilot(model="Qwen/Qwen1.5-32B", context_tokens=args.context_tokens)
+        gemini = GeminiCopilot(context_tokens=args.context_tokens)
+        if chunk:
+            together.use_stable_layout(chunk)
+            gemini.use_stable_layout(chunk)
+        prompts = [together.get_prompt(text) for text in texts]
+        messages = [gemini.flatten(gemini.prepare(text)[1]) for text in texts]
+        tokens = statistics.median(count_tokens(prompt) for prompt in prompts)
+        for provider, built in (("together", prompts), ("gemini", messages)):
+            p50, mean = reuse(built)
+            print(f"{provider + ', ' + name:<34} {p50:>10.0%} {mean:>11.0%} {tokens:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
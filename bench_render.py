@@ -0,0 +1,112 @@
+"""
+headless benchmark: drive the Editor through a fake stdscr and report redraw time per keystroke
+for documents of 1k, 100k and 1M characters.
+
+usage:
+    python bench_render.py
+    python bench_render.py --sizes 1000 1000000 --keys 2000 --full
+"""
+import argparse
+import curses
+import random
+import time
+
+from bench_buffer import make_document
+from editor import Editor
+
+
+class FakeScreen:
+    """
+    the subset of a curses window the Editor draws with; counts what would reach the terminal.
+    """
+
+    def __init__(self, n_lines=40, n_cols=100):
+        self.n_lines = n_lines
+        self.n_cols = n_cols
+        self.rows_written = 0
+        self.chars_written = 0
+
+    def getmaxyx(self):
+        return self.n_lines, self.n_cols
+
+    def addstr(self, *args):
+        self.rows_written += 1
+        self.chars_written += len(args[-1])
+
+    def erase(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def clrtoeol(self):
+        pass
+
+    def move(self, row, col):
+        pass
+
+    def refresh(self):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+
+def trace(n_keys, seed=0):
+    rng = random.Random(seed)
+    keys = []
+    while len(keys) < n_keys:
+        r = rng.random()
+        if r < 0.8:
+            keys.append(rng.choice("天地玄黄宇宙洪荒，。abc "))
+        elif r < 0.85:
+            keys.append("\n")
+        elif r < 0.9:
+            keys.append("KEY_BACKSPACE")
+        else:
+            keys.append(rng.choice(["KEY_DOWN", "KEY_DOWN", "KEY_RIGHT", "KEY_LEFT", "KEY_UP"]))
+    return keys
+
+
+def bench(size, keys, source, full):
+    screen = FakeScreen()
+    editor = Editor(screen, "")
+    editor.buffer = type(editor.buffer)(make_document(source, size))
+    editor.display_buffer()
+    t_key = t_draw = 0.0
+    for k in keys:
+        t0 = time.perf_counter()
+        editor.handle_keypress(k)
+        t1 = time.perf_counter()
+        if full:
+            editor.invalidate()
+        editor.display_buffer()
+        editor.translate_cursor()
+        t2 = time.perf_counter()
+        t_key += t1 - t0
+        t_draw += t2 - t1
+    n = len(keys)
+    return t_key / n, t_draw / n, screen.rows_written / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default="仙侠开局大纲.txt")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--keys", type=int, default=5_000)
+    parser.add_argument("--full", action="store_true", help="also measure repainting every row on every key")
+    args = parser.parse_args()
+
+    # the Editor only needs doupdate in run(); keep curses out of the headless loop
+    curses.doupdate = lambda: None
+    keys = trace(args.keys)
+    modes = [False, True] if args.full else [False]
+    print(f"{'chars':>9} {'mode':>6} {'keypress us':>12} {'redraw us':>10} {'rows/key':>9}")
+    for size in args.sizes:
+        for full in modes:
+            t_key, t_draw, rows = bench(size, keys, args.file, full)
+            print(f"{size:>9} {'full' if full else 'dirty':>6} {t_key * 1e6:12.1f} {t_draw * 1e6:10.1f} {rows:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
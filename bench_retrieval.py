@@ -0,0 +1,103 @@
+"""
+retrieval over a novel-sized buffer: index build time, per-Tab search latency while typing,
+and two checks:
+
+    - after random edits (typing, Enter, Backspace across lines), the incrementally updated
+      index equals one built from scratch over the buffer's lines
+    - a name planted in an early paragraph is found from a query that mentions it
+
+usage:
+    python bench_retrieval.py --chars 500000 --tabs 200
+"""
+import argparse
+import random
+import statistics
+import time
+
+from editor import Buffer, Cursor
+from retrieval import PassageIndex, same_index
+
+# 3000 characters with Zipf-like frequencies, roughly like the characters of Chinese prose
+alphabet = [chr(0x4E00 + i) for i in range(3000)] + ["，", "。"]
+weights = [1 / (rank + 1) for rank in range(3000)] + [30, 15]
+
+
+def random_text(rng, n):
+    return "".join(rng.choices(alphabet, weights, k=n))
+
+
+def make_lines(rng, chars):
+    lines, total = [], 0
+    while total < chars:
+        line = random_text(rng, rng.randint(40, 200))
+        lines.append(line)
+        total += len(line) + 1
+    return lines
+
+
+def random_edits(rng, buffer, n):
+    for _ in range(n):
+        row = rng.randrange(len(buffer))
+        cursor = Cursor(80, row, rng.randint(0, len(buffer[row])))
+        action = rng.random()
+        if action < 0.7:
+            buffer.insert(cursor, random_text(rng, 1))
+        elif action < 0.85:
+            buffer.split(cursor)
+        elif len(buffer) > 1 and row < len(buffer) - 1:
+            buffer.delete(Cursor(80, row, len(buffer[row])))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=500000)
+    parser.add_argument("--tabs", type=int, default=200)
+    parser.add_argument("--keys_per_tab", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    lines = make_lines(rng, args.chars)
+    lines[10] = "那一年，慕容霜华在昆仑山下的寒潭边捡到了一柄断剑，剑身刻着“归墟”二字。"
+    buffer = Buffer(lines)
+    t0 = time.perf_counter()
+    n = len(buffer.passages)
+    print(f"{len(buffer)} lines, {args.chars} characters: indexed {n} paragraphs in "
+          f"{(time.perf_counter() - t0) * 1e3:.0f} ms (first search)")
+
+    # typing at the end, searching on every Tab
+    cursor = Cursor(80, len(buffer) - 1, len(buffer[len(buffer) - 1]))
+    updates, times = [], []
+    for tab in range(args.tabs):
+        for _ in range(args.keys_per_tab):
+            buffer.insert(cursor, random_text(rng, 1))
+            cursor.col += 1
+        if tab % 10 == 9:
+            buffer.split(cursor)
+            cursor.row += 1
+            cursor.col = 0
+        query = buffer.tail(cursor, 200)
+        t0 = time.perf_counter()
+        buffer.passages.update()
+        t1 = time.perf_counter()
+        buffer.passages.search(query, 3, exclude=range(max(cursor.row - 30, 0), cursor.row + 1))
+        updates.append(t1 - t0)
+        times.append(time.perf_counter() - t1)
+    for name, values in (("update", updates), ("search", times)):
+        values.sort()
+        print(f"{name} per Tab while typing: p50 {statistics.median(values) * 1e3:.3f} ms   "
+              f"p99 {values[int(len(values) * 0.99)] * 1e3:.3f} ms")
+
+    buffer.insert(cursor, "慕容霜华握着那柄归墟剑")
+    cursor.col += len("慕容霜华握着那柄归墟剑")
+    found = buffer.passages.search(buffer.tail(cursor, 200), 3, exclude=range(cursor.row - 5, cursor.row + 1))
+    assert found and found[0][0] == 10, found
+    print("planted paragraph found first")
+
+    random_edits(rng, buffer, 2000)
+    assert same_index(buffer.passages, PassageIndex(list(buffer))), "incremental index differs"
+    print("after 2000 random edits, the index equals a rebuilt one")
+
+
+if __name__ == "__main__":
+    main()
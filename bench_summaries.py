@@ -0,0 +1,79 @@
+"""
+prompt size with rolling summaries as a novel grows to 500k characters.
+
+a novel is written chapter by chapter; after each chapter the prompt is built the way the
+copilot builds it on Tab (Summarizer.split), with a stand-in summarize function so no model is
+needed. printed per size: tokens of the full text, of summary + recent window, the time split
+takes, and how many summaries had to be computed. at the end an early chapter is edited, which
+should re-summarize that chapter and the folded summaries that contain it, nothing else.
+
+usage:
+    python bench_summaries.py --chars 500000 --window 3000
+"""
+import argparse
+import random
+import time
+
+from context import count_tokens
+from summaries import Summarizer
+
+
+def make_chapter(rng, number, chars):
+    alphabet = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳"
+    lines = [f"第{number}章 风起"]
+    while sum(map(len, lines)) < chars:
+        lines.append("".join(rng.choice(alphabet) for _ in range(rng.randint(40, 200))) + "。")
+    return "\n".join(lines) + "\n"
+
+
+def settle(summarizer, text):
+    # what a Tab does, then wait for the summaries it asked for
+    summarizer.split(text)
+    summarizer.drain()
+    while summarizer.busy():
+        time.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=500000)
+    parser.add_argument("--chapter_chars", type=int, default=4000)
+    parser.add_argument("--window", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    calls = []
+
+    def summarize(text, max_chars):
+        # stand-in for the model: a summary of about max_chars characters
+        calls.append(len(text))
+        return text[:max_chars // 2] + text[-max_chars // 2:]
+
+    summarizer = Summarizer(summarize, args.window)
+    rng = random.Random(args.seed)
+    chapters = []
+    next_report = 50000
+    print(f"{'chars':>8} {'full tokens':>12} {'prompt tokens':>14} {'split ms':>9} {'summaries':>10}")
+    while sum(map(len, chapters)) < args.chars:
+        chapters.append(make_chapter(rng, len(chapters) + 1, args.chapter_chars))
+        text = "".join(chapters)
+        settle(summarizer, text)
+        if len(text) >= next_report:
+            next_report += 50000
+            t0 = time.perf_counter()
+            summary, recent = summarizer.split(text)
+            elapsed = time.perf_counter() - t0
+            print(f"{len(text):>8} {count_tokens(text):>12} {count_tokens(summary) + count_tokens(recent):>14} "
+                  f"{elapsed * 1e3:>9.2f} {len(calls):>10}")
+
+    before = len(calls)
+    chapters[3] = chapters[3].replace("风起", "风停", 1)
+    text = "".join(chapters)
+    # each round can only fold the summaries the previous one computed
+    for _ in range(5):
+        settle(summarizer, text)
+    print(f"editing chapter 4 re-summarized {len(calls) - before} spans and folds")
+
+
+if __name__ == "__main__":
+    main()
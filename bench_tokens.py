@@ -0,0 +1,88 @@
+"""
+benchmark: startup time and memory of the token tables used for token healing. each variant
+loads its table in a fresh interpreter and answers the same prefix queries.
+
+    pickles     chinese_tokens.pkl + unstable_tokens.pkl, what copilot.py used to load at import
+    trie        chinese_tokens.pkl + token_trie.TokenTrie
+    table       memory-mapped chinese_tokens.bin (token_table.py)
+
+usage:
+    python bench_tokens.py --queries 1000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# runs in the child interpreter; prints load time, query time and rss growth as json
+child = r"""
+import json, os, pickle, resource, sys, time
+sys.path.insert(0, {here!r})
+os.chdir({here!r})
+variant, prefixes = sys.argv[1], json.loads(sys.stdin.read())
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+before = rss_kb()
+t0 = time.perf_counter()
+if variant == "pickles":
+    with open("chinese_tokens.pkl", "rb") as f:
+        chinese_tokens = pickle.load(f)
+    with open("unstable_tokens.pkl", "rb") as f:
+        unstable_tokens = pickle.load(f)
+    query = lambda prefix: sorted(unstable_tokens.get(prefix, ()))
+elif variant == "trie":
+    from token_trie import TokenTrie
+    with open("chinese_tokens.pkl", "rb") as f:
+        trie = TokenTrie(pickle.load(f))
+    query = lambda prefix: trie.candidates(prefix, proper=True)
+else:
+    from token_table import TokenTable
+    table = TokenTable()
+    query = lambda prefix: table.candidates(prefix, proper=True)
+loaded = time.perf_counter()
+found = sum(len(query(prefix)) for prefix in prefixes)
+done = time.perf_counter()
+print(json.dumps({{"load": loaded - t0, "query": done - loaded, "found": found,
+                  "rss": rss_kb() - before}}))
+"""
+
+
+def run_variant(variant, prefixes):
+    out = subprocess.run([sys.executable, "-c", child.format(here=here), variant],
+                         input=json.dumps(prefixes), capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import pickle
+    with open(os.path.join(here, "chinese_tokens.pkl"), "rb") as f:
+        tokens = pickle.load(f)
+    # one- and two-character prefixes of real tokens, the lengths token healing looks at most
+    prefixes = sorted({text[:i] for text in tokens.values() for i in (1, 2) if len(text) >= i})
+    prefixes = (prefixes * (args.queries // len(prefixes) + 1))[:args.queries]
+
+    for variant in ("pickles", "trie", "table"):
+        runs = [run_variant(variant, prefixes) for _ in range(args.repeat)]
+        load = min(r["load"] for r in runs)
+        query = min(r["query"] for r in runs)
+        rss = min(r["rss"] for r in runs)
+        print(f"{variant:<8} load {load * 1e3:8.2f} ms   {len(prefixes)} queries {query * 1e3:8.2f} ms   "
+              f"rss +{rss / 1024:6.1f} MB   {runs[0]['found']} candidates")
+
+
+if __name__ == "__main__":
+    main()
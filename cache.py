@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def cache_key(*parts) -> str:
+    """
+    hash of everything that determines a completion: model, final prompt or message list,
+    and generation config.
+    """
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    LRU cache of completions with an optional SQLite tier shared across sessions.
+
+    each key holds up to `samples` responses. a lookup of a stored key never calls the
+    provider: pressing Tab again on the same text (after an undo, say) returns a stored
+    response, cycling through them when there are several. the alternatives come from
+    get_many, whose batch of n candidates is stored as the key's samples. entries expire
+    `max_age` seconds after their first response.
+    """
+
+    def __init__(self,
+                 max_entries: int = 256,
+                 max_age: float = 3600,
+                 samples: int = 3,
+                 path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.samples = max(samples, 1)
+        self._entries = OrderedDict()  # key -> [created, responses, next sample]
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            import sqlite3
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS completions "
+                             "(key TEXT, created REAL, response TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_key ON completions (key)")
+            self._db.execute("DELETE FROM completions WHERE created < ?", (time.time() - max_age,))
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_call(self, key: str, call: Callable[[], str]) -> str:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and entry[1]:
+                created, responses, i = entry
+                entry[2] = (i + 1) % len(responses)
+                return responses[i]
+        response = call()
+        if response:
+            self._store(key, response)
+        return response
+
+    def get_many(self, key: str, call: Callable[[], list], n: int) -> list:
+        """
+        up to n responses for key: the stored samples if there are enough, otherwise the batch
+        returned by call(), which is stored as the key's samples.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and len(entry[1]) >= min(n, self.samples):
+                return entry[1][:n]
+        responses = [response for response in call() if response]
+        for response in responses:
+            self._store(key, response)
+        return responses
+
+    def _lookup(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] > self.max_age:
+            del self._entries[key]
+            entry = None
+        if entry is None and self._db is not None:
+            rows = self._db.execute("SELECT created, response FROM completions WHERE key = ? AND created >= ? "
+                                    "ORDER BY created", (key, now - self.max_age)).fetchall()
+            if rows:
+                entry = [rows[0][0], [response for _, response in rows], 0]
+                self._insert(key, entry)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, response):
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                entry = [now, [], 0]
+                self._insert(key, entry)
+            if len(entry[1]) >= self.samples:
+                return
+            entry[1].append(response)
+            if self._db is not None:
+                self._db.execute("INSERT INTO completions VALUES (?, ?, ?)", (key, now, response))
+                self._db.commit()
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
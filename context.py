@@ -0,0 +1,211 @@
+"""
+token-budgeted prompt context, shared by the copilots.
+
+fit_context keeps every instruction block (<user>...</user>, or the chat template's turns)
+and as many of the most recent paragraphs as the budget allows; older story paragraphs are
+dropped whole. token counts are estimated locally from the Qwen token table
+(chinese_tokens.bin): Chinese text is segmented greedily into the longest known tokens,
+other text is counted at about four characters per token.
+
+stable_bounds chooses the text for a cache-friendly prompt instead: it moves in blocks of about
+chunk_chars, so that consecutive prompts share a long prefix (see Copilot.use_stable_layout).
+"""
+import os
+import threading
+
+from token_table import load_token_table
+
+
+class TokenCounter:
+    """
+    approximate token counts. counts are memoised per paragraph, so after the first Tab only
+    the paragraphs that changed are segmented again.
+    """
+
+    def __init__(self, max_memo: int = 16384):
+        self.max_memo = max_memo
+        self._memo = {}
+        self._tokens = None     # multi-character token texts
+        self._prefixes = None   # their proper prefixes
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._tokens is None:
+                texts = [text for text in load_token_table().texts() if len(text) > 1]
+                self._prefixes = {text[:i] for text in texts for i in range(1, len(text))}
+                self._tokens = set(texts)
+
+    def count(self, text: str) -> int:
+        n = self._memo.get(text)
+        if n is None:
+            n = self._count(text)
+            if len(self._memo) >= self.max_memo:
+                self._memo.clear()
+            self._memo[text] = n
+        return n
+
+    def _count(self, text: str) -> int:
+        if self._tokens is None:
+            self._load()
+        tokens, prefixes = self._tokens, self._prefixes
+        n = 0
+        i = 0
+        ascii_run = 0
+        while i < len(text):
+            char = text[i]
+            if char.isascii():
+                if char.isalnum():
+                    ascii_run += 1
+                else:
+                    # a word is about one token per four characters; a space joins the next word
+                    n += (ascii_run + 3) // 4 + (char != " ")
+                    ascii_run = 0
+                i += 1
+                continue
+            n += (ascii_run + 3) // 4
+            ascii_run = 0
+            # longest known token starting here, one character if there is none
+            end = i + 1
+            j = i + 1
+            while j < len(text) and text[i:j] in prefixes:
+                j += 1
+                if text[i:j] in tokens:
+                    end = j
+            n += 1
+            i = end
+        return n + (ascii_run + 3) // 4
+
+
+_counter = TokenCounter()
+
+def count_tokens(text: str) -> int:
+    return _counter.count(text)
+
+
+def split_instructions(text: str, open_tag: str, close_tag: str) -> list:
+    """
+    split text into (is_instruction, segment) pairs. an instruction runs from open_tag through
+    close_tag; an unclosed one runs to the end of the text.
+    """
+    segments = []
+    pos = 0
+    while pos < len(text):
+        start = text.find(open_tag, pos)
+        if start == -1:
+            segments.append((False, text[pos:]))
+            break
+        if start > pos:
+            segments.append((False, text[pos:start]))
+        end = text.find(close_tag, start + len(open_tag))
+        end = len(text) if end == -1 else end + len(close_tag)
+        segments.append((True, text[start:end]))
+        pos = end
+    return segments
+
+
+def fit_context(text: str,
+                budget: int,
+                open_tag: str = "<user>",
+                close_tag: str = "</user>",
+                counter: TokenCounter = None) -> str:
+    """
+    the part of text that fits in about `budget` tokens, in document order (see fit_segments).
+    """
+    segments = fit_segments(split_instructions(text, open_tag, close_tag), budget, counter)
+    return "".join(segment for _, segment in segments)
+
+
+def fit_segments(segments: list, budget: int, counter: TokenCounter = None) -> list:
+    """
+    the (is_instruction, text) segments, or their ends, that fit in about `budget` tokens.
+
+    instruction blocks are kept first, newest first, and the newest one always. the rest of
+    the budget goes to the paragraphs right before the cursor; the first paragraph that does
+    not fit ends the window, so the story that is kept is one unbroken stretch. if not even
+    the paragraph at the cursor fits, its tail is kept.
+    """
+    counter = counter or _counter
+    keep = [None] * len(segments)
+
+    remaining = budget
+    for k in range(len(segments) - 1, -1, -1):
+        is_instruction, segment = segments[k]
+        if is_instruction:
+            n = counter.count(segment)
+            if n <= remaining or remaining == budget:
+                keep[k] = segment
+                remaining -= n
+
+    story = True
+    first = True
+    for k in range(len(segments) - 1, -1, -1):
+        is_instruction, segment = segments[k]
+        if is_instruction or not story:
+            continue
+        paragraphs = segment.split("\n")
+        kept = []
+        for p in range(len(paragraphs) - 1, -1, -1):
+            paragraph = paragraphs[p] + ("\n" if p < len(paragraphs) - 1 else "")
+            n = counter.count(paragraph)
+            if n > remaining:
+                if first and remaining > 0:
+                    kept.append(paragraph[-max(len(paragraph) * remaining // n, 1):])
+                story = False
+                break
+            kept.append(paragraph)
+            remaining -= n
+            first = first and not paragraph
+        keep[k] = "".join(reversed(kept))
+
+    return [(is_instruction, keep[k]) for k, (is_instruction, _) in enumerate(segments) if keep[k]]
+
+
+def block_start(text: str, offset: int) -> int:
+    # the start of the first paragraph at or after offset
+    if offset <= 0:
+        return 0
+    newline = text.find("\n", offset - 1)
+    return len(text) if newline == -1 else newline + 1
+
+
+def stable_bounds(text: str, budget: int, chunk_chars: int, min_start: int = 0, counter: TokenCounter = None):
+    """
+    (start, recent) for a cache-friendly prompt: the story sent is text[start:], of which
+    text[start:recent] is the stable part and text[recent:] the recent part.
+
+    blocks begin at the first paragraph at or after each multiple of chunk_chars. start is the
+    earliest block start, not before min_start, whose tail fits in budget tokens (-1: no limit),
+    and recent is the start of the last block, so both only move when the text grows or is
+    trimmed by a whole block. the token counts of whole blocks are memoised like paragraphs.
+    """
+    counter = counter or _counter
+    # block starts from the last one back; a block whose paragraph runs to the end of the
+    # text has not begun yet
+    blocks = []
+    for i in range(len(text) // chunk_chars, -1, -1):
+        block = block_start(text, i * chunk_chars)
+        if block < len(text) and (not blocks or block < blocks[-1]):
+            blocks.append(block)
+    recent = blocks[0] if blocks else 0
+    start = recent
+    remaining = budget - counter.count(text[recent:]) if budget >= 0 else 0
+    if remaining < 0:
+        # the last block alone is over budget: keep its end, at about a character per token
+        start = recent = max(recent, len(text) - budget)
+        return start, recent
+    for block in blocks[1:]:
+        if block < min_start:
+            break
+        if budget >= 0:
+            n = counter.count(text[block:start])
+            if n > remaining:
+                break
+            remaining -= n
+        start = block
+    return start, recent
+
+
+def shared_prefix(a: str, b: str) -> int:
+    # length of the common prefix of a and b, in one pass
+    return len(os.path.commonprefix([a, b]))
@@ -2,95 +2,329 @@ from typing import Any, Callable
 from abc import ABC, abstractmethod
 
 from run import completion
+from cache import CompletionCache, cache_key
 
 with open("insertion_prompt.txt", "r") as file:
     insertion_prompt = file.read()
 
-# print to log.txt
-def print_to_log(text: str):
-    with open("log.txt", "a") as file:
-        file.write(text + "\n")
+from logger import INFO, WARNING, logger, print_to_log
 
 
 
 
-from run import completion, openai_completion
-import concurrent.futures
+from run import completion, openai_completion, stream_completion
+from scheduler import OK, Result, scheduler
+from backends import GeminiBackend, OpenAIBackend, TogetherBackend, iter_sync, request_ids, run_sync
+from token_table import load_token_table
+from context import count_tokens, fit_segments, shared_prefix, split_instructions, stable_bounds
+from overlap import check_overlap, fuzzy_overlap
+from summaries import Summarizer
 
-# try call the model. if no response in 1 second, return "error"
+# seconds a completion may take before the caller gives up on it
+request_timeout = 10.0
+
+# call the model on the shared scheduler. returns a Result: ok with the completion text
+# (a list of n texts if n > 1), or timeout / error. the caller is released at the deadline
+# even if the request is still running.
 def call_model(prompt: str,
                 model: str = "Qwen/Qwen1.5-110B-Chat",
                 max_tokens: int = 1000,
                 temperature: float = 0.6,
                 stop: list = ["</s>"],
-                unstable: bool = False):
+                unstable: bool = False,
+                timeout: float = None,
+                n: int = 1) -> Result:
+    if timeout is None:
+        timeout = request_timeout
     if not unstable:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(completion, prompt=prompt, model=model, max_tokens=max_tokens, temperature=temperature, stop=stop)
-            try:
-                return future.result(timeout=1)
-            # except any 
-            except Exception as e:
-                return str(e)
+        return scheduler.run(completion, prompt=prompt, model=model, max_tokens=max_tokens,
+                             temperature=temperature, stop=stop, n=n, timeout=timeout)
     else:
-        return unstable_call_model(prompt, model, max_tokens, temperature, stop)
+        return unstable_call_model(prompt, model, max_tokens, temperature, stop, timeout, n)
     
-import pickle
-# load chinese tokens and unstable tokens
-with open("chinese_tokens.pkl", "rb") as file:
-    chinese_tokens = pickle.load(file)
-with open("unstable_tokens.pkl", "rb") as file:
-    unstable_tokens = pickle.load(file)
+# logit_bias accepts a limited number of tokens per request
+max_logit_bias_tokens = 300
 
 def unstable_call_model(prompt: str,
                         model: str = "Qwen/Qwen1.5-110B-Chat",
                         max_tokens: int = 1000,
                         temperature: float = 0.6,
-                        stop: list = ["</s>"]):
+                        stop: list = ["</s>"],
+                        timeout: float = None,
+                        n: int = 1) -> Result:
     """
     Unstable call for text completion avoids unnatural splits of Chinese tokens. 
     e.g. "我是" should not be split into "我" and "是" in the completion.
     thus, we need to check the last few tokens in the prompt to see if they are in the unstable tokens.
     then, we need to call the model with the last few tokens not in the prompt, but use logit_bias
     to bias the completion towards the last few tokens in the prompt.
-    
+
+    i.e. token healing: the ambiguous tail is trimmed, one token is generated with logit_bias
+    towards the tokens that extend the tail, and the rest of the completion continues from there.
+    the returned text starts right after the original prompt. with n > 1, the candidates
+    share the healed token and differ in the rest.
     """
+    if timeout is None:
+        timeout = request_timeout
 
     max_token_length = 4
-    if len(prompt)<1:
-        return call_model(prompt, model, max_tokens, temperature, stop, unstable=False)
-    # if the last words in the prompt are not in the unstable tokens, return the normal call_model
-    last1 = prompt[-1]
-    last2 = None if len(prompt) < 2 else prompt[-2:]
-    last3 = None if len(prompt) < 3 else prompt[-3:]
-
-    # if none of the last words are in the unstable tokens, return the normal call_model
-    if last1 not in unstable_tokens and last2 not in unstable_tokens and last3 not in unstable_tokens:
-        return call_model(prompt, model, max_tokens, temperature, stop, unstable=False)
+    # the token table is memory-mapped on first use, so sessions without token healing never load it
+    tokens = load_token_table()
+    tail = tokens.unstable_tail(prompt, max_token_length)
+    # if the prompt does not end inside a token, return the normal call_model
+    if not tail:
+        return call_model(prompt, model, max_tokens, temperature, stop, unstable=False, timeout=timeout, n=n)
+
+    head = prompt[:-len(tail)]
+    candidates = tokens.candidates(tail)[:max_logit_bias_tokens]
+    logit_bias = {str(idx): 100 for idx, _ in candidates}
+    first = scheduler.run(openai_completion, prompt=head, model=model, max_tokens=1,
+                          temperature=temperature, stop=stop, logit_bias=logit_bias, timeout=timeout)
+    if not first.ok:
+        return first
+    healed = first.value
+    if not healed.startswith(tail):
+        print_to_log ("token healing ignored the bias (%r -> %r), completing normally", tail, healed, level=INFO)
+        return call_model(prompt, model, max_tokens, temperature, stop, unstable=False, timeout=timeout, n=n)
+    healed = healed[len(tail):]
+    if max_tokens <= 1:
+        return Result(OK, healed if n == 1 else [healed], latency=first.latency)
+    rest = call_model(prompt + healed, model, max_tokens - 1, temperature, stop, unstable=False,
+                      timeout=max(timeout - first.latency, 0), n=n)
+    latency = first.latency + rest.latency
+    if not rest.ok:
+        # the healed token alone is still a valid continuation
+        return Result(OK, healed if n == 1 else [healed], latency=latency)
+    if n > 1:
+        return Result(OK, [healed + text for text in rest.value], latency=latency)
+    return Result(OK, healed + rest.value, latency=latency)
     
 
 class Copilot(ABC):
+
+    # prompt budget in tokens when none is given (see context.py); -1: no limit
+    default_context_tokens = -1
+    # instruction turns in the text, kept whole when the context is trimmed
+    instruction_tags = ("<user>", "</user>")
+    # characters before the cursor that retrieval looks for
+    query_chars = 200
     
     def __init__(self, 
                     sliding_window: int = -1,
                     fill_len: int = 7,
                     system_prompt: str = "",
+                    cache: CompletionCache = None,
+                    context_tokens: int = 0,
+                    n_candidates: int = 1,
                     ):
     
         self.sliding_window = sliding_window
         self.fill_len = fill_len
         self.system_prompt = system_prompt
+        self.cache = cache
+        # 0: the provider's default budget, -1: send the whole text
+        self.context_tokens = context_tokens or self.default_context_tokens
+        # alternative completions requested per Tab (see candidates)
+        self.n_candidates = max(n_candidates, 1)
+        self._backend = None
+        # rolling summaries of the text before the recent window (see use_summaries)
+        self.summaries = None
+        # earlier paragraphs retrieved into the prompt (see use_retrieval)
+        self.retrieval_k = 0
+        # the story is sent in blocks of this many characters, for prefix caching (see use_stable_layout)
+        self.stable_chunk = 0
+        self._last_prompt = ""
+
+    @property
+    def backend(self):
+        # the provider's async backend (see backends.py), made on first use
+        if self._backend is None:
+            self._backend = self.make_backend()
+        return self._backend
+
+    @abstractmethod
+    def make_backend(self):
+        # the provider's backends.Backend
+        pass
+
+    def use_summaries(self, window: int, path: str = None, **options):
+        """
+        send a rolling summary of the chapters and the last `window` or so characters instead
+        of the whole text. options go to summaries.Summarizer.
+        """
+        self.summaries = Summarizer(self.summarize, window, path=path, **options)
+
+    def summary_prompt(self, text: str, max_chars: int):
+        return (f"用不超过{max_chars}字概括下面的小说片段，保留人物、地点、关键情节和伏笔，只输出概括。\n\n"
+                f"{text}\n\n概括：")
+
+    def summarize(self, text: str, max_chars: int) -> str:
+        # called on the summarizer's own worker; errors are handled there, and on timeout run_sync
+        # cancels the request
+        return run_sync(self.backend.complete(self.summary_prompt(text, max_chars), max_chars * 2, 0.3),
+                        timeout=request_timeout * 6)
+
+    def use_retrieval(self, k: int = 3):
+        # add the k paragraphs most like the one being written to the prompt (see retrieval.py)
+        self.retrieval_k = k
+
+    def retrieve(self, buffer, cursor) -> list:
+        """
+        the paragraphs of the buffer most relevant to the text at the cursor, in document order,
+        leaving out the ones the prompt already has as they are.
+        """
+        if self.summaries is not None:
+            recent = self.summaries.window
+        elif self.sliding_window > 0:
+            recent = self.sliding_window
+        elif self.context_tokens > 0:
+            # a token is one or two characters; better to leave out a little too much
+            recent = self.context_tokens * 2
+        else:
+            return []  # the whole text is sent
+        first_row = buffer.lines.position(max(buffer.offset(cursor) - recent, 0))[0]
+        found = buffer.passages.search(buffer.tail(cursor, self.query_chars), self.retrieval_k,
+                                       exclude=range(first_row, cursor.row + 1))
+        print_to_log ("retrieved rows: %s", [row for row, _ in found])
+        return [text for _, text in sorted(found)]
+
+    def with_passages(self, context: dict, buffer, cursor) -> dict:
+        if self.retrieval_k > 0:
+            context["passages"] = self.retrieve(buffer, cursor)
+        return context
+
+    def use_stable_layout(self, chunk_chars: int = 1000):
+        """
+        lay prompts out so that the provider can cache their beginning: the system prompt, the
+        summary, earlier instruction turns and the older text first, in blocks that only move
+        chunk_chars at a time (see context.stable_bounds), then the passages and the recent text.
+        """
+        self.stable_chunk = chunk_chars
+
+    def stable_window(self, text: str, reserved: int = 0):
+        """
+        (instructions, start, recent) of the stable layout: the story sent is text[start:], its
+        stable blocks end at recent, and instructions are the instruction turns before start
+        that are kept, the newest ones, in up to a quarter of the budget.
+        """
+        budget = -1
+        if self.context_tokens >= 0:
+            budget = max(self.context_tokens - reserved - count_tokens(self.system_prompt) - self.fill_len, 0)
+        min_start = max(len(text) - self.sliding_window, 0) if self.sliding_window > 0 else 0
+        start, recent = stable_bounds(text, budget - budget // 4 if budget >= 0 else -1,
+                                      self.stable_chunk, min_start)
+        left = budget // 4
+        kept = []
+        for is_instruction, segment in reversed(split_instructions(text[:start], *self.instruction_tags)):
+            if not is_instruction:
+                continue
+            if budget >= 0:
+                left -= count_tokens(segment)
+                if left < 0:
+                    break
+            kept.append(segment)
+        return "".join(reversed(kept)), start, recent
+
+    def log_prefix_reuse(self, prompt):
+        # how much of the prompt repeats the start of the previous one: what a prefix cache can
+        # reuse. only with the stable layout, and only if it is logged
+        if self.stable_chunk <= 0 or not logger.isEnabledFor(INFO):
+            return
+        prompt = self.flatten(prompt)
+        shared = shared_prefix(prompt, self._last_prompt)
+        self._last_prompt = prompt
+        print_to_log ("prefix reuse: %.0f%% (%d of %d characters)", 100 * shared / max(len(prompt), 1),
+                      shared, len(prompt), level=INFO)
+
+    @staticmethod
+    def flatten(prompt) -> str:
+        # the prompt as one text, for log_prefix_reuse
+        return prompt
+
+    def split_summary(self, text: str):
+        # (summary, recent text); without summaries, all of text is recent
+        if self.summaries is None:
+            return "", text
+        return self.summaries.split(text)
+
+    def cached(self, key_parts, call: Callable[[], str]) -> str:
+        # look up the completion for key_parts in the cache, calling the provider on a miss
+        if self.cache is None:
+            return call()
+        return self.cache.get_or_call(cache_key(*key_parts), call)
+
+    def cached_many(self, key_parts, call: Callable[[], list]) -> list:
+        # like cached, for a batch of n_candidates completions stored as the key's samples
+        if self.cache is None:
+            return call()
+        return self.cache.get_many(cache_key(*key_parts), call, self.n_candidates)
     
+    def fit_context(self, text: str, reserved: int = 0) -> str:
+        """
+        the end of text that fits the token budget, with its instruction turns.
+        reserved tokens are left for the system prompt, the completion and any prompt wrapping.
+        """
+        if self.context_tokens < 0:
+            return text
+        segments = self.fit_segments(split_instructions(text, *self.instruction_tags), reserved)
+        return "".join(segment for _, segment in segments)
+
+    def fit_segments(self, segments, reserved: int = 0) -> list:
+        # fit_context for text already split into (is_instruction, text) segments
+        if self.context_tokens < 0:
+            return segments
+        reserved += count_tokens(self.system_prompt) + self.fill_len
+        return fit_segments(segments, max(self.context_tokens - reserved, 0))
+
+    def context(self, buffer, cursor) -> dict:
+        """
+        keyword arguments for __call__, read from the editor buffer at the cursor.
+        with a sliding window, only the part of the suffix the window can use is extracted.
+        """
+        if self.sliding_window > 0:
+            context = {"text": buffer.prefix(cursor), "suffix": buffer.head(cursor, self.sliding_window)}
+        else:
+            context = {"text": buffer.prefix(cursor), "suffix": buffer.suffix(cursor)}
+        return self.with_passages(context, buffer, cursor)
+
     @abstractmethod
     def __call__(self, text: str, suffix: str = '') -> str:
         pass
 
+    def stream(self, text: str, suffix: str = ''):
+        """
+        yield the completion in pieces as the provider produces them.
+        providers without streaming yield the whole completion at once.
+        """
+        yield self(text, suffix)
+
+    def candidates(self, **context) -> list:
+        """
+        n_candidates alternative completions, from a single request where the provider allows it.
+        takes the same arguments as __call__.
+        """
+        return [self(**context)]
+
+    @abstractmethod
+    async def acomplete(self, text: str) -> str:
+        """
+        the completion for text from the provider's async backend, for batch runs (see batch.py).
+        the cache is not used, and errors are raised so that the caller can retry.
+        """
+        pass
+
+    async def astream(self, text: str):
+        # stream through the async backend, like acomplete
+        yield await self.acomplete(text)
+
 class TogetherCopilot(Copilot):
 
     supported_models = ["Qwen/Qwen1.5-32B",
                         "Qwen/Qwen1.5-32B-chat",
                         "Qwen/Qwen2-72B-Instruct",
                         ]
+    default_context_tokens = 4096
+
     def __init__(self, 
                     sliding_window: int = -1,
                     fill_len: int = 7,
@@ -98,13 +332,20 @@ class TogetherCopilot(Copilot):
                     model: str = "Qwen/Qwen1.5-32B",
                     model_type: str = None,
                     chat_template: str = None,
+                    cache: CompletionCache = None,
+                    token_healing: bool = False,
+                    context_tokens: int = 0,
+                    n_candidates: int = 1,
                     ):
-        super().__init__(sliding_window, fill_len, system_prompt)
+        super().__init__(sliding_window, fill_len, system_prompt, cache, context_tokens, n_candidates)
         self.model = model
+        self.token_healing = token_healing
         if model_type is None:
             self.model_type = "chat" if "chat" in model else "base"
         else:
             self.model_type = model_type
+        if self.model_type == "chat":
+            self.instruction_tags = ("<|im_start|> user", "<|im_end|>")
         supported_chat_template = ['Qwen',]
         if chat_template is None and self.model_type == "chat":
             for template in supported_chat_template:
@@ -112,12 +353,36 @@ class TogetherCopilot(Copilot):
                     self.chat_template = template
                     break
             else:
-                print_to_log ("Chat template not supported, using default = 'Qwen'")
-
-    
-    def __call__(self, text, suffix: str = '') -> str:
-        print_to_log ("text: "+ text)
+                print_to_log ("Chat template not supported, using default = 'Qwen'", level=WARNING)
+
+
+    def context(self, buffer, cursor) -> dict:
+        # a base model only sees the last sliding_window characters (see __call__),
+        # so there is no need to join the whole document, unless it is summarized or laid out
+        # in blocks, which are counted from its start
+        if (self.sliding_window > 0 and self.model_type != "chat" and self.summaries is None
+                and self.stable_chunk <= 0):
+            return self.with_passages({"text": buffer.tail(cursor, self.sliding_window + 1),
+                                       "suffix": buffer.head(cursor, self.sliding_window)}, buffer, cursor)
+        return super().context(buffer, cursor)
+
+    def get_prompt(self, text, passages=()) -> str:
+        print_to_log ("text: %s", text)
+        summary, text = self.split_summary(text)
+        system_prompt = self.system_prompt
+        if summary:
+            system_prompt += f"【前情提要】\n{summary}\n"
+        references = "【相关段落】\n" + "\n".join(passages) + "\n" if passages else ""
+        if self.stable_chunk > 0:
+            prompt = self.stable_prompt(text, system_prompt, references)
+        else:
+            if summary or passages:
+                system_prompt += references + "【正文】\n"
+            prompt = self.window_prompt(text, system_prompt)
+        self.log_prefix_reuse(prompt)
+        return prompt
 
+    def strip_open_turn(self, text: str) -> str:
         # remove the last "user" token if not closed with end token
         if self.model_type == "chat":
             # find the last user token
@@ -126,7 +391,12 @@ class TogetherCopilot(Copilot):
             if "<|im_end|>" not in text[user_token_index:]:
                 # remove the last user token with user_token_index
                 text = text[:user_token_index] + text[user_token_index+len("<|im_start|> user"):]
-                print_to_log ("text after removing last user token: "+ text)
+                print_to_log ("text after removing last user token: %s", text)
+        return text
+
+    def window_prompt(self, text, system_prompt) -> str:
+        text = self.fit_context(text, count_tokens(system_prompt) - count_tokens(self.system_prompt))
+        text = self.strip_open_turn(text)
 
         if self.sliding_window > 0:
             if self.model_type == "chat":
@@ -136,88 +406,271 @@ class TogetherCopilot(Copilot):
                     user_prompt = "" 
                 parsed_text = text.replace("<|im_start|> user\n", "")
                 parsed_text = "<|im_start|> assistant\n" + parsed_text
-                prompt = self.system_prompt + user_prompt + parsed_text[-min(len(parsed_text)-len(user_prompt)-1, self.sliding_window):]
+                prompt = system_prompt + user_prompt + parsed_text[-min(len(parsed_text)-len(user_prompt)-1, self.sliding_window):]
             else: 
-                prompt = self.system_prompt + text[-min(len(text)-1, self.sliding_window):]
+                prompt = system_prompt + text[-min(len(text)-1, self.sliding_window):]
         else:
-            prompt = self.system_prompt + text
+            prompt = system_prompt + text
         
         # if suffix:
         #     prefix = prompt
         #     prompt = eval(f'f"""{insertion_prompt}"""')
         #     print_to_log ("prompt: "+ prompt)
-        
-        response = call_model(prompt, self.model, self.fill_len, 0.8)
-        print_to_log ("response: "+ response)
+        return prompt
+
+    def stable_prompt(self, text, system_prompt, references) -> str:
+        """
+        see use_stable_layout. the passages change from Tab to Tab, so they go between the
+        stable blocks and the recent text.
+        """
+        if self.summaries is not None or self.retrieval_k > 0:
+            system_prompt += "【正文】\n"
+        if references:
+            references += "【正文】\n"
+        text = self.strip_open_turn(text)
+        # the passages are reserved in steps of 256 tokens, so that a few more or less do not
+        # move the window
+        reserved = count_tokens(system_prompt) - count_tokens(self.system_prompt)
+        reserved += -(-count_tokens(references) // 256) * 256
+        instructions, start, recent = self.stable_window(text, reserved)
+        return system_prompt + instructions + text[start:recent] + references + text[recent:]
+
+    def __call__(self, text, suffix: str = '', passages=()) -> str:
+        prompt = self.get_prompt(text, passages)
+        response = self.cached((self.model, prompt, self.fill_len, 0.8),
+                               lambda: self.complete(prompt))
+        print_to_log ("response: %s", response)
         return response
 
-def check_overlap(text, response):
-    # Determine the maximum length of overlap to check
-    max_overlap = min(len(text), len(response))
-    
-    # Iterate through possible lengths of overlap from max to 1
-    for length in range(max_overlap, 0, -1):
-        if text[-length:] == response[:length]:
-            return length  # Return the length of the overlap if found
-    
-    return 0
+    def complete(self, prompt, n: int = 1):
+        # the completion, or a list of n of them; empty if the request failed
+        result = call_model(prompt, self.model, self.fill_len, 0.8, unstable=self.token_healing, n=n)
+        if not result.ok:
+            # never hand an error message to the editor as if it were text
+            print_to_log ("request failed: %s", result, level=WARNING)
+            return "" if n == 1 else []
+        return result.value
+
+    def candidates(self, text, suffix: str = '', passages=()) -> list:
+        if self.n_candidates == 1:
+            return super().candidates(text=text, suffix=suffix, passages=passages)
+        prompt = self.get_prompt(text, passages)
+        # same key as __call__: the batch becomes the samples Tab would otherwise cycle through
+        responses = self.cached_many((self.model, prompt, self.fill_len, 0.8),
+                                     lambda: self.complete(prompt, self.n_candidates))
+        print_to_log ("responses: %s", responses)
+        return responses
+
+    def stream(self, text, suffix: str = '', passages=()):
+        prompt = self.get_prompt(text, passages)
+        yield from stream_completion(prompt, self.model, self.fill_len, 0.8)
+
+    def make_backend(self):
+        return TogetherBackend(self.model)
+
+    def summary_prompt(self, text: str, max_chars: int):
+        prompt = super().summary_prompt(text, max_chars)
+        if self.model_type == "chat":
+            return f"<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n"
+        return prompt
+
+    async def acomplete(self, text: str) -> str:
+        # token healing is not applied here
+        return await self.backend.complete(self.get_prompt(text), self.fill_len, 0.8, stop=["</s>"])
+
+    async def astream(self, text: str, passages=()):
+        async for piece in self.backend.stream(self.get_prompt(text, passages), self.fill_len, 0.8, stop=["</s>"]):
+            yield piece
+
+
+class OpenAICopilot(TogetherCopilot):
+    """
+    any model behind an OpenAI-compatible completions endpoint at base_url: a local vLLM or
+    llama.cpp server, or mock_server.py for offline load tests. prompts are built like Together's.
+    every request goes through the async backend, and one that times out is cancelled.
+    """
+
+    # the model mock_server.py serves. with base_url, get_copilot picks this provider and takes
+    # any model name as is: the endpoint decides what it serves
+    supported_models = ["mock"]
+
+    def __init__(self,
+                    sliding_window: int = -1,
+                    fill_len: int = 7,
+                    system_prompt: str = "",
+                    model: str = "mock",
+                    model_type: str = None,
+                    chat_template: str = None,
+                    cache: CompletionCache = None,
+                    context_tokens: int = 0,
+                    n_candidates: int = 1,
+                    base_url: str = "http://localhost:8000/v1",
+                    ):
+        super().__init__(sliding_window, fill_len, system_prompt, model, model_type, chat_template, cache,
+                         False, context_tokens, n_candidates)
+        self.base_url = base_url
+
+    def make_backend(self):
+        return OpenAIBackend(self.model, self.base_url)
+
+    def complete(self, prompt, n: int = 1):
+        # waited for on the background loop, up to the time this Tab's request has left: this
+        # already runs on a scheduler worker, so a nested scheduler.run could not cut it short
+        request_id = next(request_ids)
+        try:
+            return run_sync(self.backend.complete(prompt, self.fill_len, 0.8, ["</s>"], n, request_id=request_id),
+                            timeout=scheduler.remaining(request_timeout))
+        except TimeoutError:
+            self.backend.cancel(request_id)
+            print_to_log ("request %d timed out, cancelled", request_id, level=WARNING)
+        except Exception as e:
+            print_to_log ("request failed: %r", e, level=WARNING)
+        return "" if n == 1 else []
+
+    def stream(self, text, suffix: str = '', passages=()):
+        yield from iter_sync(self.astream(text, passages))
+
+
+class Message(list):
+    # chat turns, of which the first `stable` are the cacheable prefix (see GeminiCopilot.stable_message)
+    def __init__(self, turns=(), stable: int = 0):
+        super().__init__(turns)
+        self.stable = stable
+
 
-import google.generativeai as genai
-import os
-genai.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
 class GeminiCopilot(Copilot):
     supported_models = ["gemini-1.5-pro-002", "gemini-1.5-flash-002", "gemini-1.5-flash", "gemini-1.5-pro", 
                         'gemini-1.5-pro-exp-0801', 'gemini-exp-1121', 'gemini-exp-1114']
+    default_context_tokens = 16384
+    # the default turn and the continuation request get_message adds around the text
+    wrapper_tokens = 64
+
     def __init__(self, 
                     sliding_window: int = -1,
                     fill_len: int = 7,
                     system_prompt: str = "",
                     model: str = "gemini-1.5-flash", # "flash" or "pro"
+                    cache: CompletionCache = None,
+                    context_tokens: int = 0,
+                    n_candidates: int = 1,
                     ):
-        super().__init__(sliding_window, fill_len, system_prompt)
+        super().__init__(sliding_window, fill_len, system_prompt, cache, context_tokens, n_candidates)
         self.model = model
+        # seconds the stable turns are kept as cached content on Gemini's side; 0: not cached
+        self.context_cache_ttl = 0
+        self.context_cache_min_tokens = 32768
+
+    def use_context_cache(self, ttl: float = 3600, min_tokens: int = 32768):
+        """
+        with the stable layout, register the stable turns as Gemini cached content and send only
+        the rest, reusing the cache until it expires or the turns change. Gemini does not cache
+        fewer than min_tokens tokens.
+        """
+        self.context_cache_ttl = ttl
+        self.context_cache_min_tokens = min_tokens
         
-    def get_message(self,text, suffix: str = ''):
+    def context(self, buffer, cursor) -> dict:
+        # the buffer keeps its <user> blocks indexed, so the document is not joined or scanned
+        # here; Gemini does not use the suffix. summaries and the stable layout need the whole text
+        if self.summaries is not None or self.stable_chunk > 0:
+            return self.with_passages({"text": buffer.prefix(cursor)}, buffer, cursor)
+        return self.with_passages({"segments": buffer.segments(cursor)}, buffer, cursor)
+
+    def prepare(self, text: str = "", segments=None, passages=()):
+        """
+        fit the text before the cursor to the budget and turn it into chat turns.
+        segments, the text already split at its <user> blocks (see Buffer.segments), are used
+        instead of scanning text. returns the text that is sent, the message and the prefill length.
+        """
+        summary = ""
+        if segments is None:
+            summary, text = self.split_summary(text)
+            if self.stable_chunk > 0:
+                text, message, prefill_len = self.stable_message(text, summary, passages)
+                self.log_prefix_reuse(message)
+                return text, message, prefill_len
+            segments = split_instructions(text, *self.instruction_tags)
+        references = []
+        if summary:
+            references.append(f"前情提要：\n{summary}")
+        if passages:
+            references.append("相关段落：\n" + "\n".join(passages))
+        segments = self.fit_segments(segments, self.wrapper_tokens + sum(map(count_tokens, references)))
+        text = "".join(segment for _, segment in segments)
+        message, prefill_len = self.get_message(text, segments=segments)
+        if references:
+            # the summary and passages open the conversation, as the user's first turn
+            if message[0]["role"] == "user":
+                message[0] = {"role": "user", "parts": references + message[0]["parts"]}
+            else:
+                message.insert(0, {"role": "user", "parts": references})
+        return text, message, prefill_len
+
+    def stable_message(self, text: str, summary: str = "", passages=()):
+        """
+        prepare for the stable layout (see use_stable_layout). the summary, the instruction turns
+        and the stable blocks become the first message.stable turns, the recent text the rest as
+        get_message makes it, and the passages go in the last user turn.
+        """
+        references = "相关段落：\n" + "\n".join(passages) if passages else ""
+        reserved = self.wrapper_tokens + count_tokens(summary) + -(-count_tokens(references) // 256) * 256
+        instructions, start, recent = self.stable_window(text, reserved)
+        open_tag, close_tag = self.instruction_tags
+        opened = text.rfind(open_tag, start, recent)
+        if opened != -1 and text.find(close_tag, opened, recent) == -1:
+            # an instruction turn is not split between the two parts
+            recent = opened
+        stable = [{"role": "user", "parts": [f"前情提要：\n{summary}"]}] if summary else []
+        for is_instruction, segment in split_instructions(instructions + text[start:recent], open_tag, close_tag):
+            if not is_instruction:
+                stable.append({"role": "model", "parts": [segment]})
+            elif segment.endswith(close_tag) and len(segment) >= len(open_tag) + len(close_tag):
+                stable.append({"role": "user", "parts": [segment[len(open_tag):-len(close_tag)]]})
+        message, prefill_len = self.get_message(text[recent:])
+        if references:
+            message[-1] = {"role": "user", "parts": [references] + message[-1]["parts"]}
+        return instructions + text[start:], Message(stable + message, len(stable)), prefill_len
+
+    @staticmethod
+    def flatten(message) -> str:
+        return "".join(f"{turn['role']}: {''.join(turn['parts'])}\n" for turn in message)
+
+    def get_message(self, text, suffix: str = '', segments=None):
         message = []
         if not text:
             default_user_prompt = "给我写一段小说"
             message.append({"role": "user", "parts": [default_user_prompt]}) 
 
-        # we looks for each user prompt enclosed with "<user>" and "</user>" in a loop
-        # then, we iteratively add the user prompt to the message
-        # we also add everything in between the user prompts as model response
-        unprocessed_text = text
-        while True:
-            user_prompt_start = unprocessed_text.find("<user>")
-            user_prompt_end = unprocessed_text.find("</user>")
-            if user_prompt_start != -1:
-                if user_prompt_end != -1:
-                    user_prompt = unprocessed_text[user_prompt_start+len("<user>"):user_prompt_end]
-                    model_completion = unprocessed_text[:user_prompt_start]
-                    if model_completion:
-                        message.append({"role": "model", "parts": [model_completion]})
-                    message.append({"role": "user", "parts": [user_prompt]})
-                    unprocessed_text = unprocessed_text[user_prompt_end+len("</user>"):]
-                else: # unclosed user prompt. we ask model to complete the prompt
-                    if unprocessed_text[:user_prompt_start]:
-                        message.append({"role": "model", "parts": [unprocessed_text[:user_prompt_start]]})
-                    
-                    unprocessed_text = unprocessed_text[user_prompt_start+len("<user>"):]
-                    # complete_prompt_prompt = '帮助用户编辑下一条prompt，根据已有的prompt补全。'
-                    complete_prompt_prompt = 'User has an unfinished prompt. Please help complete the prompt based on the existing prompt. A prompt is an instruction or a plot line of the following story, not the story itself. Infos to include: 人物、剧情、风格、注意, etc.'
-                    
-                    prompt = f'{complete_prompt_prompt}\nUser: {unprocessed_text}'
-
-                    last_paragraph_index = unprocessed_text.rfind("\n")
-
-                    prompt += f'\nContinue from here, and do not repeat the previous content: {unprocessed_text[last_paragraph_index:]}'
-                    message.append({"role": "user", "parts": [prompt]})
-
-                    return message, len(unprocessed_text) - last_paragraph_index
-                
-            else:
-                break
-        message.append({"role": "model", "parts": [unprocessed_text]})
+        # story between the user prompts enclosed with "<user>" and "</user>" becomes model
+        # responses, the prompts become user turns. the text is split once, front to back
+        if segments is None:
+            segments = split_instructions(text, *self.instruction_tags)
+        open_tag, close_tag = self.instruction_tags
+        model_completion = ""
+        for is_instruction, segment in segments:
+            if not is_instruction:
+                model_completion = segment
+                continue
+            if model_completion:
+                message.append({"role": "model", "parts": [model_completion]})
+            model_completion = ""
+            if segment.endswith(close_tag) and len(segment) >= len(open_tag) + len(close_tag):
+                message.append({"role": "user", "parts": [segment[len(open_tag):-len(close_tag)]]})
+                continue
+            # unclosed user prompt. we ask model to complete the prompt
+            unprocessed_text = segment[len(open_tag):]
+            # complete_prompt_prompt = '帮助用户编辑下一条prompt，根据已有的prompt补全。'
+            complete_prompt_prompt = 'User has an unfinished prompt. Please help complete the prompt based on the existing prompt. A prompt is an instruction or a plot line of the following story, not the story itself. Infos to include: 人物、剧情、风格、注意, etc.'
+
+            prompt = f'{complete_prompt_prompt}\nUser: {unprocessed_text}'
+
+            last_paragraph_index = unprocessed_text.rfind("\n")
+
+            prompt += f'\nContinue from here, and do not repeat the previous content: {unprocessed_text[last_paragraph_index:]}'
+            message.append({"role": "user", "parts": [prompt]})
+
+            return message, len(unprocessed_text) - last_paragraph_index
+        message.append({"role": "model", "parts": [model_completion]})
 
         last_paragraph_index = text.rfind("\n")
         if last_paragraph_index != -1:
@@ -230,82 +683,171 @@ class GeminiCopilot(Copilot):
         message.append({"role": "user", "parts": [continuation_prompt]})
         return message, prefill_len
     
-    def __call__(self, text, suffix: str = '') -> str:
-        if self.system_prompt:
-            gen_model = genai.GenerativeModel(self.model,
-                                            system_instruction=self.system_prompt)
-        else:
-            gen_model = genai.GenerativeModel(self.model)
-
-        message, prefill_len = self.get_message(text, suffix)
-
-        print_to_log ("message:"+ str(message))
-        response = gen_model.generate_content(message,
-                                              safety_settings={'HARASSMENT':'block_none',
-                                                   'SEXUALLY_EXPLICIT': 'block_none',
-                                                   'HATE_SPEECH': 'block_none',
-                                                   'DANGEROUS': 'block_none',
-                                                   # 'CIVIC_INTEGRITY': 'block_none',
-                                                   },
-                                              generation_config=genai.types.GenerationConfig(
-                                                    # candidate_count=1,
-                                                    # stop_sequences=['x'],
-                                                    # max_output_tokens=self.fill_len,
-                                                    max_output_tokens=self.fill_len + prefill_len,
-                                                    temperature=0.5)
-                                              ).text
+    def make_backend(self):
+        return GeminiBackend(self.model, self.system_prompt)
+
+    def summary_prompt(self, text: str, max_chars: int):
+        return [{"role": "user", "parts": [super().summary_prompt(text, max_chars)]}]
+
+    @property
+    def gen_model(self):
+        return self.backend.gen_model
+
+    def generate(self, message, max_output_tokens, stream=False, candidate_count=1):
+        stable = getattr(message, "stable", 0)
+        if stable and self.context_cache_ttl > 0:
+            model = self.backend.cached_model(message[:stable], self.context_cache_ttl,
+                                              self.context_cache_min_tokens)
+            if model is not None:
+                return self.backend.generate(message[stable:], max_output_tokens, 0.5, stream=stream,
+                                             candidate_count=candidate_count, model=model)
+        return self.backend.generate(message, max_output_tokens, 0.5, stream=stream,
+                                     candidate_count=candidate_count)
+
+    async def acomplete(self, text: str) -> str:
+        text, message, prefill_len = self.prepare(text)
+        return self.postprocess(text, await self.backend.complete(message, self.fill_len + prefill_len, 0.5))
+
+    def __call__(self, text: str = "", suffix: str = '', segments=None, passages=()) -> str:
+        text, message, prefill_len = self.prepare(text, segments, passages)
+
+        print_to_log ("message: %s", message)
+        response = self.cached((self.model, self.system_prompt, message, self.fill_len + prefill_len, 0.5),
+                               lambda: self.generate(message, self.fill_len + prefill_len).text)
 
         
-        print_to_log ("max_token: "+ str(self.fill_len+prefill_len))
-        print_to_log ("response: "+ response)
-
+        print_to_log ("max_token: %d", self.fill_len + prefill_len)
+        print_to_log ("response: %s", response)
+        return self.postprocess(text, response)
+
+    def candidates(self, text: str = "", suffix: str = '', segments=None, passages=()) -> list:
+        if self.n_candidates == 1:
+            return super().candidates(text=text, suffix=suffix, segments=segments, passages=passages)
+        text, message, prefill_len = self.prepare(text, segments, passages)
+        print_to_log ("message: %s", message)
+
+        def generate():
+            response = self.generate(message, self.fill_len + prefill_len,
+                                     candidate_count=self.n_candidates)
+            # response.text only works for a single candidate
+            return ["".join(part.text for part in candidate.content.parts)
+                    for candidate in response.candidates]
+
+        responses = self.cached_many((self.model, self.system_prompt, message, self.fill_len + prefill_len, 0.5),
+                                     generate)
+        print_to_log ("responses: %s", responses)
+        return [self.postprocess(text, response) for response in responses]
+
+    def stream(self, text: str = "", suffix: str = '', segments=None, passages=()):
+        text, message, prefill_len = self.prepare(text, segments, passages)
+        print_to_log ("message: %s", message)
+        # the model usually repeats the last paragraph (prefill_len characters) first,
+        # so hold the stream back until the overlap with the text can be measured
+        head = ""
+        held = True
+        for chunk in self.generate(message, self.fill_len + prefill_len, stream=True):
+            if not held:
+                yield correct_spacing(chunk.text.replace("User: ", ""))
+                continue
+            head += chunk.text
+            if len(head) > prefill_len:
+                yield self.postprocess(text, head)
+                held = False
+        if held and head:
+            yield self.postprocess(text, head)
+
+    def postprocess(self, text, response):
         # strip away "User: "
         response = response.replace("User: ", "")
 
-        overlap = check_overlap(text, response)
-        print_to_log ("overlap length: "+ str(overlap))
+        # the repeated last line may come back with different spacing or punctuation
+        overlap = check_overlap(text, response) or fuzzy_overlap(text, response)
+        print_to_log ("overlap length: %d", overlap)
         response = response[overlap:]
 
         # strip away ...
         if response[:3] == '...':
             response = response[3:]
 
-        import regex
-
-        def correct_spacing(text):
-            # Regex pattern to match punctuation or Chinese characters followed by a space
-            # but not followed by a newline
-            pattern = regex.compile(r'([\p{P}\p{Han}])[ \t](?!\n)')
-            # Replace occurrences found by the pattern with the character without the space
-            corrected_text = regex.sub(pattern, r'\1', text)
-            return corrected_text
-
-
         # Assuming the rest of the code is unchanged, apply the correction to the response:
-        response = correct_spacing(response)
-        
-        return response
+        return correct_spacing(response)
+
 
+# compiled once, on the first call, so that importing this module does not import regex
+_spacing_pattern = None
 
-def get_copilot(model=None, provider=None, sliding_window=-1, fill_len=7, system_prompt = ''):
+def correct_spacing(text):
+    global _spacing_pattern
+    if _spacing_pattern is None:
+        import regex
+        # Regex pattern to match punctuation or Chinese characters followed by a space
+        # but not followed by a newline
+        _spacing_pattern = regex.compile(r'([\p{P}\p{Han}])[ \t](?!\n)')
+    # Replace occurrences found by the pattern with the character without the space
+    corrected_text = _spacing_pattern.sub(r'\1', text)
+    return corrected_text
+
+
+# provider name -> copilot class. a provider's SDK is only imported when its copilot
+# makes its first request, so registering it here costs nothing at startup
+providers = {
+    "together": TogetherCopilot,
+    "gemini": GeminiCopilot,
+    "openai": OpenAICopilot,
+}
+
+# modules each provider imports on its first request (see --profile-startup in ai_editor.py)
+provider_modules = {
+    "together": ["together", "openai", "httpx"],
+    "gemini": ["google.generativeai", "regex"],
+    "openai": ["openai", "httpx", "asyncio"],
+}
+
+def get_copilot(model=None, provider=None, sliding_window=-1, fill_len=7, system_prompt = '', cache=None, token_healing=False,
+                context_tokens=0, n_candidates=1, base_url=None, summary_window=0, summary_path=None, retrieval_k=0,
+                stable_chunk=0, context_cache_ttl=0, context_cache_min_tokens=32768):
     """
-    returns a copilot object based on the provider
+    returns a copilot object based on the provider.
+    with base_url, the model is served by the OpenAI-compatible endpoint there.
+    with summary_window, earlier chapters are sent as summaries (see summaries.py).
+    with retrieval_k, that many related earlier paragraphs are added (see retrieval.py).
+    with stable_chunk, prompts are laid out for prefix caching (see Copilot.use_stable_layout),
+    and Gemini also caches the stable turns for context_cache_ttl seconds.
     """
-    # create a list of models that are supported by each provider
-    
-    if model is None:
+    if base_url:
+        provider = "openai"
+        model = model or "mock"
+    elif model is None:
         model = "Qwen/Qwen2-72B-Instruct"
         provider = "together"
     else:
-        if model in TogetherCopilot.supported_models:
-            provider = "together"
-        elif model in GeminiCopilot.supported_models:
-            provider = "gemini"
-        else:
-            raise ValueError("Model not supported by any provider")
+        provider = get_provider(model)
 
-    if provider == "gemini":
-        return GeminiCopilot(sliding_window=sliding_window, fill_len=fill_len, system_prompt=system_prompt, model=model)
+    options = {}
     if provider == "together":
-        return TogetherCopilot(sliding_window=sliding_window, fill_len=fill_len, system_prompt=system_prompt, model=model)
-    
\ No newline at end of file
+        options["token_healing"] = token_healing
+    elif provider == "openai" and base_url:
+        options["base_url"] = base_url
+    copilot = providers[provider](sliding_window=sliding_window, fill_len=fill_len, system_prompt=system_prompt,
+                                  model=model, cache=cache, context_tokens=context_tokens,
+                                  n_candidates=n_candidates, **options)
+    if summary_window > 0:
+        copilot.use_summaries(summary_window, summary_path)
+    if retrieval_k > 0:
+        copilot.use_retrieval(retrieval_k)
+    if stable_chunk > 0:
+        copilot.use_stable_layout(stable_chunk)
+        if provider == "gemini" and context_cache_ttl > 0:
+            copilot.use_context_cache(context_cache_ttl, context_cache_min_tokens)
+    return copilot
+
+def supported_models() -> list:
+    # every model name get_provider knows, for --model's help
+    return [model for copilot_class in providers.values() for model in copilot_class.supported_models]
+
+def get_provider(model) -> str:
+    # the registered provider that supports model
+    for provider, copilot_class in providers.items():
+        if model in copilot_class.supported_models:
+            return provider
+    raise ValueError("Model not supported by any provider")
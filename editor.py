@@ -1,17 +1,17 @@
 import argparse
 import curses
+import json
 import sys
-import wcwidth
 import locale
 from utils import save_text, save_buffer, ascii_to_key
+from rope import LineRope
+from instructions import InstructionIndex
+from retrieval import PassageIndex
+from layout import char_width, get_layout
 
 # Ensure the locale is set to support UTF-8
 locale.setlocale(locale.LC_ALL, '')
 
-def char_width(character):
-    width = wcwidth.wcwidth(character)
-    return max(0, width)
-
 def line_width(line):
     return sum(char_width(c) for c in line)
 
@@ -19,32 +19,46 @@ def get_line_height(line, n_cols):
     """
     line: str
     n_cols: int
-    return: int, int
+    return: int, number of extra display rows the wrapped line takes
     """
-
-    lw = 0
-    line_rows = 0
-    line += ' '
-    for cursor_col in range(len(line)):
-        # lw = line_width(buffer[cursor.row][line_start:cursor_col+1])
-        lw += char_width(line[cursor_col])
-        if lw < n_cols:
-            continue
-        line_rows += 1
-        # line_start = cursor_col + 1 
-        lw = 0
-    return line_rows
+    return get_layout(line, n_cols).height
 
 class Buffer:
     def __init__(self, lines):
-        self.lines = lines
-        self.word_count = sum([len(line) for line in lines])
+        self.lines = LineRope(lines or [""])
+        self.word_count = sum([len(line) for line in self.lines])
+        # bumped on every edit, so background work can tell whether the text changed under it
+        self.version = 0
+        self.instructions = InstructionIndex(self.lines)
+        # paragraphs indexed for retrieval (see retrieval.py), made when retrieval first asks for it
+        self._passages = None
 
     def __len__(self):
         return len(self.lines)
 
+    @property
+    def passages(self):
+        if self._passages is None:
+            self._passages = PassageIndex(self.lines)
+        return self._passages
+
+    def _replaced(self, row, count, lines):
+        # keep the indexes in step with lines[row:row + count] = lines
+        self.instructions.replace(row, count, lines)
+        if self._passages is not None:
+            self._passages.replace(row, count, lines)
+
+    def _edited(self, row, col, line, inserted=""):
+        # _replaced for an edit within one line, at col
+        self.instructions.edit(row, col, line, inserted)
+        if self._passages is not None:
+            self._passages.replace(row, 1, [line])
+
     def __getitem__(self, index):
         return self.lines[index]
+
+    def __iter__(self):
+        return iter(self.lines)
     
     # get all text before cursor
     def prefix(self, cursor):
@@ -55,39 +69,95 @@ class Buffer:
     def suffix(self, cursor):
         if cursor.row == len(self) - 1:
             return self[cursor.row][cursor.col:]
-        return self[cursor.row][cursor.col:] + "\n".join(self.lines[cursor.row + 1:])
+        return self[cursor.row][cursor.col:] + "\n" + "\n".join(self.lines.iter_from(cursor.row + 1))
         
 
+    def offset(self, cursor):
+        # document offset of the cursor, i.e. len(self.prefix(cursor))
+        return self.lines.offset(cursor.row) + cursor.col
+
+    def text(self, start, end):
+        # text between two (row, col) positions, built from the lines it spans only
+        (row, col), (end_row, end_col) = start, end
+        if row == end_row:
+            return self.lines[row][col:end_col]
+        lines = self.lines[row:end_row + 1]
+        lines[0] = lines[0][col:]
+        lines[-1] = lines[-1][:end_col]
+        return "\n".join(lines)
+
+    def tail(self, cursor, n_chars):
+        """
+        the last n_chars characters before the cursor, i.e. self.prefix(cursor)[-n_chars:],
+        built from the lines it spans only.
+        """
+        start = max(self.offset(cursor) - n_chars, 0)
+        return self.text(self.lines.position(start), (cursor.row, cursor.col))
+
+    def head(self, cursor, n_chars):
+        # the first n_chars characters after the cursor, i.e. self.suffix(cursor)[:n_chars]
+        end = self.lines.position(self.offset(cursor) + n_chars)
+        return self.text((cursor.row, cursor.col), end)
+
+    def segments(self, cursor):
+        # the text before the cursor split at <user> instructions, see InstructionIndex
+        return self.instructions.segments(self, cursor)
+
     @property
     def bottom(self):
         return len(self) - 1
 
     def insert(self, cursor, string):
+        # string may contain newlines; the affected line is replaced in one operation
         row, col = cursor.row, cursor.col
-        current = self.lines.pop(row)
-        new = current[:col] + string + current[col:]
-        self.lines.insert(row, new)
+        if "\n" not in string:
+            line = self.lines.splice(row, col, col, string)
+            self._edited(row, col, line, string)
+        else:
+            current = self.lines[row]
+            new_lines = string.split("\n")
+            new_lines[0] = current[:col] + new_lines[0]
+            new_lines[-1] += current[col:]
+            self.lines.replace(row, 1, new_lines)
+            self._replaced(row, 1, new_lines)
         self.word_count += len(string)
+        self.version += 1
 
     def split(self, cursor):
         row, col = cursor.row, cursor.col
-        current = self.lines.pop(row)
-        self.lines.insert(row, current[:col])
-        self.lines.insert(row + 1, current[col:])
+        current = self.lines[row]
+        new_lines = [current[:col], current[col:]]
+        self.lines.replace(row, 1, new_lines)
+        self._replaced(row, 1, new_lines)
         self.word_count += 1
+        self.version += 1
 
     def delete(self, cursor):
         row, col = cursor.row, cursor.col
-        if col < len(self[row]): # if left did not move cursor up
-            current = self.lines.pop(row) 
-            new = current[:col] + current[col+1:]
-            self.lines.insert(row, new)
+        current = self.lines[row]
+        if col < len(current): # if left did not move cursor up
+            line = self.lines.splice(row, col, col + 1, "")
+            self._edited(row, col, line)
         else: # if left moved cursor up
-            current = self.lines.pop(row) 
-            next = self.lines.pop(row)
-            new = current + next
-            self.lines.insert(row, new)
+            next = self.lines[row + 1]
+            self.lines.replace(row, 2, [current + next])
+            self._replaced(row, 2, [current + next])
         self.word_count -= 1
+        self.version += 1
+
+    def delete_range(self, start, end):
+        # delete the text between two (row, col) positions; the lines it spans are replaced in one operation
+        (row, col), (end_row, end_col) = start, end
+        removed = self.lines.offset(end_row) + end_col - self.lines.offset(row) - col
+        new_lines = [self.lines[row][:col] + self.lines[end_row][end_col:]]
+        if row == end_row:
+            self.lines[row] = new_lines[0]
+            self._edited(row, col, new_lines[0])
+        else:
+            self.lines.replace(row, end_row - row + 1, new_lines)
+            self._replaced(row, end_row - row + 1, new_lines)
+        self.word_count -= removed
+        self.version += 1
 
 
 def clamp(x, lower, upper):
@@ -154,19 +224,67 @@ class Window:
         return self.row + self.n_rows - 1
 
     def up(self, buffer, cursor):
-        if cursor.row == self.row - 1 and self.row > 0:
+        while cursor.row < self.row:
             self.row -= 1
             # self.row_offset += (line_width(buffer[self.row])+1)//self.n_cols
             self.row_offset += get_line_height(buffer[self.row], self.n_cols)
 
     def down(self, buffer, cursor):
-        # line_height = (line_width(buffer[cursor.row]))//self.n_cols
         cursor_line_height = get_line_height(buffer[cursor.row], self.n_cols)
-        while self.translate(cursor, buffer)[0] + cursor_line_height >= self.n_rows - 1 :
-            # self.row_offset -= (line_width(buffer[self.row])+1)//self.n_cols
-            self.row_offset -= get_line_height(buffer[self.row], self.n_cols)
+        display_row = self.translate(cursor, buffer)[0]
+        while display_row + cursor_line_height >= self.n_rows - 1:
+            # scrolling past a line moves the cursor up by the rows that line took
+            line_height = get_line_height(buffer[self.row], self.n_cols)
+            self.row_offset -= line_height
             self.row += 1
-            # cursor_line_height = get_line_height(buffer[self.row], self.n_cols)
+            display_row -= line_height + 1
+
+    def show(self, buffer, cursor):
+        """
+        scroll to a cursor that jumped (see Editor.goto), laying out only the lines on the screen.
+        the row offsets are re-based on the window's first row: translate only uses their sum.
+        """
+        if cursor.row < self.row:
+            # going up, the cursor's line becomes the first on screen
+            self.row = cursor.row
+            self.row_offset = cursor.row_offset = 0
+            return
+        # the display rows from the window down to the cursor, if they fit on the screen
+        rows = 0
+        row = self.row
+        while row < cursor.row and rows < self.n_rows:
+            rows += get_line_height(buffer[row], self.n_cols) + 1
+            row += 1
+        if row == cursor.row and rows < self.n_rows:
+            self.row_offset = 0
+            cursor.row_offset = rows - (cursor.row - self.row)
+            self.down(buffer, cursor)
+            return
+        # far below: the cursor's line goes at the bottom, as scrolling down to it would leave it
+        self.row = cursor.row
+        self.row_offset = cursor.row_offset = 0
+        cursor_line_height = get_line_height(buffer[cursor.row], self.n_cols)
+        display_row = self.translate(cursor, buffer)[0]
+        while self.row > 0:
+            line_height = get_line_height(buffer[self.row - 1], self.n_cols)
+            if display_row + line_height + 1 + cursor_line_height >= self.n_rows - 1:
+                break
+            self.row -= 1
+            self.row_offset += line_height
+            display_row += line_height + 1
+
+    def page_rows(self, buffer, start, direction):
+        # the number of lines from start that fill a screen going down (1) or up (-1), at least one
+        rows = 0
+        count = 0
+        row = start
+        while 0 <= row < len(buffer):
+            rows += get_line_height(buffer[row], self.n_cols) + 1
+            if rows > self.n_rows - 1 and count:
+                break
+            count += 1
+            row += direction
+        return max(count, 1)
 
     # def horizontal_scroll(self, cursor, left_margin=5, right_margin=2):
     #     n_pages = cursor.col // (self.n_cols - right_margin)
@@ -174,28 +292,19 @@ class Window:
 
     def translate(self, cursor, buffer):
         display_row = cursor.row - self.row + self.row_offset + cursor.row_offset
-        line_start = 0
-        lw = 0
-        for cursor_col in range(cursor.col):
-            # lw = line_width(buffer[cursor.row][line_start:cursor_col+1])
-            lw += char_width(buffer[cursor.row][cursor_col])
-            if lw < self.n_cols:
-                continue
-            display_row += 1
-            # line_start = cursor_col + 1 
-            lw = 0
-        return display_row, lw
-
-        # lw = line_width(buffer[cursor.row][:cursor.col])
-        # return display_row + (lw)//(self.n_cols-1), lw % (self.n_cols-1)
+        wrapped_rows, lw = get_layout(buffer[cursor.row], self.n_cols).translate(cursor.col)
+        return display_row + wrapped_rows, lw
 
 
 
 class Editor:
-    def __init__(self, stdscr, filename, keypresses_list = [], func_after_keypress = None, func_before_keypress = None, auto_save=False):
+    def __init__(self, stdscr, filename, keypresses_list = [], func_after_keypress = None, func_before_keypress = None, auto_save=False, record_keys=None, func_on_idle = None, input_timeout = None):
         self.stdscr = stdscr
-        self.window = Window(curses.LINES - 1, curses.COLS - 1)
-        self.cursor = Cursor(n_cols = curses.COLS-1)
+        n_lines, n_cols = stdscr.getmaxyx()
+        self.window = Window(n_lines - 1, n_cols - 1)
+        self.cursor = Cursor(n_cols = n_cols - 1)
+        # what is currently drawn on each screen row, used to redraw only the rows that changed
+        self.screen_rows = []
         self.filename = filename
         if filename:
             self.buffer = Buffer(self.read_file(filename).splitlines())
@@ -206,12 +315,19 @@ class Editor:
         self.func_before_keypress = func_before_keypress
         self.saved = False
         self.auto_save = auto_save
+        # optional file to record keystrokes into, one json value per line (see bench_buffer.py)
+        self.key_log = open(record_keys, "a") if record_keys else None
+        # with input_timeout (ms), get_wch gives up after that long and func_on_idle runs instead,
+        # so background results can be shown while the user is not typing
+        self.func_on_idle = func_on_idle
+        self.input_timeout = input_timeout
     def display_welcomepage(self):
         instructions = """
 - backspace or delete: delete the character before the cursor
 - esc: exit the editor and save the text
 - ctrl + t: save the text
 - ctrl + n: go to the bottom of the text
+- page down / page up: scroll by a screen
 - right arrow: move cursor right
 - left arrow: move cursor left
 - down arrow: move cursor down
@@ -241,36 +357,37 @@ class Editor:
         with open(filename) as f:
             return f.read()
 
+    def invalidate(self):
+        # forget what is on screen, e.g. after another page drew over it
+        self.screen_rows = []
+
     def display_buffer(self):
-        self.stdscr.erase()
-        display_rows = 0
-        for row, line in enumerate(self.buffer[self.window.row:]):
-            chunks = []
-            line = line.strip() + " "
-            while True:
-                chunk = ""
-                chunk_width = 0
-                while line and chunk_width < self.window.n_cols:
-                    chunk += line[0]
-                    line = line[1:]
-                    chunk_width += char_width(chunk[-1])
-                chunks.append(chunk)
-                if not line:
-                    break
-
-            for i, chunk in enumerate(chunks):
-                if display_rows + i < self.window.n_rows:
-                    self.stdscr.addstr(display_rows + i, 0, chunk)
-                else:
-                    break
-            display_rows += len(chunks)
+        rows = []
+        n_rows = self.window.n_rows
+        for line in self.buffer.lines.iter_from(self.window.row):
+            rows.extend(get_layout(line, self.window.n_cols).chunks(line))
+            if len(rows) >= n_rows:
+                break
+        del rows[n_rows:]
+        rows.extend([""] * (n_rows - len(rows)))
         # use last line to display col, row, row_offsets, word_count
         if not self.saved:
-            self.stdscr.addstr(curses.LINES-1, 0, f"row: {self.cursor.row}, col: {self.cursor.col}, w_row: {self.window.row} w_row_off: {self.window.row_offset}, c_row_off: {self.cursor.row_offset}, word_count: {self.buffer.word_count}")
+            rows.append(f"row: {self.cursor.row}, col: {self.cursor.col}, w_row: {self.window.row} w_row_off: {self.window.row_offset}, c_row_off: {self.cursor.row_offset}, word_count: {self.buffer.word_count}")
         else:
-            self.stdscr.addstr(curses.LINES-1, 0, f"row: {self.cursor.row}, col: {self.cursor.col}, w_row_off: {self.window.row_offset}, c_row_off: {self.cursor.row_offset}, word_count: {self.buffer.word_count} - saved")
+            rows.append(f"row: {self.cursor.row}, col: {self.cursor.col}, w_row_off: {self.window.row_offset}, c_row_off: {self.cursor.row_offset}, word_count: {self.buffer.word_count} - saved")
         self.saved = False
 
+        if len(self.screen_rows) != len(rows):
+            self.stdscr.erase()
+            self.screen_rows = [""] * len(rows)
+        for i, chunk in enumerate(rows):
+            if chunk != self.screen_rows[i]:
+                self.stdscr.move(i, 0)
+                self.stdscr.clrtoeol()
+                if chunk:
+                    self.stdscr.addstr(i, 0, chunk)
+                self.screen_rows[i] = chunk
+
     def translate_cursor(self):
         self.stdscr.move(*self.window.translate(self.cursor, self.buffer))
 
@@ -283,16 +400,81 @@ class Editor:
         self.window.down(self.buffer, self.cursor)
     
     def insert(self, string):
-        for char in string:
-            if char == "\n":
-                self.buffer.split(self.cursor)
-            else:
-                self.buffer.insert(self.cursor, char)
-            self.right()
+        """
+        insert string at the cursor in one buffer operation, newlines included, and move the
+        cursor to its end and the window after it once.
+        """
+        if not string:
+            return
+        row = self.cursor.row
+        self.buffer.insert(self.cursor, string)
+        newlines = string.count("\n")
+        if newlines:
+            # the rows the cursor passes, as right() would have counted them
+            for passed in range(row, row + newlines):
+                self.cursor.row_offset += get_line_height(self.buffer[passed], self.cursor.n_cols)
+            self.cursor.row += newlines
+            self.cursor.col = len(string) - string.rfind("\n") - 1
+        else:
+            self.cursor.col += len(string)
+        self.window.down(self.buffer, self.cursor)
+
+    def delete_before(self, n):
+        """
+        delete the n characters before the cursor (backspace n times) in one buffer operation,
+        moving the cursor and the window once.
+        """
+        end = self.buffer.offset(self.cursor)
+        if n <= 0 or end == 0:
+            return
+        row, col = self.buffer.lines.position(max(end - n, 0))
+        # the rows the cursor passes, as left() would have counted them, before they are joined
+        for passed in range(row, self.cursor.row):
+            self.cursor.row_offset -= get_line_height(self.buffer[passed], self.cursor.n_cols)
+        end_position = (self.cursor.row, self.cursor.col)
+        self.cursor.row, self.cursor.col = row, col
+        self.window.up(self.buffer, self.cursor)
+        self.buffer.delete_range((row, col), end_position)
+
+    def goto(self, row, col=0):
+        """
+        put the cursor at (row, col), clamped to the buffer, without stepping through the text
+        in between. the window stays if the cursor is on it; otherwise it scrolls as far as
+        moving the cursor there would have (see Window.show).
+        """
+        row = clamp(row, 0, self.buffer.bottom)
+        self.cursor.row = row
+        self.cursor.col = clamp(col, 0, len(self.buffer[row]))
+        self.window.show(self.buffer, self.cursor)
+
+    def goto_offset(self, offset):
+        # the cursor at a document offset (see Buffer.offset), found in the rope's offset index
+        self.goto(*self.buffer.lines.position(offset))
+
+    def goto_line(self, row):
+        self.goto(row, 0)
 
     def goto_bottom(self):
-        while self.cursor.row < self.buffer.bottom or self.cursor.col < len(self.buffer[self.cursor.row]):
-            self.right()
+        self.goto(self.buffer.bottom, len(self.buffer[self.buffer.bottom]))
+
+    def page_down(self):
+        # the line after the last one on screen becomes the first, with the cursor on it
+        top = self.window.row + self.window.page_rows(self.buffer, self.window.row, 1)
+        if top > self.buffer.bottom:
+            self.goto_bottom()
+            return
+        self.window.row = top
+        self.window.row_offset = self.cursor.row_offset = 0
+        self.goto(self.window.row, self.cursor.col)
+
+    def page_up(self):
+        # the lines that fill the screen above the first one, with the cursor on the first
+        if self.window.row == 0:
+            self.goto(0, 0)
+            return
+        self.window.row -= self.window.page_rows(self.buffer, self.window.row - 1, -1)
+        self.window.row_offset = self.cursor.row_offset = 0
+        self.goto(self.window.row, self.cursor.col)
     
     def save(self):
         if len(self.filename) > 1:
@@ -322,6 +504,7 @@ class Editor:
             # esc 
             # if k == "\x1b" or k == '\x14': 
             if k == "\x1b":
+                self.stdscr.timeout(-1)
                 save_buffer(self.buffer, self.stdscr)
                 sys.exit(0)
             # ctrl + t
@@ -330,6 +513,10 @@ class Editor:
             # goto bottom if ctrl + n
             elif k == "\x0e":
                 self.goto_bottom()
+            elif k == "KEY_NPAGE":
+                self.page_down()
+            elif k == "KEY_PPAGE":
+                self.page_up()
             elif k == "KEY_LEFT":
                 self.left()
             elif k == "KEY_DOWN":
@@ -349,13 +536,15 @@ class Editor:
                     self.left()
                     self.buffer.delete(self.cursor)
             elif not special_keypress:
-                self.buffer.insert(self.cursor, k)
-                for _ in k:
-                    self.right()
+                self.insert(k)
             
 
         elif isinstance(k, int):
-            if k == curses.KEY_LEFT:
+            if k == curses.KEY_NPAGE:
+                self.page_down()
+            elif k == curses.KEY_PPAGE:
+                self.page_up()
+            elif k == curses.KEY_LEFT:
                 self.left()
             elif k == curses.KEY_DOWN:
                 self.cursor.down(self.buffer)
@@ -372,11 +561,25 @@ class Editor:
 
     def run(self):
         self.display_welcomepage()
+        self.invalidate()
+        if self.input_timeout is not None:
+            self.stdscr.timeout(self.input_timeout)
         ops = 0
         while True:
             self.display_buffer()
             self.translate_cursor()
-            k = self.stdscr.get_wch()
+            self.stdscr.noutrefresh()
+            curses.doupdate()
+            try:
+                k = self.stdscr.get_wch()
+            except curses.error:
+                # no key within input_timeout
+                if self.func_on_idle:
+                    self.func_on_idle(self)
+                continue
+            if self.key_log:
+                self.key_log.write(json.dumps(k) + "\n")
+                self.key_log.flush()
             if self.func_before_keypress:
                 self.func_before_keypress(self)
             self.handle_keypress(k)
@@ -390,6 +593,7 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("filename", nargs="?")
     parser.add_argument("--auto-save", action="store_true", default=False)
+    parser.add_argument("--record-keys", type=str, default=None)
     return parser.parse_args()
 
 def main(stdscr):
@@ -414,7 +618,7 @@ def main(stdscr):
     editor = Editor(stdscr, args.filename, keypresses_list, func_before_keypress=add_user_token)
     """
 
-    editor = Editor(stdscr, args.filename, auto_save=args.auto_save)
+    editor = Editor(stdscr, args.filename, auto_save=args.auto_save, record_keys=args.record_keys)
     editor.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import sys
+from bisect import bisect_left
+
+
+class InstructionIndex:
+    """
+    positions of the <user> / </user> tags in a buffer, kept up to date by Buffer's edits.
+
+    segments() splits the text before the cursor into story and instruction segments the
+    way context.split_instructions does, without scanning the document: the tag positions
+    are known, and the text of segments that end before the first line edited since the last
+    call is reused, so typing at the end of a long manuscript only rebuilds the last segments.
+    """
+
+    def __init__(self, lines, open_tag: str = "<user>", close_tag: str = "</user>"):
+        self.open_tag = open_tag
+        self.close_tag = close_tag
+        self._rows = []     # sorted rows holding at least one tag
+        self._tags = {}     # row -> [(col, is_open)] in column order
+        self._segments = []  # last segments: (is_instruction, start, end, text)
+        self._valid_row = sys.maxsize  # segments ending before this row are unchanged
+        self._chars = frozenset(open_tag + close_tag)  # text without these adds no tag
+        self._width = max(len(open_tag), len(close_tag))
+        for row, line in enumerate(lines):
+            tags = self._scan(line)
+            if tags:
+                self._rows.append(row)
+                self._tags[row] = tags
+
+    def __len__(self):
+        # number of tags
+        return sum(len(tags) for tags in self._tags.values())
+
+    def _scan(self, line: str) -> list:
+        tags = []
+        for tag, is_open in ((self.open_tag, True), (self.close_tag, False)):
+            col = line.find(tag)
+            while col != -1:
+                tags.append((col, is_open))
+                col = line.find(tag, col + len(tag))
+        tags.sort()
+        return tags
+
+    def replace(self, row: int, count: int, lines: list):
+        """
+        lines[row:row + count] of the buffer were replaced by lines.
+        """
+        i = bisect_left(self._rows, row)
+        j = bisect_left(self._rows, row + count)
+        delta = len(lines) - count
+        tags = self._tags
+        for old in self._rows[i:j]:
+            del tags[old]
+        shifted = self._rows[j:]
+        if delta:
+            moved = [(old + delta, tags.pop(old)) for old in shifted]
+            tags.update(moved)
+            shifted = [old + delta for old in shifted]
+        added = []
+        for k, line in enumerate(lines):
+            found = self._scan(line)
+            if found:
+                added.append(row + k)
+                tags[row + k] = found
+        self._rows[i:] = added + shifted
+        self._valid_row = min(self._valid_row, row)
+
+    def edit(self, row: int, col: int, line: str, inserted: str = ""):
+        """
+        line row of the buffer is now line, after inserted was put at col, or with inserted
+        empty, after text was removed at col. cheaper than replace for typing in story text.
+        """
+        # a new tag holds inserted characters, or after a removal, spans col
+        added = inserted or line[max(col - self._width + 1, 0):col + self._width - 1]
+        if row in self._tags or not self._chars.isdisjoint(added):
+            self.replace(row, 1, [line])
+        elif row < self._valid_row:
+            self._valid_row = row
+
+    def _boundaries(self, cursor):
+        # (is_instruction, start, end) of each segment before the cursor
+        open_len, close_len = len(self.open_tag), len(self.close_tag)
+        segments = []
+        start = (0, 0)
+        inside = False
+        for row in self._rows[:bisect_left(self._rows, cursor.row + 1)]:
+            for col, is_open in self._tags[row]:
+                length = open_len if is_open else close_len
+                if row == cursor.row and col + length > cursor.col:
+                    break
+                if is_open and not inside:
+                    if (row, col) != start:
+                        segments.append((False, start, (row, col)))
+                    start = (row, col)
+                    inside = True
+                elif not is_open and inside:
+                    end = (row, col + length)
+                    segments.append((True, start, end))
+                    start = end
+                    inside = False
+        end = (cursor.row, cursor.col)
+        if end != start or inside:
+            segments.append((inside, start, end))
+        return segments
+
+    def segments(self, buffer, cursor) -> list:
+        """
+        [(is_instruction, text)] covering buffer.prefix(cursor).
+        """
+        cached = self._segments
+        segments = []
+        for k, (is_instruction, start, end) in enumerate(self._boundaries(cursor)):
+            if (k < len(cached) and cached[k][:3] == (is_instruction, start, end)
+                    and end[0] < self._valid_row):
+                text = cached[k][3]
+            else:
+                # everything from here on is rebuilt
+                cached = ()
+                text = buffer.text(start, end)
+            segments.append((is_instruction, start, end, text))
+        self._segments = segments
+        self._valid_row = sys.maxsize
+        return [(is_instruction, text) for is_instruction, _, _, text in segments]
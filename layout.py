@@ -0,0 +1,89 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import accumulate
+
+import wcwidth
+
+
+def char_width(character):
+    width = wcwidth.wcwidth(character)
+    return max(0, width)
+
+
+class LineLayout:
+    """
+    soft-wrap layout of one logical line at a given terminal width.
+
+    the line is laid out with a trailing space for the cursor. a display row ends after the
+    character that brings its width to n_cols or more, so a wide character at the edge may
+    overhang by one column, exactly as the editor has always wrapped.
+    """
+    __slots__ = ("widths", "breaks")
+
+    def __init__(self, line, n_cols):
+        # widths[i]: display width of line[:i]
+        self.widths = [0] + list(accumulate(map(char_width, line + " ")))
+        breaks = []
+        row_start = 0
+        for i in range(1, len(self.widths)):
+            if self.widths[i] - row_start >= n_cols:
+                breaks.append(i - 1)
+                row_start = self.widths[i]
+        # breaks: indices of the characters that end a display row
+        self.breaks = breaks
+
+    @property
+    def height(self):
+        # number of extra display rows taken by the line (0 if it fits on one row)
+        return len(self.breaks)
+
+    def translate(self, col):
+        """
+        return (display rows below the first row of the line, column width) of the character at col.
+        """
+        k = bisect_left(self.breaks, col)
+        row_start = self.widths[self.breaks[k - 1] + 1] if k else 0
+        return k, self.widths[col] - row_start
+
+    def chunks(self, line):
+        """
+        split line (plus the cursor space) into the strings drawn on each display row.
+        """
+        line += " "
+        chunks = []
+        start = 0
+        for end in self.breaks:
+            chunks.append(line[start:end + 1])
+            start = end + 1
+        if start < len(line):
+            chunks.append(line[start:])
+        return chunks
+
+
+class LayoutCache:
+    """
+    LRU cache of LineLayout keyed by (line content, n_cols).
+    an edited line is a new string, so it simply misses the cache; untouched lines are never re-wrapped.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._layouts = OrderedDict()
+
+    def __call__(self, line, n_cols):
+        key = (line, n_cols)
+        layout = self._layouts.get(key)
+        if layout is not None:
+            self._layouts.move_to_end(key)
+            return layout
+        layout = LineLayout(line, n_cols)
+        self._layouts[key] = layout
+        if len(self._layouts) > self.max_size:
+            self._layouts.popitem(last=False)
+        return layout
+
+    def clear(self):
+        self._layouts.clear()
+
+
+get_layout = LayoutCache()
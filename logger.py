@@ -0,0 +1,130 @@
+"""
+background logging for the copilot. print_to_log only puts the record on a queue; a listener
+thread truncates long prompts, writes records in batches and rotates the file by size.
+"""
+import atexit
+import hashlib
+import logging
+import logging.handlers
+import queue
+
+logger = logging.getLogger("copilot")
+logger.propagate = False
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+_listener = None
+
+# until setup_logging is called (by ai_editor and the command line tools), warnings go to
+# stderr and the rest is dropped: importing this module never creates a log file
+_fallback = logging.StreamHandler()
+_fallback.setLevel(WARNING)
+logger.handlers = [_fallback]
+
+
+def truncate(text: str, max_chars: int) -> str:
+    # long texts are logged as their length, a hash to tell them apart, and their tail
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+    return f"<{len(text)} chars, sha1 {digest}> ...{text[-max_chars:]}"
+
+
+class TruncatingFormatter(logging.Formatter):
+    """
+    formats on the listener thread, so str() of message lists and truncation are off the UI thread.
+    """
+
+    def __init__(self, max_chars: int = 1000):
+        super().__init__("%(asctime)s %(levelname)s %(threadName)s: %(message)s")
+        self.max_chars = max_chars
+
+    def format(self, record):
+        # the rotating handler formats each record twice (once to check the size), truncate once
+        if not getattr(record, "truncated", False):
+            if isinstance(record.args, tuple) and record.args:
+                record.args = tuple(self.shorten(arg) for arg in record.args)
+            elif not record.args:
+                record.msg = truncate(str(record.msg), self.max_chars)
+            record.truncated = True
+        return super().format(record)
+
+    def shorten(self, arg):
+        if isinstance(arg, (int, float)):
+            return arg
+        return truncate(str(arg), self.max_chars)
+
+
+class BatchFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    StreamHandler flushes after every record; this one is flushed by the listener once the
+    queue has been drained, so a burst of records costs one write.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # the stdlib version formats the record on the calling thread; the listener formats it instead
+    def prepare(self, record):
+        return record
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush_batch()
+
+
+def setup_logging(path: str = "log.txt",
+                  level="DEBUG",
+                  max_chars: int = 1000,
+                  max_bytes: int = 5 * 1024 * 1024,
+                  backup_count: int = 3):
+    """
+    (re)start the background logger. level is a name ("DEBUG", "INFO", ...) or a logging level;
+    texts longer than max_chars are truncated; the file rotates after max_bytes.
+    """
+    global _listener
+    stop_logging()
+    handler = BatchFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                               encoding="utf-8", delay=True)
+    handler.setFormatter(TruncatingFormatter(max_chars))
+    records = queue.SimpleQueue()
+    logger.handlers = [QueueHandler(records)]
+    logger.setLevel(level)
+    _listener = BatchQueueListener(records, handler)
+    _listener.start()
+
+
+def stop_logging():
+    # write out everything still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.flush_batch()
+            handler.close()
+        _listener = None
+        logger.handlers = [_fallback]
+
+
+atexit.register(stop_logging)
+
+
+def print_to_log(text: str, *args, level: int = DEBUG):
+    """
+    log text % args in the background. pass large values as args rather than concatenating
+    them, so that formatting them is left to the listener (and skipped below the log level).
+    before setup_logging, only warnings and errors are shown, on stderr.
+    """
+    logger.log(level, text, *args)
@@ -0,0 +1,186 @@
+"""
+a local stand-in for an OpenAI-compatible completions endpoint, for latency and throughput
+tests without network or API keys. standard library only.
+
+    python mock_server.py --port 8000 --latency 0.3 --tokens_per_second 40
+    python ai_editor.py story.txt --base_url http://localhost:8000/v1 --stream
+
+each request waits `latency` seconds (plus up to `jitter`) before the first token, then produces
+one token (one character of filler text) every 1 / tokens_per_second seconds. streamed requests
+are sent as server-sent events like the real APIs; a client that disconnects stops its stream.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+filler = ("山风吹过竹林，少年握紧了手中的剑。远处的城门缓缓打开，一队骑兵踏着晨雾而来。"
+          "他想起师父临别时的话，心中默念了一遍，转身走进了人群。")
+
+
+class MockConfig:
+
+    def __init__(self, latency=0.2, jitter=0.0, tokens_per_second=50.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        # share of requests answered with a 500, to exercise retries
+        self.error_rate = error_rate
+
+
+class MockStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+        self.disconnects = 0  # streams the client closed before the end
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+
+def generate(prompt, max_tokens, index=0) -> list:
+    # deterministic filler tokens for a prompt: the same request gets the same answer
+    start = (sum(map(ord, prompt[-32:])) + 7 * index) % len(filler)
+    return [filler[(start + i) % len(filler)] for i in range(max_tokens)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self.send_json({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        self.send_error(404)
+
+    def do_POST(self):
+        chat = self.path.rstrip("/").endswith("/chat/completions")
+        if not chat and not self.path.rstrip("/").endswith("/completions"):
+            return self.send_error(404)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config, stats = self.server.config, self.server.stats
+        stats.add(requests=1)
+        if random.random() < config.error_rate:
+            stats.add(errors=1)
+            return self.send_json({"error": {"message": "mock error", "type": "server_error"}}, status=500)
+
+        if chat:
+            prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+        else:
+            prompt = body.get("prompt", "")
+            prompt = prompt if isinstance(prompt, str) else "".join(prompt)
+        n = int(body.get("n") or 1)
+        choices = [generate(prompt, int(body.get("max_tokens") or 16), i) for i in range(n)]
+        time.sleep(config.latency + random.uniform(0, config.jitter))
+        if body.get("stream"):
+            return self.stream(body, chat, choices[0])
+
+        time.sleep(len(choices[0]) / config.tokens_per_second)
+        tokens = sum(map(len, choices))
+        stats.add(tokens=tokens)
+        if chat:
+            choices = [{"index": i, "message": {"role": "assistant", "content": "".join(choice)},
+                        "finish_reason": "length"} for i, choice in enumerate(choices)]
+        else:
+            choices = [{"index": i, "text": "".join(choice), "logprobs": None, "finish_reason": "length"}
+                       for i, choice in enumerate(choices)]
+        self.send_json(self.response(body, chat, choices, usage={
+            "prompt_tokens": len(prompt), "completion_tokens": tokens, "total_tokens": len(prompt) + tokens}))
+
+    def response(self, body, chat, choices, **extra) -> dict:
+        return {"id": f"mock-{time.monotonic_ns()}", "object": "chat.completion" if chat else "text_completion",
+                "created": int(time.time()), "model": body.get("model", "mock"), "choices": choices, **extra}
+
+    def send_json(self, data, status=200):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def stream(self, body, chat, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # no length is known up front; the connection ends with the stream
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        interval = 1 / self.server.config.tokens_per_second
+        sent = 0
+        try:
+            for token in tokens:
+                if chat:
+                    choice = {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                else:
+                    choice = {"index": 0, "text": token, "logprobs": None, "finish_reason": None}
+                self.send_event(self.response(body, chat, [choice]))
+                sent += 1
+                time.sleep(interval)
+            self.send_event("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.stats.add(disconnects=1)
+        finally:
+            self.server.stats.add(tokens=sent)
+
+    def send_event(self, data):
+        data = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats = MockStats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start(host="127.0.0.1", port=0, **config) -> MockServer:
+    """
+    serve in a background thread (port 0: any free port, see server.base_url). for benchmarks.
+    """
+    server = MockServer((host, port), MockConfig(**config))
+    threading.Thread(target=server.serve_forever, name="mock_server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds of latency")
+    parser.add_argument("--tokens_per_second", type=float, default=50.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = MockServer((args.host, args.port), MockConfig(args.latency, args.jitter, args.tokens_per_second,
+                                                           args.error_rate))
+    print(f"serving {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
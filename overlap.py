@@ -0,0 +1,91 @@
+"""
+how much of a response repeats the end of the text it continues.
+
+models often start a continuation by re-emitting the last line. check_overlap finds the
+longest suffix of the text that is also a prefix of the response with the KMP prefix
+function, in O(len(response)). fuzzy_overlap does the same after dropping whitespace and
+punctuation, for re-emitted lines whose spacing or punctuation changed.
+"""
+import unicodedata
+
+
+def prefix_function(s) -> list:
+    # pi[i]: length of the longest proper prefix of s[:i + 1] that is also its suffix
+    pi = [0] * len(s)
+    k = 0
+    for i in range(1, len(s)):
+        while k and s[i] != s[k]:
+            k = pi[k - 1]
+        if s[i] == s[k]:
+            k += 1
+        pi[i] = k
+    return pi
+
+
+def suffix_prefix_overlap(text, response) -> int:
+    """
+    length of the longest suffix of text that is a prefix of response. works on any sequences
+    of characters.
+    """
+    if not text or not response:
+        return 0
+    # None equals no character, so no match runs across it, and the overlap is at most
+    # len(response): only that much of the text's tail is looked at
+    return prefix_function([*response, None, *text[-len(response):]])[-1]
+
+
+def check_overlap(text, response):
+    # number of leading characters of response that repeat the end of text
+    return suffix_prefix_overlap(text, response)
+
+
+def ignorable(char: str) -> bool:
+    return char.isspace() or unicodedata.category(char).startswith("P")
+
+
+# character -> what it contributes to the normalized text ("" for whitespace and punctuation)
+_folded = {}
+
+def fold(char: str) -> str:
+    folded = _folded.get(char)
+    if folded is None:
+        folded = "" if ignorable(char) else "".join(
+            c for c in unicodedata.normalize("NFKC", char) if not ignorable(c))
+        _folded[char] = folded
+    return folded
+
+
+def normalize(text: str):
+    """
+    text without whitespace and punctuation, NFKC-folded (full-width letters and digits become
+    ASCII), and for each character kept, its index in text.
+    """
+    chars, index = [], []
+    for i, char in enumerate(text):
+        for folded in fold(char):
+            chars.append(folded)
+            index.append(i)
+    return chars, index
+
+
+def fuzzy_overlap(text: str, response: str, min_len: int = 4) -> int:
+    """
+    number of leading characters of response that repeat the end of text, ignoring whitespace
+    and punctuation. overlaps shorter than min_len kept characters are not trusted and give 0.
+
+    if the text ends in punctuation or spaces, the punctuation and spaces that follow the
+    repeated part of the response (up to a line break) are counted as repeated too.
+    """
+    if not text or not response:
+        return 0
+    # the response may drop punctuation the text has, so look at a longer tail of the text
+    text_chars, _ = normalize(text[-(2 * len(response) + 16):])
+    response_chars, response_index = normalize(response)
+    n = suffix_prefix_overlap(text_chars, response_chars)
+    if n < min_len:
+        return 0
+    end = response_index[n - 1] + 1
+    if ignorable(text[-1]):
+        while end < len(response) and response[end] != "\n" and ignorable(response[end]):
+            end += 1
+    return end
@@ -0,0 +1,249 @@
+from typing import Iterable, Iterator, List
+
+
+class Fenwick:
+    """
+    binary indexed tree over a list of non-negative ints.
+    supports point updates, prefix sums and "which slot holds the k-th unit" lookups in O(log n).
+    """
+
+    def __init__(self, values: Iterable[int] = ()):
+        self.rebuild(values)
+
+    def rebuild(self, values: Iterable[int]):
+        tree = [0] + list(values)
+        n = len(tree) - 1
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.size = n
+
+    def __len__(self):
+        return self.size
+
+    def add(self, index: int, delta: int):
+        i = index + 1
+        tree = self.tree
+        while i <= self.size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index: int) -> int:
+        # sum of values[:index]
+        total = 0
+        tree = self.tree
+        i = index
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def total(self) -> int:
+        return self.prefix_sum(self.size)
+
+    def search(self, k: int):
+        """
+        return (index, remainder) such that prefix_sum(index) <= k < prefix_sum(index + 1)
+        and remainder = k - prefix_sum(index).
+        """
+        pos = 0
+        tree = self.tree
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and tree[nxt] <= k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return pos, k
+
+
+class LineRope:
+    """
+    a list of lines stored as a sequence of bounded chunks.
+    the number of lines per chunk is indexed by a fenwick tree, so locating, inserting and
+    removing a line costs O(log n + load) instead of shifting the whole list.
+    a second fenwick tree counts characters per chunk (each line plus its newline), which maps
+    between line numbers and document offsets without joining the text.
+    """
+
+    def __init__(self, lines: Iterable[str] = (), load: int = 256):
+        self.load = load
+        lines = list(lines)
+        self._chunks: List[List[str]] = [lines[i:i + load] for i in range(0, len(lines), load)] or [[]]
+        self._len = len(lines)
+        self._counts = Fenwick(len(chunk) for chunk in self._chunks)
+        self._chars = Fenwick(_chunk_chars(chunk) for chunk in self._chunks)
+        # change in characters of one chunk not yet added to _chars: typing changes the same
+        # chunk over and over, and the offsets are only read when a prompt is built
+        self._pending = (0, 0)
+        # (chunk, first line, end line) of the last lookup; typing hits the same line over and over
+        self._hint = (0, 0, 0)
+
+    def __len__(self):
+        return self._len
+
+    def _locate(self, index: int):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("line index out of range")
+        c, lo, hi = self._hint
+        if lo <= index < hi:
+            return c, index - lo
+        c, j = self._counts.search(index)
+        self._hint = (c, index - j, index - j + len(self._chunks[c]))
+        return c, j
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            return list(self.iter_from(start, stop))
+        c, j = self._locate(index)
+        return self._chunks[c][j]
+
+    def __setitem__(self, index: int, line: str):
+        c, j = self._locate(index)
+        self._set(c, j, line)
+
+    def splice(self, index: int, start: int, stop: int, string: str) -> str:
+        """
+        replace characters start:stop of line index with string, and return the new line.
+        """
+        c, j = self._locate(index)
+        current = self._chunks[c][j]
+        line = current[:start] + string + current[stop:]
+        self._set(c, j, line)
+        return line
+
+    def _set(self, c: int, j: int, line: str):
+        chunk = self._chunks[c]
+        pending_chunk, delta = self._pending
+        if pending_chunk != c and delta:
+            self._chars.add(pending_chunk, delta)
+            delta = 0
+        self._pending = (c, delta + len(line) - len(chunk[j]))
+        chunk[j] = line
+
+    def _char_counts(self) -> Fenwick:
+        # _chars with the pending change added
+        c, delta = self._pending
+        if delta:
+            self._chars.add(c, delta)
+            self._pending = (c, 0)
+        return self._chars
+
+    @property
+    def n_chars(self) -> int:
+        # length of "\n".join(lines)
+        return max(self._char_counts().total - 1, 0)
+
+    def offset(self, index: int) -> int:
+        """
+        document offset of the first character of line index.
+        """
+        if index >= self._len:
+            return self._char_counts().total
+        c, j = self._locate(index)
+        return self._char_counts().prefix_sum(c) + _chunk_chars(self._chunks[c][:j])
+
+    def position(self, offset: int):
+        """
+        inverse of offset: return (line, column) of a document offset, clamped to the document.
+        """
+        if offset <= 0:
+            return 0, 0
+        if offset > self.n_chars:
+            return self._len - 1, len(self[-1])
+        c, rest = self._char_counts().search(offset)
+        row = self._counts.prefix_sum(c)
+        for line in self._chunks[c]:
+            if rest <= len(line):
+                return row, rest
+            rest -= len(line) + 1
+            row += 1
+        return row, rest
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def iter_from(self, start: int, stop: int = None) -> Iterator[str]:
+        stop = self._len if stop is None else min(stop, self._len)
+        if start >= stop:
+            return
+        c, j = self._counts.search(start)
+        remaining = stop - start
+        for chunk in self._chunks[c:]:
+            piece = chunk[j:j + remaining]
+            yield from piece
+            remaining -= len(piece)
+            if remaining <= 0:
+                return
+            j = 0
+
+    def insert(self, index: int, line: str):
+        self.replace(index, 0, [line])
+
+    def pop(self, index: int) -> str:
+        line = self[index]
+        self.replace(index, 1, [])
+        return line
+
+    def replace(self, index: int, count: int, lines: List[str]):
+        """
+        replace lines[index:index+count] with lines, touching only the chunks involved.
+        """
+        if index < 0:
+            index += self._len
+        if not 0 <= index <= self._len or index + count > self._len:
+            raise IndexError("line index out of range")
+        self._hint = (0, 0, 0)
+        if index == self._len:
+            c = len(self._chunks) - 1
+            j = len(self._chunks[c])
+        else:
+            c, j = self._counts.search(index)
+        chunk = self._chunks[c]
+        if j + count <= len(chunk):
+            removed = _chunk_chars(chunk[j:j + count])
+            chunk[j:j + count] = lines
+            self._len += len(lines) - count
+            if len(chunk) > 2 * self.load or (not chunk and len(self._chunks) > 1):
+                self._rechunk(c, c + 1)
+            else:
+                self._counts.add(c, len(lines) - count)
+                self._chars.add(c, _chunk_chars(lines) - removed)
+            return
+        # the replaced range spans several chunks: merge them into one and re-split
+        end = c
+        covered = len(chunk) - j
+        while covered < count:
+            end += 1
+            covered += len(self._chunks[end])
+        merged = [line for ch in self._chunks[c:end + 1] for line in ch]
+        merged[j:j + count] = lines
+        self._chunks[c:end + 1] = [merged]
+        self._len += len(lines) - count
+        self._rechunk(c, c + 1)
+
+    def _rechunk(self, start: int, stop: int):
+        load = self.load
+        pieces = []
+        for chunk in self._chunks[start:stop]:
+            pieces.extend(chunk[i:i + load] for i in range(0, len(chunk), load))
+        self._chunks[start:stop] = pieces
+        if not self._chunks:
+            self._chunks = [[]]
+        self._counts.rebuild(len(chunk) for chunk in self._chunks)
+        self._chars.rebuild(_chunk_chars(chunk) for chunk in self._chunks)
+        self._pending = (0, 0)
+
+
+def _chunk_chars(lines: List[str]) -> int:
+    return sum(map(len, lines)) + len(lines)
@@ -1,9 +1,94 @@
 # This python scripts calls together.ai api
 
-import os, asyncio
-from together import AsyncTogether, Together
+import inspect, os, threading
 from typing import Union, List, Dict
 
+# process-wide API clients, created on first use and reused by every call so that
+# HTTP keep-alive connections and TLS sessions survive between completions.
+# the SDKs are imported when their first client is made, not when this module is imported
+_clients = {}
+_clients_lock = threading.Lock()
+client_config = {
+    "timeout": 30.0,            # seconds per request
+    "max_retries": 2,
+    "max_connections": 10,      # connection pool size of every client kind
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60.0,   # seconds an idle connection is kept open
+}
+
+TOGETHER_BASE_URL = "https://api.together.xyz/v1"
+
+def configure_clients(**config):
+    """
+    change pool sizes / timeouts (keys of client_config). existing clients are dropped and
+    rebuilt with the new settings on next use.
+    """
+    unknown = set(config) - set(client_config)
+    if unknown:
+        raise ValueError("unknown client options", unknown)
+    with _clients_lock:
+        client_config.update(config)
+        _clients.clear()
+
+def get_client(kind: str = "together", base_url: str = None):
+    """
+    return the shared client of the given kind: "together", "async_together", "openai" or "async_openai".
+    """
+    key = (kind, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _make_client(kind, base_url)
+    return client
+
+def _http_client(asynchronous: bool = False):
+    # the pool every client kind shares its settings with (see client_config)
+    import httpx
+    limits = httpx.Limits(max_connections=client_config["max_connections"],
+                          max_keepalive_connections=client_config["max_keepalive_connections"],
+                          keepalive_expiry=client_config["keepalive_expiry"])
+    if asynchronous:
+        return httpx.AsyncClient(limits=limits, timeout=client_config["timeout"])
+    return httpx.Client(limits=limits, timeout=client_config["timeout"])
+
+def _accepts(cls, name: str) -> bool:
+    try:
+        return name in inspect.signature(cls).parameters
+    except (TypeError, ValueError):
+        return False
+
+def _together_client(cls, base_url, asynchronous):
+    kwargs = dict(api_key=os.environ.get("TOGETHER_API_KEY"), base_url=base_url,
+                  timeout=client_config["timeout"], max_retries=client_config["max_retries"])
+    # together>=2 is built on httpx and takes the shared pool; 1.x has no http_client
+    # argument and keeps its own connections
+    if _accepts(cls, "http_client"):
+        kwargs["http_client"] = _http_client(asynchronous)
+    return cls(**kwargs)
+
+def _make_client(kind, base_url):
+    api_key = os.environ.get("TOGETHER_API_KEY")
+    if kind == "together":
+        from together import Together
+        return _together_client(Together, base_url, asynchronous=False)
+    if kind == "async_together":
+        from together import AsyncTogether
+        return _together_client(AsyncTogether, base_url, asynchronous=True)
+    if kind == "async_openai":
+        import openai
+        # local OpenAI-compatible servers (vLLM, llama.cpp, mock_server.py) ignore the key
+        api_key = api_key if not base_url or base_url == TOGETHER_BASE_URL else os.environ.get("OPENAI_API_KEY", "none")
+        return openai.AsyncOpenAI(api_key=api_key, base_url=base_url or TOGETHER_BASE_URL,
+                                  max_retries=client_config["max_retries"], http_client=_http_client(True))
+    if kind == "openai":
+        import openai
+        return openai.OpenAI(api_key=api_key, base_url=base_url or TOGETHER_BASE_URL,
+                             max_retries=client_config["max_retries"], http_client=_http_client())
+    raise ValueError("unknown client kind", kind)
+
 
 
 def chat_completion(message, 
@@ -11,7 +96,7 @@ def chat_completion(message,
                     temperature = 0.6,
                     max_tokens = 512,
                     stop=["</s>"]):
-    client = Together(api_key=os.environ.get("TOGETHER_API_KEY"))
+    client = get_client("together")
     if isinstance(message, str):
         message = [{"role": "user", "content": message}]
     elif isinstance(message, list):
@@ -27,12 +112,18 @@ def chat_completion(message,
     )
     return response.choices[0].message.content
 
-async def async_chat_completion(messages):
-    async_client = AsyncTogether(api_key=os.environ.get("TOGETHER_API_KEY"))
+async def async_chat_completion(messages,
+                                model: str = "meta-llama/Llama-3-8b-chat-hf",
+                                temperature = 0.6,
+                                max_tokens = 512):
+    import asyncio
+    async_client = get_client("async_together")
     tasks = [
         async_client.chat.completions.create(
-            model="meta-llama/Llama-3-8b-chat-hf",
+            model=model,
             messages=[{"role": "user", "content": message}],
+            temperature=temperature,
+            max_tokens=max_tokens,
         )
         for message in messages
     ]
@@ -48,18 +139,51 @@ def completion(prompt: str,
                model: str = "Qwen/Qwen1.5-110B-Chat", 
                max_tokens: int = 1000,
                temperature: float = 0.6,
-               stop: List[str] = ["</s>"]):
-    client = Together(api_key=os.environ.get("TOGETHER_API_KEY"))
+               stop: List[str] = ["</s>"],
+               n: int = 1):
+    """
+    the completion text, or with n > 1, a list of n alternative completions from one request.
+    """
+    client = get_client("together")
+    options = {"n": n} if n > 1 else {}
     response = client.completions.create(
         model=model,
         prompt=prompt,
         max_tokens=max_tokens,
         temperature=temperature,
         stop=stop,
+        **options,
     )
+    if n > 1:
+        return [choice.text for choice in response.choices]
     return response.choices[0].text
 
-import openai
+def stream_completion(prompt: str, 
+                      model: str = "Qwen/Qwen1.5-110B-Chat", 
+                      max_tokens: int = 1000,
+                      temperature: float = 0.6,
+                      stop: List[str] = ["</s>"]):
+    """
+    like completion, but yields the text piece by piece as tokens arrive.
+    """
+    client = get_client("together")
+    stream = client.completions.create(
+        model=model,
+        prompt=prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stop=stop,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].text:
+                yield chunk.choices[0].text
+    finally:
+        # stop reading the HTTP response if the consumer gave up early
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
 
 def openai_completion(prompt: str, 
                       model: str = "Qwen/Qwen1.5-110B-Chat", 
@@ -68,13 +192,11 @@ def openai_completion(prompt: str,
                       stop: List[str] = ["</s>"],
                       logit_bias: Dict[str, float] = {},
                       log_probs: int = 0,
+                      base_url: str = TOGETHER_BASE_URL,
                       ):
 
 
-    client = openai.OpenAI(
-        api_key=os.environ.get("TOGETHER_API_KEY"),
-        base_url="https://api.together.xyz/v1",
-        )
+    client = get_client("openai", base_url)
     response = client.completions.create(
         model=model,
         prompt=prompt,
@@ -82,11 +204,12 @@ def openai_completion(prompt: str,
         temperature=temperature,
         stop=stop,
         logit_bias=logit_bias,
-        log_probs=log_probs,
+        logprobs=log_probs or None,
     )   
     return response.choices[0].text
 
 if __name__ == "__main__":
+    from together import AsyncTogether
     async_client = AsyncTogether(api_key=os.environ.get("TOGETHER_API_KEY"))
     messages = [
         "What are the top things to do in San Francisco?",
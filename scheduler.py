@@ -0,0 +1,137 @@
+import concurrent.futures
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+OK = "ok"
+TIMEOUT = "timeout"
+ERROR = "error"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class Result:
+    """
+    outcome of a scheduled request. only an OK result carries a value; callers should never
+    treat the text of an error as a completion.
+    """
+    status: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    latency: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == OK
+
+    def __str__(self):
+        if self.ok:
+            return str(self.value)
+        return f"{self.status}: {self.error!r}" if self.error else self.status
+
+
+class Ticket:
+    """
+    handle on a scheduled request. done() becomes true when the request finishes or its
+    deadline passes, whichever comes first, so a caller polling or waiting on it is released
+    at the deadline even if the provider is still working.
+    """
+
+    def __init__(self, future: concurrent.futures.Future, deadline: Optional[float], started: float):
+        self.future = future
+        self.deadline = deadline
+        self.started = started
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def done(self) -> bool:
+        return self.future.done() or self.expired()
+
+    def cancel(self):
+        # a request that has not started is dropped; a running one finishes but is ignored
+        self.future.cancel()
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def result(self) -> Result:
+        """
+        wait until the request finishes or the deadline passes.
+        """
+        remaining = None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+        try:
+            return self.future.result(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            self.future.cancel()
+            return Result(TIMEOUT, latency=time.monotonic() - self.started)
+        except concurrent.futures.CancelledError:
+            return Result(CANCELLED, latency=time.monotonic() - self.started)
+
+
+class RequestScheduler:
+    """
+    long-lived worker pool for provider requests. unlike a pool per call, submitting never
+    waits for other requests to shut down, and queued requests whose deadline has already
+    passed are skipped instead of sent.
+    """
+
+    def __init__(self, max_workers: int = 4, name: str = "copilot"):
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                                thread_name_prefix=name)
+        self._local = threading.local()
+
+    def submit(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Ticket:
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        future = self._executor.submit(self._execute, fn, args, kwargs, deadline, started)
+        return Ticket(future, deadline, started)
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Result:
+        """
+        submit and wait, returning at the deadline at the latest.
+        called from one of the scheduler's own workers, fn runs inline instead, as waiting on the
+        same pool could starve the outer request. it is not started once the earlier of the outer
+        deadline and its own has passed, and if it finishes after that, the result is TIMEOUT.
+        """
+        if getattr(self._local, "active", False):
+            started = time.monotonic()
+            return self._execute(fn, args, kwargs, self.deadline(timeout), started)
+        return self.submit(fn, *args, timeout=timeout, **kwargs).result()
+
+    def deadline(self, timeout: Optional[float] = None) -> Optional[float]:
+        # the earlier of now + timeout and the deadline of the request running on this thread
+        deadlines = [d for d in (getattr(self._local, "deadline", None),
+                                 None if timeout is None else time.monotonic() + timeout) if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def remaining(self, timeout: Optional[float] = None) -> Optional[float]:
+        # seconds left for a call with this timeout made here, counting the outer deadline
+        deadline = self.deadline(timeout)
+        return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+    def _execute(self, fn, args, kwargs, deadline, started) -> Result:
+        if deadline is not None and time.monotonic() >= deadline:
+            return Result(TIMEOUT, latency=time.monotonic() - started)
+        nested = getattr(self._local, "active", False)
+        outer = getattr(self._local, "deadline", None)
+        self._local.active = True
+        self._local.deadline = deadline
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as e:
+            return Result(ERROR, error=e, latency=time.monotonic() - started)
+        finally:
+            self._local.active = nested
+            self._local.deadline = outer
+        if nested and deadline is not None and time.monotonic() >= deadline:
+            return Result(TIMEOUT, latency=time.monotonic() - started)
+        return Result(OK, value, latency=time.monotonic() - started)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+scheduler = RequestScheduler()
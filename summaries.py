@@ -0,0 +1,174 @@
+"""
+rolling summaries of the manuscript before the recent window, so that the prompt stays about
+the same size however long the novel grows.
+
+the text is split into spans: chapters at their headings, and chapters longer than
+max_span_chars into scenes at paragraph breaks, cut greedily from the chapter start, so typing
+at the end only ever changes the last span. each span is summarized once and the summary is
+kept under the hash of the span's text: an edit to an early chapter re-summarizes that chapter
+only. when the summaries together are longer than summary_chars, the oldest of them are
+summarized again `fanout` at a time (keyed the same way), and so on, so that the distant past
+is told more briefly than the recent chapters.
+
+summaries are computed in the background, one at a time on a worker of their own, so that a
+slow one never holds up a Tab. a prompt built while a summary is missing leaves that span out;
+a later one picks it up.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from logger import INFO, WARNING, print_to_log
+from scheduler import RequestScheduler
+
+# drains run here rather than on the shared scheduler, whose workers serve Tab requests
+summary_scheduler = RequestScheduler(max_workers=1, name="summaries")
+
+# "第一章：..." / "第12回" / "第三卷" at the start of a line
+chapter_pattern = r"^[ \t　]*第[0-9０-９零〇一二两三四五六七八九十百千万]+[章回节卷].*$"
+
+
+def split_chapters(text: str, pattern: str = chapter_pattern) -> list:
+    # offsets of the chapter headings in text
+    return [m.start() for m in re.finditer(pattern, text, flags=re.MULTILINE)]
+
+
+def split_spans(text: str, max_span_chars: int = 6000, pattern: str = chapter_pattern) -> list:
+    """
+    (start, end) of the chapters of text, long chapters cut into scenes at paragraph breaks.
+    """
+    starts = split_chapters(text, pattern)
+    # the text before the first heading is a chapter of its own
+    if not starts or starts[0] > 0:
+        starts.insert(0, 0)
+    spans = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        while end - start > max_span_chars:
+            cut = text.rfind("\n", start + 1, start + max_span_chars)
+            if cut == -1:
+                cut = start + max_span_chars
+            spans.append((start, cut))
+            start = cut
+        spans.append((start, end))
+    return spans
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class Summarizer:
+    """
+    split(text) returns (rolling summary, recent text): the recent text is at least `window`
+    characters, back to the start of the span it begins in, and the summary covers everything
+    before it. summarize(text, max_chars) is called on summary_scheduler for missing summaries.
+    with a path, summaries are also kept in a json file and survive restarts.
+    """
+
+    def __init__(self,
+                 summarize,
+                 window: int = 3000,
+                 max_span_chars: int = 6000,
+                 span_summary_chars: int = 200,
+                 summary_chars: int = 1500,
+                 fanout: int = 4,
+                 pattern: str = chapter_pattern,
+                 path: str = None):
+        self.summarize = summarize
+        self.window = window
+        self.max_span_chars = max_span_chars
+        self.span_summary_chars = span_summary_chars
+        self.summary_chars = summary_chars
+        self.fanout = max(fanout, 2)
+        self.pattern = pattern
+        self.path = path
+        self._summaries = {}         # content hash -> summary
+        self._wanted = OrderedDict()  # content hash -> text, missing summaries oldest first
+        self._running = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self._summaries = json.load(file)
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def busy(self) -> bool:
+        # summaries are wanted or being computed
+        return bool(self._wanted) or self._running
+
+    def split(self, text: str):
+        spans = split_spans(text, self.max_span_chars, self.pattern)
+        cut = len(text) - self.window
+        done = [span for span in spans if span[1] <= cut]
+        wanted = OrderedDict()
+        summaries = [self._lookup(text[start:end], wanted) for start, end in done]
+        summary = self._roll(summaries, wanted)
+        with self._lock:
+            # only what this text needs; summaries of text edited since are no longer wanted
+            self._wanted = wanted
+            start = wanted and not self._running
+            self._running = self._running or bool(start)
+        if start:
+            summary_scheduler.submit(self.drain)
+        return summary, text[done[-1][1] if done else 0:]
+
+    def _lookup(self, text: str, wanted):
+        key = content_key(text)
+        summary = self._summaries.get(key)
+        if summary is None:
+            wanted[key] = text
+        return summary
+
+    def _roll(self, summaries: list, wanted) -> str:
+        # fold the oldest summaries, fanout at a time, until they fit in summary_chars. groups
+        # are counted from the first span, so an earlier group stays the same as the text grows.
+        # the newest fanout summaries are never folded
+        level = summaries
+        while sum(len(s or "") for s in level) > self.summary_chars:
+            groups = (len(level) - self.fanout) // self.fanout
+            if groups <= 0:
+                break
+            folded = []
+            for g in range(groups):
+                group = level[g * self.fanout:(g + 1) * self.fanout]
+                folded.append(None if None in group else self._lookup("\n".join(group), wanted))
+            level = folded + level[groups * self.fanout:]
+        level = [s for s in level if s]
+        # still too long: the oldest are left out
+        while len(level) > 1 and sum(map(len, level)) > self.summary_chars:
+            level.pop(0)
+        return "\n".join(level)
+
+    def drain(self):
+        """
+        summarize the wanted spans, oldest first, until none are left.
+        """
+        while True:
+            with self._lock:
+                if not self._wanted:
+                    self._running = False
+                    return
+                key, text = self._wanted.popitem(last=False)
+            try:
+                summary = self.summarize(text, self.span_summary_chars)
+            except Exception as e:
+                # the span is wanted again by the next split
+                print_to_log("summary of %d characters failed: %r", len(text), e, level=WARNING)
+                continue
+            if not summary:
+                continue
+            print_to_log("summarized %d characters into %d", len(text), len(summary), level=INFO)
+            with self._lock:
+                self._summaries[key] = summary.strip()
+                if self.path:
+                    self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump(self._summaries, file, ensure_ascii=False)
+        os.replace(tmp, self.path)
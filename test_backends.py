@@ -0,0 +1,77 @@
+"""
+async backends driven from the editor: a request that outlives its Tab is cancelled on the
+background loop, not left running.
+"""
+import asyncio
+import time
+
+import copilot as copilot_module
+from backends import Backend, run_sync
+from copilot import OpenAICopilot
+from scheduler import scheduler
+
+
+class SlowBackend(Backend):
+    # answers after `delay` seconds, and records whether the request was cancelled
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.cancelled = []
+
+    async def _complete(self, prompt, max_tokens, temperature, stop, n):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(prompt)
+            raise
+        return "slow"
+
+    async def _stream(self, prompt, max_tokens, temperature, stop):
+        yield await self._complete(prompt, max_tokens, temperature, stop, 1)
+
+
+def make_copilot(delay):
+    copilot = OpenAICopilot(base_url="http://localhost:1/v1")
+    copilot._backend = SlowBackend(delay)
+    return copilot
+
+
+def test_timed_out_request_is_cancelled(monkeypatch):
+    monkeypatch.setattr(copilot_module, "request_timeout", 5.0)
+    copilot = make_copilot(3.0)
+    t0 = time.monotonic()
+    # the Tab's ticket expires first; the request must stop with it
+    ticket = scheduler.submit(copilot.complete, "prompt", timeout=0.2)
+    assert ticket.future.result(timeout=2).value == ""
+    assert time.monotonic() - t0 < 1.0
+    time.sleep(0.05)
+    assert copilot.backend.cancelled == ["prompt"]
+    assert copilot.backend._inflight == {}
+
+
+def test_request_within_timeout(monkeypatch):
+    monkeypatch.setattr(copilot_module, "request_timeout", 5.0)
+    copilot = make_copilot(0.01)
+    assert scheduler.run(copilot.complete, "prompt", timeout=2).value == "slow"
+
+
+def test_run_sync_cancels_on_timeout():
+    backend = SlowBackend(3.0)
+    t0 = time.monotonic()
+    try:
+        run_sync(backend.complete("summary", 10, 0.3), timeout=0.1)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("run_sync did not time out")
+    assert time.monotonic() - t0 < 1.0
+    time.sleep(0.05)
+    assert backend.cancelled == ["summary"]
+
+
+def test_openai_models():
+    assert copilot_module.get_provider("mock") == "openai"
+    assert copilot_module.get_copilot("mock").base_url == "http://localhost:8000/v1"
+    # at a base_url the endpoint decides which models exist
+    copilot = copilot_module.get_copilot("any-local-model", base_url="http://localhost:1/v1")
+    assert isinstance(copilot, OpenAICopilot) and copilot.model == "any-local-model"
@@ -0,0 +1,23 @@
+"""
+batch.find_manuscripts: the manuscripts of a directory, not the editor's own text files.
+"""
+import os
+
+from batch import find_manuscripts
+
+
+def test_directory_of_manuscripts(tmp_path):
+    for name in ("b.txt", "a.txt", "chinese_tokens.txt", "insertion_prompt.txt", "notes.md"):
+        (tmp_path / name).write_text("天地", encoding="utf-8")
+    (tmp_path / "chapters.txt").mkdir()
+    names = lambda files: [os.path.basename(path) for path in files]
+    assert names(find_manuscripts([str(tmp_path)])) == ["a.txt", "b.txt"]
+    assert names(find_manuscripts([str(tmp_path)], "b*")) == ["b.txt"]
+    # a file named on the command line is always taken
+    assert find_manuscripts([str(tmp_path / "notes.md")]) == [str(tmp_path / "notes.md")]
+
+
+def test_repo_root():
+    here = os.path.dirname(os.path.abspath(__file__))
+    found = [os.path.basename(path) for path in find_manuscripts([here])]
+    assert "chinese_tokens.txt" not in found and "insertion_prompt.txt" not in found
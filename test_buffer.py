@@ -0,0 +1,81 @@
+"""
+Buffer: the instruction and passage indexes, updated on each edit, stay equal to ones built
+from the edited text.
+"""
+import random
+
+from editor import Buffer, Cursor
+from instructions import InstructionIndex
+from retrieval import PassageIndex, same_index
+
+
+def random_text(rng, n):
+    pieces = ["天地玄黄", "宇宙洪荒", "。", "\n", "<user>", "</user>", "<", ">", "abc "]
+    return "".join(rng.choice(pieces) for _ in range(n))
+
+
+def random_cursor(rng, buffer):
+    row = rng.randrange(len(buffer))
+    return Cursor(80, row, rng.randrange(len(buffer[row]) + 1))
+
+
+def random_edits(rng, buffer, n):
+    for _ in range(n):
+        cursor = random_cursor(rng, buffer)
+        kind = rng.random()
+        if kind < 0.5:
+            # mostly typing story text, as the fast paths expect
+            buffer.insert(cursor, random_text(rng, 1) if rng.random() < 0.3 else "天")
+        elif kind < 0.6:
+            buffer.split(cursor)
+        elif kind < 0.8:
+            if cursor.col < len(buffer[cursor.row]) or cursor.row < len(buffer) - 1:
+                buffer.delete(cursor)
+        else:
+            other = random_cursor(rng, buffer)
+            start, end = sorted([(cursor.row, cursor.col), (other.row, other.col)])
+            buffer.delete_range(start, end)
+
+
+def check(buffer):
+    cursor = Cursor(80, buffer.bottom, len(buffer[buffer.bottom]))
+    rebuilt = InstructionIndex(list(buffer))
+    assert buffer.instructions.segments(buffer, cursor) == rebuilt.segments(buffer, cursor)
+    assert same_index(buffer.passages, PassageIndex(list(buffer)))
+    for row, text in buffer.passages.search("天地玄黄宇宙洪荒", k=10):
+        assert buffer[row] == text
+
+
+def test_indexes_follow_edits():
+    rng = random.Random(0)
+    buffer = Buffer(random_text(rng, 200).split("\n"))
+    buffer.passages  # indexed from the start
+    for _ in range(20):
+        random_edits(rng, buffer, 100)
+        check(buffer)
+
+
+def test_passages_made_after_edits():
+    rng = random.Random(1)
+    buffer = Buffer(random_text(rng, 200).split("\n"))
+    random_edits(rng, buffer, 500)
+    assert buffer._passages is None
+    check(buffer)
+
+
+def test_edits_inside_tags():
+    buffer = Buffer(["故事<usxer>指令</user>", "天地"])
+    # removing a character joins the text around it into a tag
+    buffer.delete(Cursor(80, 0, 5))
+    check(buffer)
+    assert len(buffer.instructions) == 2
+    # typing inside a tag breaks it
+    buffer.insert(Cursor(80, 0, 4), "天")
+    check(buffer)
+    assert len(buffer.instructions) == 1
+    # and typing the missing characters back makes it again
+    buffer.delete_range((0, 4), (0, 5))
+    buffer.insert(Cursor(80, 1, 2), "<us")
+    buffer.insert(Cursor(80, 1, 5), "er>")
+    check(buffer)
+    assert len(buffer.instructions) == 3
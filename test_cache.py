@@ -0,0 +1,43 @@
+"""
+CompletionCache: Tab again on the same text is answered from the cache, by the response stored
+first or by the alternatives of a candidates batch.
+"""
+from cache import CompletionCache
+
+
+class Provider:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"response {self.calls}"
+
+    def batch(self):
+        self.calls += 1
+        return [f"candidate {i}" for i in range(3)]
+
+
+def test_second_tab_does_not_call():
+    cache, provider = CompletionCache(samples=3), Provider()
+    assert cache.get_or_call("key", provider) == "response 1"
+    assert cache.get_or_call("key", provider) == "response 1"
+    assert cache.get_or_call("key", provider) == "response 1"
+    assert provider.calls == 1
+
+
+def test_tab_cycles_through_candidates():
+    cache, provider = CompletionCache(samples=3), Provider()
+    assert cache.get_many("key", provider.batch, 3) == ["candidate 0", "candidate 1", "candidate 2"]
+    assert [cache.get_or_call("key", provider) for _ in range(4)] == \
+        ["candidate 0", "candidate 1", "candidate 2", "candidate 0"]
+    assert cache.get_many("key", provider.batch, 3) == ["candidate 0", "candidate 1", "candidate 2"]
+    assert provider.calls == 1
+
+
+def test_sqlite_tier(tmp_path):
+    path = str(tmp_path / "cache.db")
+    provider = Provider()
+    CompletionCache(path=path).get_or_call("key", provider)
+    assert CompletionCache(path=path).get_or_call("key", provider) == "response 1"
+    assert provider.calls == 1
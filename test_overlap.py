@@ -0,0 +1,62 @@
+"""
+check_overlap and fuzzy_overlap on random inputs, against a direct slice comparison.
+"""
+import random
+
+from overlap import check_overlap, fuzzy_overlap
+
+
+def slice_overlap(text, response):
+    # the longest length whose slices agree, tried from the longest down
+    for length in range(min(len(text), len(response)), 0, -1):
+        if text[-length:] == response[:length]:
+            return length
+    return 0
+
+
+def random_text(rng, alphabet, max_len):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, max_len)))
+
+
+def perturb(rng, text):
+    # what a model re-emitting a line might change: spaces and punctuation
+    out = []
+    for char in text:
+        if rng.random() < 0.2:
+            out.append(rng.choice([" ", "，", ",", "。", ".", "“", "\t"]))
+        out.append(char)
+    return "".join(out)
+
+
+def test_check_overlap_matches_slices():
+    rng = random.Random(0)
+    for _ in range(5000):
+        # small alphabets make long and repeated overlaps likely
+        alphabet = rng.choice(["ab", "abc", "天地玄", "ab天 ，"])
+        text = random_text(rng, alphabet, 30)
+        response = random_text(rng, alphabet, 30)
+        if rng.random() < 0.5 and text:
+            response = text[rng.randrange(len(text)):] + response
+        expected = slice_overlap(text, response)
+        assert check_overlap(text, response) == expected, (text, response)
+        if " " not in alphabet:
+            # without whitespace or punctuation the fuzzy overlap is the exact one, or 0 below min_len
+            fuzzy = fuzzy_overlap(text, response)
+            assert fuzzy == (expected if expected >= 4 else 0), (text, response, fuzzy)
+
+
+def test_fuzzy_overlap_strips_reemitted_line():
+    rng = random.Random(1)
+    for _ in range(5000):
+        # the line is re-emitted with different spacing and punctuation
+        story = random_text(rng, "abc", 20)
+        line = random_text(rng, "天地玄黄", 12) + "甲"
+        rest = "a" + random_text(rng, "abc天地", 12)
+        response = perturb(rng, line) + rest
+        if len(line) >= 4:
+            assert response[fuzzy_overlap(story + line, response):] == rest, (story + line, response)
+
+
+def test_trailing_punctuation_counted():
+    assert fuzzy_overlap("他说：天地玄黄。", "天地 玄黄。  新的一段") == len("天地 玄黄。  ")
+    assert fuzzy_overlap("天地玄黄", "宇宙洪荒") == 0
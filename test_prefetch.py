@@ -0,0 +1,80 @@
+"""
+Prefetcher: a prefetch still on its way is only followed by Tab at the text and cursor it was
+made for.
+"""
+import threading
+
+from ai_editor import AsyncCopilot, Prefetcher
+from bench_render import FakeScreen
+from editor import Buffer, Editor
+
+
+class SlowCopilot:
+    # answers with the offset the request was made at, once released
+    def __init__(self):
+        self.release = threading.Event()
+
+    def context(self, buffer, cursor):
+        return {"offset": buffer.offset(cursor)}
+
+    def candidates(self, offset):
+        self.release.wait(5)
+        return [f"<completion for offset {offset}>"]
+
+
+def make_editor(text):
+    editor = Editor(FakeScreen(), "")
+    editor.buffer = Buffer(text.split("\n"))
+    editor.draft_len = 0
+    editor.drafts = []
+    return editor
+
+
+def prefetch(editor, copilot):
+    prefetcher = Prefetcher(copilot, idle_ms=0, timeout=5)
+    prefetcher.maybe_prefetch(editor)
+    assert prefetcher.current is not None
+    return prefetcher
+
+
+def test_moved_cursor_drops_inflight_prefetch():
+    copilot = SlowCopilot()
+    editor = make_editor("第一段文字。")
+    editor.goto_bottom()
+    prefetcher = prefetch(editor, copilot)
+    ticket = prefetcher.current[0]
+    worker = AsyncCopilot(copilot)
+
+    editor.goto(0, 2)  # no edit: the buffer version stays the same
+    assert not prefetcher.take(editor, worker)
+    assert prefetcher.current is None and worker.pending is None
+    copilot.release.set()
+    ticket.result()
+    assert "\n".join(editor.buffer) == "第一段文字。"
+
+
+def test_inflight_prefetch_followed_at_same_cursor():
+    copilot = SlowCopilot()
+    editor = make_editor("第一段文字。")
+    editor.goto_bottom()
+    prefetcher = prefetch(editor, copilot)
+    worker = AsyncCopilot(copilot)
+
+    assert prefetcher.take(editor, worker)
+    copilot.release.set()
+    worker.pending.ticket.result()
+    assert worker.poll(editor)
+    assert "\n".join(editor.buffer) == "第一段文字。<completion for offset 6>"
+
+
+def test_moved_cursor_prefetches_again():
+    copilot = SlowCopilot()
+    editor = make_editor("第一段文字。")
+    editor.goto_bottom()
+    prefetcher = prefetch(editor, copilot)
+    first = prefetcher.current[0]
+    editor.goto(0, 2)
+    prefetcher.inflight = []  # room for another request
+    prefetcher.maybe_prefetch(editor)
+    assert prefetcher.current[0] is not first and prefetcher.current[2] == 2
+    copilot.release.set()
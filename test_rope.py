@@ -0,0 +1,109 @@
+"""
+LineRope and the Buffer built on it, against a plain list of lines. a small chunk load makes
+every edit cross chunk boundaries and re-chunk.
+"""
+import random
+
+import pytest
+
+from editor import Buffer, Cursor
+from rope import Fenwick, LineRope
+
+
+def random_line(rng):
+    return "".join(rng.choice("天地玄黄ab ") for _ in range(rng.randint(0, 8)))
+
+
+def check(rope, lines):
+    assert len(rope) == len(lines)
+    assert list(rope) == lines
+    text = "\n".join(lines)
+    assert rope.n_chars == len(text)
+    offset = 0
+    for row, line in enumerate(lines):
+        assert rope[row] == line
+        assert rope.offset(row) == offset
+        offset += len(line) + 1
+
+
+def test_fenwick():
+    values = [3, 0, 5, 1, 2]
+    tree = Fenwick(values)
+    tree.add(1, 4)
+    values[1] += 4
+    assert [tree.prefix_sum(i) for i in range(6)] == [0, 3, 7, 12, 13, 15]
+    assert tree.total == 15
+    assert tree.search(0) == (0, 0) and tree.search(3) == (1, 0) and tree.search(14) == (4, 1)
+
+
+def test_replace_across_chunks():
+    rng = random.Random(0)
+    lines = [random_line(rng) for _ in range(40)]
+    rope = LineRope(lines, load=4)
+    for _ in range(2000):
+        row = rng.randrange(len(lines) + 1)
+        count = rng.randrange(min(12, len(lines) - row) + 1)
+        new = [random_line(rng) for _ in range(rng.choice([0, 1, 1, 2, 9]))]
+        if row == len(lines) and not new:
+            continue
+        rope.replace(row, count, new)
+        lines[row:row + count] = new
+        if rng.random() < 0.3 and lines:
+            # in-place edits between replaces: their character counts are held back
+            row = rng.randrange(len(lines))
+            col = rng.randrange(len(lines[row]) + 1)
+            assert rope.splice(row, col, col, "字") == lines[row][:col] + "字" + lines[row][col:]
+            lines[row] = rope[row]
+            rope[-1] = lines[-1] = random_line(rng)
+        check(rope, lines)
+    assert all(len(chunk) <= 2 * rope.load for chunk in rope._chunks)
+
+
+def test_offset_position_round_trip():
+    rng = random.Random(1)
+    lines = [random_line(rng) for _ in range(50)]
+    rope = LineRope(lines, load=4)
+    text = "\n".join(lines)
+    for offset in range(len(text) + 1):
+        row, col = rope.position(offset)
+        assert rope.offset(row) + col == offset
+        assert "\n".join(lines[:row] + [lines[row][:col]]) == text[:offset]
+    assert rope.position(-5) == (0, 0)
+    assert rope.position(len(text) + 5) == (len(lines) - 1, len(lines[-1]))
+
+
+def test_negative_indices_and_slices():
+    lines = [str(i) for i in range(11)]
+    rope = LineRope(lines, load=3)
+    assert rope[-1] == "10" and rope[-11] == "0"
+    rope[-2] = "nine"
+    lines[-2] = "nine"
+    for index in (slice(None), slice(2, 9), slice(-4, None), slice(5, 2), slice(1, 10, 3), slice(None, None, -1)):
+        assert rope[index] == lines[index]
+    assert list(rope.iter_from(4, 8)) == lines[4:8]
+    assert rope.pop(-1) == "10"
+    rope.insert(0, "start")
+    assert list(rope) == ["start"] + lines[:-1]
+    for index in (11, -12):
+        with pytest.raises(IndexError):
+            rope[index]
+    with pytest.raises(IndexError):
+        rope.replace(5, 20, [])
+
+
+def test_buffer_text_against_lines():
+    rng = random.Random(2)
+    lines = [random_line(rng) for _ in range(60)]
+    buffer = Buffer(list(lines))
+    buffer.lines = LineRope(lines, load=4)
+    text = "\n".join(lines)
+    for _ in range(300):
+        row = rng.randrange(len(lines))
+        cursor = Cursor(80, row, rng.randrange(len(lines[row]) + 1))
+        offset = len("\n".join(lines[:row] + [lines[row][:cursor.col]]))
+        n = rng.randrange(40)
+        assert buffer.offset(cursor) == offset
+        assert buffer.prefix(cursor) == text[:offset]
+        assert buffer.suffix(cursor) == text[offset:]
+        assert buffer.tail(cursor, n) == text[max(offset - n, 0):offset]
+        assert buffer.head(cursor, n) == text[offset:offset + n]
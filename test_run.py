@@ -0,0 +1,72 @@
+"""
+run.get_client: every client kind is built with the configured pool, against both the
+together 1.x constructor (no http_client) and the 2.x one.
+"""
+import sys
+import types
+
+import pytest
+
+import run
+
+
+class FakeHttpClient:
+    def __init__(self, limits=None, timeout=None):
+        self.limits, self.timeout = limits, timeout
+
+
+def fake_httpx():
+    module = types.ModuleType("httpx")
+    module.Limits = lambda **kwargs: kwargs
+    module.Client = type("Client", (FakeHttpClient,), {})
+    module.AsyncClient = type("AsyncClient", (FakeHttpClient,), {})
+    return module
+
+
+class Together1:
+    # the together 1.x constructor
+    def __init__(self, api_key=None, base_url=None, timeout=None, max_retries=None, supplied_headers=None):
+        self.timeout, self.max_retries = timeout, max_retries
+
+
+class Together2:
+    def __init__(self, api_key=None, base_url=None, timeout=None, max_retries=None, http_client=None):
+        self.timeout, self.max_retries, self.http_client = timeout, max_retries, http_client
+
+
+class OpenAI:
+    def __init__(self, api_key=None, base_url=None, max_retries=None, http_client=None):
+        self.base_url, self.http_client = base_url, http_client
+
+
+def fake_module(name, **classes):
+    module = types.ModuleType(name)
+    for key, cls in classes.items():
+        setattr(module, key, type(key, (cls,), {}))
+    return module
+
+
+@pytest.fixture
+def sdks(monkeypatch):
+    monkeypatch.setitem(sys.modules, "httpx", fake_httpx())
+    monkeypatch.setitem(sys.modules, "openai", fake_module("openai", OpenAI=OpenAI, AsyncOpenAI=OpenAI))
+    run.configure_clients(max_connections=7)
+    yield monkeypatch
+    run.configure_clients(max_connections=10)
+
+
+@pytest.mark.parametrize("together", [Together1, Together2])
+def test_every_client_kind_is_built(sdks, together):
+    sdks.setitem(sys.modules, "together", fake_module("together", Together=together, AsyncTogether=together))
+    for kind in ("together", "async_together", "openai", "async_openai"):
+        client = run.get_client(kind)
+        assert run.get_client(kind) is client
+        if kind.endswith("openai") or together is Together2:
+            assert client.http_client.limits["max_connections"] == 7
+            assert type(client.http_client).__name__ == ("AsyncClient" if kind.startswith("async") else "Client")
+    assert run.get_client("together").max_retries == run.client_config["max_retries"]
+
+
+def test_unknown_kind(sdks):
+    with pytest.raises(ValueError):
+        run.get_client("nope")
@@ -0,0 +1,42 @@
+"""
+RequestScheduler: a request run from inside another one runs inline and still honours its own
+timeout and the outer request's deadline.
+"""
+import time
+
+from scheduler import OK, TIMEOUT, RequestScheduler
+
+
+def test_nested_run_times_out():
+    scheduler = RequestScheduler(max_workers=1)
+
+    def outer():
+        return scheduler.run(time.sleep, 0.2, timeout=0.05)
+
+    result = scheduler.run(outer, timeout=5)
+    assert result.ok
+    assert result.value.status == TIMEOUT
+
+
+def test_nested_run_within_timeout():
+    scheduler = RequestScheduler(max_workers=1)
+
+    def outer():
+        return scheduler.run(lambda: "done", timeout=1)
+
+    result = scheduler.run(outer, timeout=5)
+    assert result.value.status == OK and result.value.value == "done"
+
+
+def test_nested_run_after_outer_deadline_is_not_started():
+    scheduler = RequestScheduler(max_workers=1)
+    calls = []
+
+    def outer():
+        time.sleep(0.1)
+        # the outer deadline has passed: a longer timeout of its own does not help
+        return scheduler.run(calls.append, 1, timeout=10), scheduler.remaining(10)
+
+    ticket = scheduler.submit(outer, timeout=0.05)
+    nested, remaining = ticket.future.result().value
+    assert nested.status == TIMEOUT and calls == [] and remaining == 0.0
@@ -0,0 +1,31 @@
+"""
+Summarizer: missing summaries are computed on a worker of their own, so a slow one leaves the
+shared scheduler free for Tab requests.
+"""
+import threading
+
+from scheduler import scheduler
+from summaries import Summarizer
+
+
+def test_drain_leaves_tab_workers_free():
+    release = threading.Event()
+    threads = []
+
+    def summarize(text, max_chars):
+        threads.append(threading.current_thread().name)
+        release.wait(5)
+        return "概括"
+
+    summarizer = Summarizer(summarize, window=10, max_span_chars=100)
+    text = "\n".join(f"第{i}章\n" + "天地玄黄" * 20 for i in range(1, 4))
+    summary, recent = summarizer.split(text)
+    assert summary == "" and summarizer.busy()
+    # every Tab worker can still be used while the summaries wait
+    tickets = [scheduler.submit(lambda: "tab", timeout=1) for _ in range(scheduler.max_workers)]
+    assert [ticket.result().value for ticket in tickets] == ["tab"] * scheduler.max_workers
+    release.set()
+    while summarizer.busy():
+        threading.Event().wait(0.01)
+    assert threads and all(name.startswith("summaries") for name in threads)
+    assert summarizer.split(text)[0]
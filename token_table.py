@@ -0,0 +1,190 @@
+"""
+compact binary token table, memory-mapped at runtime.
+
+build it from the tokenizer dump once (the notebook writes chinese_tokens.txt):
+    python token_table.py                      # chinese_tokens.txt -> chinese_tokens.bin
+    python token_table.py --check chinese_tokens.pkl
+
+layout (all integers little-endian uint32):
+    magic b"TOKT", version, count, blob size
+    offsets[count + 1]   byte offsets of each token text in the blob
+    ids[count]           token ids
+    blob                 utf-8 token texts, sorted
+
+utf-8 byte order is code point order, so the tokens extending a prefix are one contiguous
+range of the table, found by binary search on the raw bytes. that range is exactly the
+notebook's unstable_tokens[prefix], without materialising a dict of sets.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"TOKT"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_txt = os.path.join(here, "chinese_tokens.txt")
+default_table = os.path.join(here, "chinese_tokens.bin")
+
+
+def read_token_txt(path: str) -> dict:
+    """
+    parse the "id<TAB>text" dump. token texts may themselves contain newlines, so an entry
+    runs until the next line that starts with "id<TAB>".
+    """
+    import re
+    with open(path, encoding="utf-8", newline="") as f:
+        data = f.read()
+    starts = list(re.finditer(r"^(\d+)\t", data, flags=re.MULTILINE))
+    tokens = {}
+    for m, nxt in zip(starts, starts[1:] + [None]):
+        end = nxt.start() if nxt is not None else len(data)
+        tokens[int(m.group(1))] = data[m.end():end - 1]
+    return tokens
+
+
+def write_token_table(tokens: dict, path: str):
+    items = sorted((text.encode("utf-8"), idx) for idx, text in tokens.items() if text)
+    offsets = array("I", [0])
+    ids = array("I")
+    blob = bytearray()
+    for text, idx in items:
+        blob += text
+        offsets.append(len(blob))
+        ids.append(idx)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+        ids.byteswap()
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(items), len(blob)))
+        f.write(offsets.tobytes())
+        f.write(ids.tobytes())
+        f.write(blob)
+
+
+class TokenTable:
+    """
+    read-only view of a token table file. nothing is decoded until a query touches it.
+    """
+
+    def __init__(self, path: str = default_table):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, blob_size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} token table")
+        self.count = count
+        start = HEADER.size
+        self._offsets = self._uint32(start, count + 1)
+        start += 4 * (count + 1)
+        self._ids = self._uint32(start, count)
+        self._blob = start + 4 * count
+
+    def _uint32(self, start, n):
+        view = memoryview(self._mm)[start:start + 4 * n]
+        if sys.byteorder == "little":
+            return view.cast("I")
+        values = array("I", view)
+        values.byteswap()
+        return values
+
+    def __len__(self):
+        return self.count
+
+    def _text(self, i: int) -> bytes:
+        return self._mm[self._blob + self._offsets[i]:self._blob + self._offsets[i + 1]]
+
+    def texts(self) -> list:
+        # every token text, decoded
+        return [self._text(i).decode("utf-8") for i in range(self.count)]
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._text(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, prefix: str, proper: bool):
+        key = prefix.encode("utf-8")
+        lo = self._lower_bound(key)
+        # no utf-8 byte is 0xff, so this sorts after every string starting with key
+        hi = self._lower_bound(key + b"\xff")
+        if proper:
+            while lo < hi and self._offsets[lo + 1] - self._offsets[lo] == len(key):
+                lo += 1
+        return lo, hi
+
+    def candidates(self, prefix: str, proper: bool = False) -> list:
+        """
+        (id, text) of every token starting with prefix; with proper=True, only tokens longer than it.
+        """
+        lo, hi = self._range(prefix, proper)
+        return [(self._ids[i], self._text(i).decode("utf-8")) for i in range(lo, hi)]
+
+    def is_unstable(self, prefix: str) -> bool:
+        # prefix is a proper prefix of at least one token
+        lo, hi = self._range(prefix, proper=True)
+        return lo < hi
+
+    def unstable_tail(self, text: str, max_len: int = 4) -> str:
+        """
+        the longest suffix of text (at most max_len characters) that some token extends,
+        i.e. the text may end in the middle of that token. empty if there is none.
+        """
+        for length in range(min(max_len, len(text)), 0, -1):
+            tail = text[-length:]
+            if self.is_unstable(tail):
+                return tail
+        return ""
+
+
+_table = None
+
+def load_token_table(path: str = default_table, txt: str = default_txt) -> TokenTable:
+    """
+    the shared TokenTable, opened on first use. the table is built from the text dump if missing.
+    """
+    global _table
+    if _table is None:
+        if not os.path.exists(path):
+            write_token_table(read_token_txt(txt), path)
+        _table = TokenTable(path)
+    return _table
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txt", type=str, default=default_txt)
+    parser.add_argument("--out", type=str, default=default_table)
+    parser.add_argument("--check", type=str, default=None,
+                        help="pickled {id: text} dict to verify the table against")
+    args = parser.parse_args()
+
+    tokens = read_token_txt(args.txt)
+    write_token_table(tokens, args.out)
+    table = TokenTable(args.out)
+    print(f"wrote {len(table)} tokens to {args.out} ({os.path.getsize(args.out)} bytes)")
+
+    if args.check:
+        import pickle
+        from token_trie import TokenTrie
+        with open(args.check, "rb") as f:
+            expected = pickle.load(f)
+        assert tokens == expected, "token dump and pickle disagree"
+        trie = TokenTrie(expected)
+        prefixes = {text[:i] for text in expected.values() for i in range(1, len(text) + 1)}
+        for prefix in prefixes:
+            assert sorted(table.candidates(prefix, proper=True)) == sorted(trie.candidates(prefix, proper=True)), prefix
+        print(f"checked {len(prefixes)} prefixes against {args.check}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class TokenTrie:
+    """
+    character trie over token strings, used to find the tokens a prompt may end in the middle of.
+
+    tokens are kept in one sorted array; because a depth-first walk of the trie visits strings
+    in sorted order, every node only stores the [lo, hi) range of tokens below it instead of
+    its own token set. the candidates extending a prefix are then a slice of the array.
+    """
+
+    def __init__(self, tokens: Dict[int, str]):
+        items = sorted((text, idx) for idx, text in tokens.items() if text)
+        self.texts: List[str] = [text for text, _ in items]
+        self.ids: List[int] = [idx for _, idx in items]
+        self._children: List[Dict[str, int]] = [{}]
+        self._lo: List[int] = [0]
+        self._hi: List[int] = [len(items)]
+        self._depth: List[int] = [0]
+        for i, text in enumerate(self.texts):
+            node = 0
+            for char in text:
+                child = self._children[node].get(char)
+                if child is None:
+                    child = len(self._children)
+                    self._children[node][char] = child
+                    self._children.append({})
+                    self._lo.append(i)
+                    self._hi.append(i)
+                    self._depth.append(self._depth[node] + 1)
+                node = child
+                self._hi[node] = i + 1
+
+    def __len__(self):
+        return len(self.texts)
+
+    def walk(self, prefix: str) -> Optional[int]:
+        node = 0
+        for char in prefix:
+            node = self._children[node].get(char)
+            if node is None:
+                return None
+        return node
+
+    def candidates(self, prefix: str, proper: bool = False) -> List[Tuple[int, str]]:
+        """
+        (id, text) of every token starting with prefix; with proper=True, only tokens longer than it.
+        """
+        node = self.walk(prefix)
+        if node is None:
+            return []
+        lo, hi = self._lo[node], self._hi[node]
+        if proper:
+            # tokens equal to the prefix sort first in the range
+            while lo < hi and len(self.texts[lo]) == len(prefix):
+                lo += 1
+        return list(zip(self.ids[lo:hi], self.texts[lo:hi]))
+
+    def is_unstable(self, prefix: str) -> bool:
+        # prefix is a proper prefix of at least one token
+        node = self.walk(prefix)
+        return node is not None and bool(self._children[node])
+
+    def unstable_tail(self, text: str, max_len: int = 4) -> str:
+        """
+        the longest suffix of text (at most max_len characters) that some token extends,
+        i.e. the text may end in the middle of that token. empty if there is none.
+        """
+        for length in range(min(max_len, len(text)), 0, -1):
+            tail = text[-length:]
+            if self.is_unstable(tail):
+                return tail
+        return ""